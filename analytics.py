@@ -0,0 +1,158 @@
+import os
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+import historico
+import ledger
+import tiendas
+from totales import EXCLUIR_ESTADO
+
+COLUMNAS = ["fecha", "hora", "proveedor", "monto", "pagado"]
+
+# (tienda, mes) -> (versión del ledger, DataFrame); se recalcula solo si el mes cambió
+_frames = {}
+
+# (tienda, tupla de meses) -> (versiones, DataFrame concatenado)
+_combinados = {}
+
+def _armar_frame(filas):
+    """Tuplas del ledger -> DataFrame tipado (fechas, hora entera, categorías)"""
+    df = pd.DataFrame.from_records(filas, columns=COLUMNAS)
+    df["fecha"] = pd.to_datetime(df["fecha"], format="%Y-%m-%d", errors="coerce")
+    df["hora"] = pd.to_numeric(df["hora"].str.slice(0, 2), errors="coerce").astype("Int8")
+    df["proveedor"] = df["proveedor"].astype("category")
+    df["monto"] = df["monto"].astype("float64")
+    df["pagado"] = df["pagado"].str.lower().eq("true")
+    return df
+
+def _cerrado(mes):
+    """Mes pasado y sin nada pendiente en el ledger: se lee del snapshot"""
+    return mes < datetime.now().strftime("%Y-%m") and ledger.mes_replicado(mes)
+
+def _version(mes):
+    if _cerrado(mes):
+        return ("snapshot", os.path.getmtime(historico.asegurar_snapshot(mes)))
+    return ledger.version(mes)
+
+def frame_mes(mes):
+    version = _version(mes)
+    clave = (tiendas.actual(), mes)
+    cacheado = _frames.get(clave)
+    if cacheado and cacheado[0] == version:
+        return cacheado[1]
+
+    if isinstance(version, tuple):
+        df = historico.frame_cerrado(mes)
+    else:
+        df = _armar_frame([tuple(f) for f in ledger.filas_mes(mes)])
+    _frames[clave] = (version, df)
+    return df
+
+def ultimos_meses(n, hasta=None):
+    """Los `n` meses (%Y-%m) que terminan en `hasta` (el actual por defecto)"""
+    hasta = hasta or date.today()
+    base = hasta.year * 12 + hasta.month - 1
+    return [f"{m // 12:04d}-{m % 12 + 1:02d}" for m in range(base - n + 1, base + 1)]
+
+def frame(meses=None):
+    """Movimientos de los meses pedidos (el actual por defecto)"""
+    meses = tuple(meses or [datetime.now().strftime("%Y-%m")])
+    if len(meses) == 1:
+        return frame_mes(meses[0])
+
+    versiones = tuple(_version(m) for m in meses)
+    clave = (tiendas.actual(), meses)
+    cacheado = _combinados.get(clave)
+    if cacheado and cacheado[0] == versiones:
+        return cacheado[1]
+
+    df = pd.concat([frame_mes(m) for m in meses], ignore_index=True)
+    df["proveedor"] = df["proveedor"].astype("category")
+    _combinados[clave] = (versiones, df)
+    return df
+
+def _caja(df):
+    """Sin Mercadería/Desperdicio, que no son movimientos de caja"""
+    return df[~df["proveedor"].isin(EXCLUIR_ESTADO)]
+
+def totales_periodo(df, desde=None, hasta=None):
+    """Ingreso, egreso y saldo de caja entre dos fechas (inclusive)"""
+    caja = _caja(df)
+    mascara = np.ones(len(caja), dtype=bool)
+    if desde is not None:
+        mascara &= (caja["fecha"] >= pd.Timestamp(desde)).to_numpy()
+    if hasta is not None:
+        mascara &= (caja["fecha"] <= pd.Timestamp(hasta)).to_numpy()
+
+    montos = caja["monto"].to_numpy()[mascara]
+    ingreso = montos[montos > 0].sum()
+    egreso = abs(montos[montos < 0].sum())
+    return {
+        "ingreso": float(ingreso),
+        "egreso": float(egreso),
+        "saldo": float(ingreso - egreso)
+    }
+
+def por_proveedor(df):
+    """Egresos por proveedor, de mayor a menor"""
+    egresos = _caja(df)
+    egresos = egresos[(egresos["monto"] < 0) & (egresos["proveedor"] != "cliente")]
+    return (
+        egresos.groupby("proveedor", observed=True)["monto"]
+        .sum()
+        .abs()
+        .sort_values(ascending=False)
+    )
+
+def por_hora(df):
+    """Ventas de clientes por hora del día: suma y cantidad"""
+    ventas = df[df["proveedor"] == "cliente"].dropna(subset=["hora"])
+    return (
+        ventas.groupby(ventas["hora"].astype(int))["monto"]
+        .agg(["sum", "count"])
+        .sort_index()
+    )
+
+def por_dia(df, proveedor=None):
+    """Serie diaria de montos (todos, o de un proveedor)"""
+    if proveedor is not None:
+        df = df[df["proveedor"] == proveedor]
+    return df.groupby("fecha")["monto"].sum().sort_index()
+
+def resumen_mensual(df):
+    """Ingreso, egreso y saldo de caja por mes"""
+    caja = _caja(df)
+    meses = caja["fecha"].dt.to_period("M")
+    montos = caja["monto"]
+    tabla = pd.DataFrame({
+        "ingreso": montos.clip(lower=0).groupby(meses).sum(),
+        "egreso": montos.clip(upper=0).groupby(meses).sum().abs()
+    })
+    tabla["saldo"] = tabla["ingreso"] - tabla["egreso"]
+    return tabla.sort_index()
+
+def ultimos_12_meses():
+    return resumen_mensual(frame(ultimos_meses(12)))
+
+def interanual(hoy=None):
+    """Mes en curso hasta hoy contra el mismo tramo del año anterior"""
+    hoy = hoy or date.today()
+    try:
+        hace_un_anio = hoy.replace(year=hoy.year - 1)
+    except ValueError:  # 29 de febrero
+        hace_un_anio = hoy.replace(year=hoy.year - 1, day=28)
+
+    actual = totales_periodo(
+        frame([hoy.strftime("%Y-%m")]), desde=hoy.replace(day=1), hasta=hoy
+    )
+    anterior = totales_periodo(
+        frame([hace_un_anio.strftime("%Y-%m")]), desde=hace_un_anio.replace(day=1), hasta=hace_un_anio
+    )
+
+    variacion = {
+        clave: (actual[clave] / anterior[clave] - 1) * 100 if anterior[clave] else None
+        for clave in actual
+    }
+    return actual, anterior, variacion
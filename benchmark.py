@@ -0,0 +1,380 @@
+"""
+Benchmark offline del bot: planilla de Google en memoria (con latencia y
+errores 429 configurables) y tráfico sintético contra los handlers reales.
+
+    python benchmark.py --segundos 30 --ritmo 5 --latencia 300 --error 0.02
+
+No usa red ni credenciales; el ledger y las métricas van a un directorio
+temporal. Con --json se guarda el resultado para comparar entre corridas.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+import gspread
+import requests
+from gspread.utils import a1_to_rowcol
+
+# ---------------------------------------------------------------------------
+# Planilla falsa (mismo subconjunto de la API de gspread que usa el bot)
+# ---------------------------------------------------------------------------
+
+class Backend:
+    """Latencia, errores de cuota y contador de llamadas compartidos"""
+
+    def __init__(self, latencia=0.2, jitter=0.1, error=0.0, semilla=None):
+        self.latencia = latencia
+        self.jitter = jitter
+        self.error = error
+        self.azar = random.Random(semilla)
+        self.llamadas = Counter()
+        self.errores = Counter()
+        self.lock = threading.Lock()
+
+    def llamar(self, metodo):
+        with self.lock:
+            self.llamadas[metodo] += 1
+            demora = max(0.0, self.azar.gauss(self.latencia, self.jitter * self.latencia))
+            falla = self.azar.random() < self.error
+        time.sleep(demora)
+        if falla:
+            with self.lock:
+                self.errores[metodo] += 1
+            raise gspread.exceptions.APIError(_respuesta_429())
+
+def _respuesta_429():
+    respuesta = requests.Response()
+    respuesta.status_code = 429
+    respuesta._content = json.dumps({
+        "error": {"code": 429, "message": "Quota exceeded (simulado)", "status": "RESOURCE_EXHAUSTED"}
+    }).encode()
+    return respuesta
+
+class HojaFalsa:
+    def __init__(self, planilla, titulo, id_hoja):
+        self.spreadsheet = planilla
+        self.title = titulo
+        self.id = id_hoja
+        self.filas = []
+        self._backend = planilla.backend
+
+    def _rango(self, desde, hasta):
+        return f"'{self.title}'!A{desde}:E{hasta}"
+
+    def append_row(self, valores, **kwargs):
+        self._backend.llamar("append_row")
+        self.filas.append([str(v) for v in valores])
+
+    def append_rows(self, valores, **kwargs):
+        self._backend.llamar("append_rows")
+        desde = len(self.filas) + 1
+        self.filas.extend([str(v) for v in fila] for fila in valores)
+        return {"updates": {"updatedRange": self._rango(desde, len(self.filas))}}
+
+    def batch_update(self, datos, **kwargs):
+        self._backend.llamar("batch_update")
+        for cambio in datos:
+            fila, col = a1_to_rowcol(cambio["range"])
+            self.filas[fila - 1][col - 1] = str(cambio["values"][0][0])
+
+    def get_values(self, rango=None, **kwargs):
+        self._backend.llamar("get_values")
+        if not rango:
+            return [list(f) for f in self.filas]
+        inicio, _, fin = rango.partition(":")
+        desde = int("".join(c for c in inicio if c.isdigit()))
+        hasta = "".join(c for c in fin if c.isdigit())
+        return [list(f) for f in self.filas[desde - 1:int(hasta) if hasta else None]]
+
+    def get_all_values(self, **kwargs):
+        self._backend.llamar("get_all_values")
+        return [list(f) for f in self.filas]
+
+    def get_all_records(self, **kwargs):
+        self._backend.llamar("get_all_records")
+        if not self.filas:
+            return []
+        encabezado = self.filas[0]
+        return [dict(zip(encabezado, f)) for f in self.filas[1:]]
+
+class PlanillaFalsa:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hojas = {}
+
+    def worksheet(self, titulo):
+        self.backend.llamar("worksheet")
+        if titulo not in self.hojas:
+            raise gspread.WorksheetNotFound(titulo)
+        return self.hojas[titulo]
+
+    def add_worksheet(self, title, rows=None, cols=None):
+        self.backend.llamar("add_worksheet")
+        self.hojas[title] = HojaFalsa(self, title, len(self.hojas) + 1)
+        return self.hojas[title]
+
+    def batch_update(self, cuerpo):
+        self.backend.llamar("spreadsheet.batch_update")
+        for pedido in cuerpo["requests"]:
+            rango = pedido["deleteDimension"]["range"]
+            hoja = next(h for h in self.hojas.values() if h.id == rango["sheetId"])
+            del hoja.filas[rango["startIndex"]:rango["endIndex"]]
+
+    def get_lastUpdateTime(self):
+        self.backend.llamar("get_lastUpdateTime")
+        return "simulado"
+
+class ClienteFalso:
+    def __init__(self, backend):
+        self.planilla = PlanillaFalsa(backend)
+
+    def set_timeout(self, segundos):
+        pass
+
+    def open(self, nombre):
+        self.planilla.backend.llamar("open")
+        return self.planilla
+
+    create = open
+
+def instalar(backend):
+    """Reemplaza la autenticación de Google (antes de que el bot la use)"""
+    from google.oauth2.service_account import Credentials
+
+    cliente = ClienteFalso(backend)
+    Credentials.from_service_account_file = staticmethod(lambda *a, **k: None)
+    gspread.authorize = lambda credenciales: cliente
+    return cliente
+
+# ---------------------------------------------------------------------------
+# Updates sintéticos de Telegram
+# ---------------------------------------------------------------------------
+
+CHAT_ID = 1000
+_ids = iter(range(1, 10 ** 9))
+
+class Respuestas:
+    """Guarda lo último que el bot mostró, para seguir la conversación"""
+
+    def __init__(self):
+        self.texto = None
+        self.teclado = None
+        self.mensaje_id = next(_ids)  # El mensaje del bot que se va editando
+
+    async def __call__(self, texto, reply_markup=None, **kwargs):
+        self.texto = texto
+        self.teclado = reply_markup
+
+    def botones(self):
+        if self.teclado is None:
+            return []
+        return [b.callback_data for fila in self.teclado.inline_keyboard for b in fila]
+
+
+def update_mensaje(texto, respuestas, cajero):
+    return SimpleNamespace(
+        message=SimpleNamespace(text=texto, reply_text=respuestas, message_id=next(_ids)),
+        effective_chat=SimpleNamespace(id=CHAT_ID),
+        effective_user=SimpleNamespace(id=cajero)
+    )
+
+def update_boton(data, respuestas, cajero):
+    async def answer(*args, **kwargs):
+        pass
+
+    return SimpleNamespace(
+        callback_query=SimpleNamespace(
+            id=str(next(_ids)), data=data, answer=answer, edit_message_text=respuestas,
+            message=SimpleNamespace(chat=SimpleNamespace(id=CHAT_ID), message_id=respuestas.mensaje_id),
+            from_user=SimpleNamespace(id=cajero)
+        ),
+        effective_chat=SimpleNamespace(id=CHAT_ID),
+        effective_user=SimpleNamespace(id=cajero)
+    )
+
+# ---------------------------------------------------------------------------
+# Escenarios
+# ---------------------------------------------------------------------------
+
+class Corrida:
+    def __init__(self, handlers, azar, cajeros=3):
+        self.handlers = handlers
+        self.azar = azar
+        self.cajeros = cajeros
+        self.latencias = defaultdict(list)
+        self.fallidos = Counter()
+
+    async def _enviar(self, tipo, update, es_boton):
+        funcion = self.handlers.manejar_boton if es_boton else self.handlers.manejar_mensaje
+        inicio = time.perf_counter()
+        try:
+            await funcion(update, None)
+        except Exception:
+            self.fallidos[tipo] += 1
+        self.latencias[tipo].append(time.perf_counter() - inicio)
+
+    def _cajero(self):
+        return self.azar.randrange(self.cajeros)
+
+    def _monto(self):
+        # Con centavos, para no caer en el anti-duplicados del handler
+        return f"{self.azar.uniform(500, 30000):.2f}"
+
+    async def venta(self, cajero=None):
+        respuestas = Respuestas()
+        cajero = self._cajero() if cajero is None else cajero
+        await self._enviar("venta", update_mensaje(self._monto(), respuestas, cajero), False)
+        return respuestas
+
+    async def pago_proveedor(self):
+        cajero = self._cajero()
+        respuestas = await self.venta(cajero)
+        monto = next((b for b in respuestas.botones() if b.startswith("p:")), None)
+        if monto is None:
+            return
+        await self._enviar("menu_proveedor", update_boton(monto, respuestas, cajero), True)
+        opciones = [b for b in respuestas.botones() if b.startswith(("v:", "a:"))]
+        if opciones:
+            await self._enviar("egreso", update_boton(self.azar.choice(opciones), respuestas, cajero), True)
+
+    async def deshacer(self):
+        cajero = self._cajero()
+        respuestas = await self.venta(cajero)
+        eliminar = next((b for b in respuestas.botones() if b.startswith("e:")), None)
+        if eliminar:
+            await self._enviar("eliminar", update_boton(eliminar, respuestas, cajero), True)
+
+    async def saldar(self):
+        cajero = self._cajero()
+        respuestas = Respuestas()
+        await self._enviar("menu_pagar", update_boton("m:pagar", respuestas, cajero), True)
+        opciones = respuestas.botones()
+        if opciones:
+            await self._enviar("pagar_proveedor", update_boton(self.azar.choice(opciones), respuestas, cajero), True)
+
+ESCENARIOS = [
+    ("venta", 0.70),
+    ("pago_proveedor", 0.17),
+    ("deshacer", 0.10),
+    ("saldar", 0.03)
+]
+
+async def generar_trafico(corrida, segundos, ritmo, rafaga):
+    """Llegadas de Poisson a `ritmo` por segundo, con ráfagas de `rafaga` ventas"""
+    nombres = [n for n, _ in ESCENARIOS]
+    pesos = [p for _, p in ESCENARIOS]
+    tareas = []
+    fin = time.perf_counter() + segundos
+
+    while time.perf_counter() < fin:
+        if rafaga and corrida.azar.random() < 0.05:
+            tareas += [asyncio.create_task(corrida.venta()) for _ in range(rafaga)]
+        else:
+            escenario = corrida.azar.choices(nombres, pesos)[0]
+            tareas.append(asyncio.create_task(getattr(corrida, escenario)()))
+        await asyncio.sleep(corrida.azar.expovariate(ritmo))
+
+    await asyncio.gather(*tareas)
+
+def esperar_replicacion(db_sheet, ledger, limite):
+    """Segundos hasta que el escritor vació la cola (None si no terminó)"""
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < limite:
+        if (db_sheet.en_cola() == 0 and not ledger.sin_replicar()
+                and not ledger.actualizaciones_pendientes()):
+            return time.perf_counter() - inicio
+        time.sleep(0.05)
+    return None
+
+def _percentiles(muestras):
+    ordenados = sorted(muestras)
+    if not ordenados:
+        return {}
+    n = len(ordenados) - 1
+    return {
+        "n": len(ordenados),
+        "p50": ordenados[int(round(0.50 * n))] * 1000,
+        "p95": ordenados[int(round(0.95 * n))] * 1000,
+        "p99": ordenados[int(round(0.99 * n))] * 1000,
+        "max": ordenados[-1] * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segundos", type=float, default=20, help="duración del tráfico")
+    parser.add_argument("--ritmo", type=float, default=5, help="escenarios por segundo (media)")
+    parser.add_argument("--rafaga", type=int, default=10, help="ventas por ráfaga (0 = sin ráfagas)")
+    parser.add_argument("--latencia", type=float, default=250, help="latencia media de Sheets en ms")
+    parser.add_argument("--error", type=float, default=0.0, help="probabilidad de 429 por llamada")
+    parser.add_argument("--drenado", type=float, default=60, help="segundos máximos esperando la cola")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--json", help="archivo donde guardar el resultado")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="benchmark-")
+    os.environ["LEDGER_PATH"] = os.path.join(directorio, "ledger.db")
+    os.environ["HISTORICO_DIR"] = os.path.join(directorio, "historico")
+    os.environ["METRICS_PATH"] = os.path.join(directorio, "metrics.json")
+
+    backend = Backend(args.latencia / 1000, error=args.error, semilla=args.semilla)
+    instalar(backend)
+
+    import db_sheet
+    import handlers
+    import ledger
+    import metrics
+
+    db_sheet.iniciar()
+    corrida = Corrida(handlers, random.Random(args.semilla))
+    inicio = time.perf_counter()
+    asyncio.run(generar_trafico(corrida, args.segundos, args.ritmo, args.rafaga))
+    duracion = time.perf_counter() - inicio
+    drenado = esperar_replicacion(db_sheet, ledger, args.drenado)
+
+    updates = sum(len(v) for v in corrida.latencias.values())
+    resultado = {
+        "parametros": vars(args),
+        "updates": updates,
+        "updates_por_segundo": updates / duracion,
+        "drenado_segundos": drenado,
+        "latencias_ms": {tipo: _percentiles(v) for tipo, v in sorted(corrida.latencias.items())},
+        "fallidos": dict(corrida.fallidos),
+        "errores_handler": metrics.resumen()["contadores"].get("handler.errores", 0),
+        "llamadas_api": dict(sorted(backend.llamadas.items())),
+        "errores_api": dict(sorted(backend.errores.items())),
+        "metricas": metrics.resumen()
+    }
+
+    print(f"📨 {updates} updates en {duracion:.1f}s ({resultado['updates_por_segundo']:.1f}/s)")
+    print("⏱️ ms (p50 / p95 / p99)")
+    for tipo, t in resultado["latencias_ms"].items():
+        print(f"  {tipo} [{t['n']}]: {t['p50']:.1f} / {t['p95']:.1f} / {t['p99']:.1f}")
+    print(f"📡 Llamadas a Sheets: {sum(backend.llamadas.values())} {resultado['llamadas_api']}")
+    if backend.errores:
+        print(f"⚠️ 429 simulados: {resultado['errores_api']}")
+    if drenado is None:
+        print(f"❌ La cola no se vació en {args.drenado:.0f}s")
+    else:
+        print(f"✅ Cola replicada {drenado:.1f}s después del último update")
+
+    # Los handlers atrapan sus excepciones: los errores salen del contador
+    if resultado["errores_handler"]:
+        print(f"❌ {resultado['errores_handler']} errores en los handlers")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=1, ensure_ascii=False, default=str)
+
+    ok = drenado is not None and not corrida.fallidos and not resultado["errores_handler"]
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
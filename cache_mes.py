@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+# Lo que ven los lectores: no cambia nunca, se reemplaza entera
+Instantanea = namedtuple("Instantanea", ["version", "mes", "datos"])
+
+_MISMO_MES = object()
+
+def _congelar(registro):
+    if isinstance(registro, MappingProxyType):
+        return registro
+    return MappingProxyType(registro)
+
+class CacheMes:
+    """
+    Movimientos del mes de una sucursal, copy-on-write. Los lectores toman
+    `instantanea` (tupla de registros de solo lectura, con su versión) sin
+    lock ni copia. Toda escritura pasa por `mutar`, de a una por vez.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.timestamp = 0
+        self.instantanea = Instantanea(0, None, ())
+        self._lock = threading.Lock()
+
+    @property
+    def datos(self):
+        return self.instantanea.datos
+
+    @property
+    def mes(self):
+        return self.instantanea.mes
+
+    def vigente(self, mes):
+        """Datos del mes cargados y dentro del TTL"""
+        return self.instantanea.mes == mes and time.time() - self.timestamp < self.ttl
+
+    def mutar(self, cambio, mes=_MISMO_MES):
+        """
+        `cambio(borrador)` recibe una copia de la lista y la modifica con el
+        lock tomado (junto con el ledger, los totales y los pendientes, así
+        una recarga no se cruza con un alta o un borrado). Al volver, el
+        borrador se publica como instantánea nueva con una sola asignación.
+        Con `mes` el borrador arranca vacío y el cache pasa a ese mes.
+        Devuelve lo que devuelva `cambio`.
+        """
+        with self._lock:
+            actual = self.instantanea
+            if mes is _MISMO_MES:
+                mes, borrador = actual.mes, list(actual.datos)
+            else:
+                borrador = []
+            resultado = cambio(borrador)
+            self.instantanea = Instantanea(
+                actual.version + 1, mes, tuple(_congelar(r) for r in borrador)
+            )
+            return resultado
@@ -0,0 +1,149 @@
+import os
+from datetime import date, datetime, time, timedelta
+
+import ledger
+import metrics
+import pendientes
+import tiendas
+from totales import EXCLUIR_ESTADO
+from utils import formatear_monto
+
+# Hora (HH:MM, hora local) del cierre del día y del resumen a los dueños
+HORA_CIERRE = os.getenv("HORA_CIERRE", "23:30")
+
+def _fila_cierre(fecha):
+    """Totales del día `fecha` (date) y acumulado del mes, desde el último cierre"""
+    dia = fecha.isoformat()
+    mes = dia[:7]
+    ingreso, egreso, ventas = ledger.totales_caja(dia, dia, EXCLUIR_ESTADO)
+
+    anterior = ledger.ultimo_cierre(mes, dia)
+    if anterior:
+        ingreso_mes, egreso_mes = anterior["ingreso_mes"], anterior["egreso_mes"]
+        desde = (date.fromisoformat(anterior["fecha"]) + timedelta(days=1)).isoformat()
+    else:
+        ingreso_mes = egreso_mes = 0.0
+        desde = f"{mes}-01"
+
+    # Días sin cierre entre el anterior y este (bot apagado o cierre invalidado)
+    if desde < dia:
+        hasta = (fecha - timedelta(days=1)).isoformat()
+        entre_ingreso, entre_egreso, _ = ledger.totales_caja(desde, hasta, EXCLUIR_ESTADO)
+        ingreso_mes += entre_ingreso
+        egreso_mes += entre_egreso
+
+    return {
+        "fecha": dia,
+        "mes": mes,
+        "ingreso": ingreso,
+        "egreso": egreso,
+        "ventas": ventas,
+        "ingreso_mes": ingreso_mes + ingreso,
+        "egreso_mes": egreso_mes + egreso,
+        "a_pagar": sum(total for _, total in pendientes.resumen().values()),
+        "cerrado": datetime.now().isoformat(timespec="seconds")
+    }
+
+def cerrar_dia(fecha=None):
+    """Congela los totales del día (hoy por defecto) de la sucursal actual"""
+    fecha = fecha or date.today()
+    with metrics.medir("cierre.dia"):
+        fila = _fila_cierre(fecha)
+        ledger.guardar_cierre(fila)
+    return fila
+
+def mes_a_la_fecha(hoy=None):
+    """
+    Ingreso, egreso y saldo de caja del mes hasta hoy: el último cierre
+    vigente más lo que entró después (sin recorrer el mes entero).
+    """
+    hoy = hoy or date.today()
+    dia = hoy.isoformat()
+    anterior = ledger.ultimo_cierre(dia[:7], dia)
+    if anterior:
+        metrics.contar("cierre.hit")
+        desde = (date.fromisoformat(anterior["fecha"]) + timedelta(days=1)).isoformat()
+        ingreso, egreso = anterior["ingreso_mes"], anterior["egreso_mes"]
+    else:
+        metrics.contar("cierre.miss")
+        desde = f"{dia[:7]}-01"
+        ingreso = egreso = 0.0
+
+    resto_ingreso, resto_egreso, _ = ledger.totales_caja(desde, dia, EXCLUIR_ESTADO)
+    ingreso += resto_ingreso
+    egreso += resto_egreso
+    return {"ingreso": ingreso, "egreso": egreso, "saldo": ingreso - egreso}
+
+def texto_resumen(fila):
+    """Mensaje del cierre para los dueños, con lo pendiente de pago"""
+    lineas = [
+        f"🌙 Cierre {fila['fecha']} ({tiendas.actual()})",
+        f"📥 ${formatear_monto(fila['ingreso'])} ({fila['ventas']} ventas)",
+        f"📤 ${formatear_monto(fila['egreso'])}",
+        f"💰 Saldo día: ${formatear_monto(fila['ingreso'] - fila['egreso'])}",
+        f"📆 Mes: ${formatear_monto(fila['ingreso_mes'] - fila['egreso_mes'])}"
+    ]
+
+    resumen = pendientes.resumen()
+    if resumen:
+        lineas.append(f"⏳ A pagar: ${formatear_monto(fila['a_pagar'])}")
+        lineas += [
+            f"• {proveedor}: ${formatear_monto(total)} ({cantidad})"
+            for proveedor, (cantidad, total) in resumen.items()
+        ]
+    return "\n".join(lineas)
+
+async def _cerrar_sucursal(bot, tienda, fecha, avisar):
+    with tiendas.usando(tienda):
+        fila = cerrar_dia(fecha)  # Consultas locales al ledger, por índice
+        if not avisar:
+            return
+        texto = texto_resumen(fila)
+        for dueno in tiendas.duenos():
+            try:
+                await bot.send_message(dueno, texto)
+            except Exception as e:
+                print(f"❌ Error mandando el cierre a {dueno}: {e}")
+
+async def cierre_diario(context):
+    """Job del JobQueue: cierra el día de cada sucursal y manda el resumen"""
+    for tienda in tiendas.todas():
+        try:
+            await _cerrar_sucursal(context.bot, tienda, date.today(), avisar=True)
+        except Exception as e:
+            print(f"❌ Error en el cierre de {tienda}: {e}")
+
+def _hora_cierre():
+    hora, minuto = (int(p) for p in HORA_CIERRE.split(":"))
+    zona = datetime.now().astimezone().tzinfo  # La del contenedor (TZ), no UTC
+    return time(hora, minuto, tzinfo=zona)
+
+def _cerrado(fecha):
+    dia = fecha.isoformat()
+    anterior = ledger.ultimo_cierre(dia[:7], (fecha + timedelta(days=1)).isoformat())
+    return anterior is not None and anterior["fecha"] == dia
+
+async def cierre_atrasado(context):
+    """
+    Al arrancar: los cierres que se perdieron con el bot apagado (ayer, y
+    hoy si ya pasó la hora) se hacen sin avisar.
+    """
+    hoy = date.today()
+    fechas = [hoy - timedelta(days=1)]
+    if datetime.now().time() >= _hora_cierre().replace(tzinfo=None):
+        fechas.append(hoy)
+
+    for tienda in tiendas.todas():
+        for fecha in fechas:
+            try:
+                with tiendas.usando(tienda):
+                    if _cerrado(fecha):
+                        continue
+                await _cerrar_sucursal(context.bot, tienda, fecha, avisar=False)
+            except Exception as e:
+                print(f"❌ Error en el cierre atrasado de {tienda}: {e}")
+
+def programar(job_queue):
+    """Agenda el cierre diario (necesita python-telegram-bot[job-queue])"""
+    job_queue.run_daily(cierre_diario, _hora_cierre(), name="cierre_diario")
+    job_queue.run_once(cierre_atrasado, 0, name="cierre_atrasado")
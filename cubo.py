@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+import analytics
+import tiendas
+from totales import EXCLUIR_ESTADO
+
+# (tienda, mes) -> (frame del que salió, cubo); se rearma solo si analytics
+# devuelve otro frame (el mes cambió)
+_cubos = {}
+
+def _meses(desde, hasta):
+    return [
+        f"{m // 12:04d}-{m % 12 + 1:02d}"
+        for m in range(desde.year * 12 + desde.month - 1, hasta.year * 12 + hasta.month)
+    ]
+
+def cubo_mes(mes):
+    """
+    Agregado día × proveedor × hora del mes: suma y cantidad de movimientos.
+    Un mes de miles de filas queda en pocos cientos de celdas.
+    """
+    df = analytics.frame_mes(mes)
+    clave = (tiendas.actual(), mes)
+    cacheado = _cubos.get(clave)
+    if cacheado and cacheado[0] is df:
+        return cacheado[1]
+
+    datos = df.dropna(subset=["fecha"])
+    cubo = (
+        datos.groupby(
+            [
+                datos["fecha"].dt.date.rename("fecha"),
+                datos["proveedor"].astype(str).rename("proveedor"),
+                datos["hora"].fillna(-1).astype(int).rename("hora")
+            ]
+        )["monto"]
+        .agg(["sum", "count"])
+        .reset_index()
+    )
+    _cubos[clave] = (df, cubo)
+    return cubo
+
+def celdas(desde, hasta, proveedores=None, excluir=()):
+    """
+    Celdas del cubo entre dos fechas (date, inclusive), de los proveedores
+    pedidos (todos por defecto) y sin los de `excluir`.
+    """
+    partes = []
+    for mes in _meses(desde, hasta):
+        cubo = cubo_mes(mes)
+        mascara = ((cubo["fecha"] >= desde) & (cubo["fecha"] <= hasta)).to_numpy()
+        if proveedores is not None:
+            mascara &= cubo["proveedor"].isin(proveedores).to_numpy()
+        if excluir:
+            mascara &= ~cubo["proveedor"].isin(excluir).to_numpy()
+        partes.append(cubo[mascara])
+
+    if not partes:
+        return pd.DataFrame(columns=["fecha", "proveedor", "hora", "sum", "count"])
+    return pd.concat(partes, ignore_index=True)
+
+def ventas(desde, hasta):
+    return celdas(desde, hasta, proveedores=["cliente"])
+
+def pagos(desde, hasta, proveedor=None):
+    """Egresos de caja (de un proveedor, o de todos menos clientes)"""
+    if proveedor is not None:
+        sel = celdas(desde, hasta, proveedores=[proveedor])
+    else:
+        sel = celdas(desde, hasta, excluir=EXCLUIR_ESTADO | {"cliente"})
+    return sel[sel["sum"] < 0]
+
+def caja(desde, hasta):
+    """Todo lo que mueve la caja (sin Mercadería/Desperdicio)"""
+    return celdas(desde, hasta, excluir=EXCLUIR_ESTADO)
+
+def total(sel):
+    """(suma, cantidad) de una selección de celdas"""
+    return float(sel["sum"].sum()), int(sel["count"].sum())
+
+def agrupar(sel, nivel):
+    """Suma por "hora", "proveedor" o "fecha", de mayor a menor en valor absoluto"""
+    serie = sel.groupby(nivel)["sum"].sum()
+    return serie.iloc[np.argsort(-serie.abs().to_numpy(), kind="stable")]
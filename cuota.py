@@ -0,0 +1,79 @@
+import os
+import random
+import threading
+import time
+
+import gspread
+import requests
+from google.auth.exceptions import TransportError
+
+import metrics
+
+# Cuota de la API de Sheets: lecturas y escrituras por minuto por usuario
+CUOTA_POR_MINUTO = int(os.getenv("SHEETS_CUOTA_MINUTO", "60"))
+REINTENTOS = int(os.getenv("SHEETS_REINTENTOS", "5"))
+
+# Backoff exponencial truncado, con jitter completo (recomendación de Google)
+ESPERA_BASE = 1.0
+ESPERA_MAXIMA = 32.0
+
+_balde = {
+    "fichas": float(CUOTA_POR_MINUTO),
+    "actualizado": time.monotonic()
+}
+_lock = threading.Lock()
+
+def _es_cuota(error):
+    return isinstance(error, gspread.exceptions.APIError) and error.code == 429
+
+def es_reintentable(error):
+    """429, errores 5xx y fallas de red; el resto no se arregla reintentando"""
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.code in (408, 429) or error.code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, TransportError))
+
+def espera(intento):
+    return random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** intento))
+
+def _tomar_ficha():
+    """Bloquea (al hilo que llama) hasta que haya cuota disponible"""
+    while True:
+        with _lock:
+            ahora = time.monotonic()
+            _balde["fichas"] = min(
+                CUOTA_POR_MINUTO,
+                _balde["fichas"] + (ahora - _balde["actualizado"]) * CUOTA_POR_MINUTO / 60
+            )
+            _balde["actualizado"] = ahora
+            if _balde["fichas"] >= 1:
+                _balde["fichas"] -= 1
+                return
+            faltante = (1 - _balde["fichas"]) * 60 / CUOTA_POR_MINUTO
+        metrics.contar("cuota.esperas")
+        time.sleep(faltante)
+
+def _vaciar():
+    """Google dijo basta: todos los hilos esperan a que se rellene el balde"""
+    with _lock:
+        _balde["fichas"] = min(_balde["fichas"], 0.0)
+
+def llamar(nombre, funcion, *args, reintentos=REINTENTOS, **kwargs):
+    """
+    Toda llamada a Sheets pasa por acá: toma una ficha del balde, mide la
+    llamada y reintenta con backoff los errores transitorios. Nunca corre
+    en el event loop (escritor, prealistado o ejecutor de db_async).
+    """
+    intento = 0
+    while True:
+        _tomar_ficha()
+        try:
+            with metrics.medir(nombre):
+                return funcion(*args, **kwargs)
+        except Exception as e:
+            if intento >= reintentos or not es_reintentable(e):
+                raise
+            if _es_cuota(e):
+                _vaciar()
+            metrics.contar(f"{nombre}.reintento")
+            time.sleep(espera(intento))
+            intento += 1
@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import db_sheet
+import ledger
+import metrics
+import pendientes
+import services
+import tiendas
+
+# Hilos dedicados a Google: la red nunca corre en el event loop
+_ejecutor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SHEETS_HILOS", "4")),
+    thread_name_prefix="sheets"
+)
+
+# tienda -> sincronización en curso con su hoja
+_sincronizaciones = {}
+
+async def en_hilo(funcion, *args, timeout=db_sheet.TIMEOUT_SHEETS):
+    """
+    Corre una llamada bloqueante fuera del event loop, con timeout (y con
+    la sucursal actual). timeout=None para trabajos largos (importaciones).
+    """
+    loop = asyncio.get_running_loop()
+    contexto = contextvars.copy_context()
+    return await asyncio.wait_for(
+        loop.run_in_executor(_ejecutor, contexto.run, funcion, *args),
+        timeout
+    )
+
+async def iniciar(app):
+    """post_init: recién acá arrancan los escritores, la conexión con Google y el volcado de métricas"""
+    db_sheet.iniciar()
+    metrics.iniciar()
+
+async def detener(app):
+    """post_shutdown: drena la cola de escritura sin bloquear el loop"""
+    await asyncio.get_running_loop().run_in_executor(None, db_sheet.detener)
+
+async def _sincronizar(mes):
+    """La red va en un hilo; el cache se actualiza de vuelta en el loop"""
+    try:
+        cambio = await en_hilo(db_sheet.sincronizar_hoja, mes)
+    except asyncio.TimeoutError:
+        print(f"⏱️ La hoja no respondió en {db_sheet.TIMEOUT_SHEETS}s, se usa el ledger local")
+        cambio = False
+    except Exception as e:
+        print(f"❌ Error sincronizando la hoja: {e}")
+        cambio = False
+    
+    db_sheet.aplicar_sincronizacion(mes, cambio)
+
+async def obtener_datos_cache():
+    """
+    Si el TTL venció se sincroniza en segundo plano y se devuelve lo que
+    hay. Solo la primera carga de un mes que el ledger todavía no tiene
+    espera a la hoja (y como mucho TIMEOUT_SHEETS).
+    """
+    mes_actual = datetime.now().strftime("%Y-%m")
+    
+    if db_sheet.cache_vigente(mes_actual):
+        metrics.contar("cache.hit")
+        return db_sheet.datos_en_cache()
+    
+    metrics.contar("cache.miss")
+    tienda = tiendas.actual()
+    tarea = _sincronizaciones.get(tienda)
+    if tarea is None or tarea.done():
+        tarea = asyncio.create_task(_sincronizar(mes_actual))
+        _sincronizaciones[tienda] = tarea
+    
+    if db_sheet.mes_en_cache() != mes_actual:
+        if ledger.mes_importado(mes_actual):
+            # Después de un reinicio: se responde con el ledger local
+            db_sheet.recargar_cache(mes_actual)
+        else:
+            await asyncio.shield(tarea)
+    
+    return db_sheet.datos_en_cache()
+
+# Registros, borrados y pagos van primero al ledger local: no tocan la red
+
+async def registrar_ingreso(monto, hora=None):
+    return db_sheet.registrar_ingreso(monto, hora=hora)
+
+async def registrar_egreso(proveedor, monto, hora=None, pagado=True):
+    return db_sheet.registrar_egreso(proveedor, monto, hora=hora, pagado=pagado)
+
+async def eliminar_ultimo_cliente():
+    return db_sheet.eliminar_ultimo_cliente()
+
+async def eliminar_operacion(id_mov):
+    return db_sheet.eliminar_operacion(id_mov)
+
+async def eliminar_ultima_operacion():
+    await obtener_datos_cache()
+    return db_sheet.eliminar_ultima_en_cache()
+
+async def obtener_egresos_pendientes():
+    return services.obtener_egresos_pendientes()
+
+async def marcar_como_pagado(id_mov):
+    return services.marcar_como_pagado(id_mov)
+
+async def pagar_proveedor(proveedor):
+    return services.pagar_proveedor(proveedor)
+
+async def resumen_pendientes():
+    return pendientes.resumen()
+
+async def calcular_total_diario(proveedor="cliente"):
+    return services.calcular_total_diario(proveedor)
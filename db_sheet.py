@@ -1,102 +1,798 @@
 import gspread
 from google.oauth2.service_account import Credentials
-from datetime import datetime
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime, date, timedelta
+import heapq
+import itertools
+import os
+import re
 import time
 import threading
-from queue import Queue
+
+import cuota
+import ledger
+from cache_mes import CacheMes
+import metrics
+import pendientes
+import proyeccion
+import tiendas
+import totales
 
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
     "https://www.googleapis.com/auth/drive"
 ]
 
-credenciales = Credentials.from_service_account_file("credential.json", scopes=SCOPES)
-cliente = gspread.authorize(credenciales)
-SPREADSHEET_NAME = "Registro_Movimientos"
-
-_cache = {
-    "hoja": None,
-    "mes": None,
-    "datos": [],
-    "timestamp": 0,
-    "ttl": 15  # 15 segundos de cache
-}
-
-# COLA DE ESCRITURA ASÍNCRONA
-_cola_escritura = Queue()
-_escritor_activo = False
-
-def _procesar_cola_escritura():
-    """Hilo que procesa escrituras en background"""
-    global _escritor_activo
-    _escritor_activo = True
-    
-    while True:
-        try:
-            operacion = _cola_escritura.get(timeout=1)
-            if operacion is None:  # Señal de parada
-                break
-            
-            tipo, datos = operacion
-            hoja = obtener_hoja_mes()
-            
-            if tipo == "append":
-                hoja.append_row(datos)
+# Ninguna llamada a Google puede quedar colgada para siempre
+TIMEOUT_SHEETS = float(os.getenv("SHEETS_TIMEOUT", "20"))
+
+CREDENCIALES_PATH = os.getenv("GOOGLE_CREDENCIALES", "credential.json")
+
+# Se autentica la primera vez que hace falta: importar el módulo no toca la red
+_google = {"cliente": None}
+_lock_google = threading.Lock()
+
+# Espera máxima para vaciar la cola al apagar (lo que quede se retoma al arrancar)
+DRENADO_SEGUNDOS = float(os.getenv("SHEETS_DRENADO", "8"))
+
+# Hojas abiertas por mes: la actual, la que viene y algunas anteriores
+HOJAS_EN_CACHE = 4
+
+# Hora del último día del mes a la que se crea la hoja del mes siguiente
+HORA_PREALISTAR = int(os.getenv("HORA_PREALISTAR", "23"))
+
+# Filas finales que se comparan contra la hoja para detectar ediciones
+FILAS_VERIFICACION = 3
+
+# Lotes: hasta LOTE_MAXIMO operaciones, juntadas durante LATENCIA_MAXIMA segundos
+LOTE_MAXIMO = int(os.getenv("SHEETS_LOTE_MAXIMO", "50"))
+LATENCIA_MAXIMA = float(os.getenv("SHEETS_LATENCIA_MAXIMA", "1"))
+
+# Filas nuevas por llamada de escritura (importaciones y reinicios con mucho atrasado)
+FILAS_POR_LLAMADA = int(os.getenv("SHEETS_FILAS_POR_LLAMADA", "5000"))
+
+# Escritores compartidos por todas las sucursales
+ESCRITORES = int(os.getenv("SHEETS_ESCRITORES", "2"))
+
+# Estado por sucursal (ver tiendas.py), creado la primera vez que se usa
+_tiendas = {}
+_lock_tiendas = threading.Lock()
+
+def _nuevo_estado(tienda):
+    return {
+        "nombre": tienda,
+        "cache": CacheMes(ttl=15),  # 15 segundos de cache
+        "hojas": OrderedDict(),
+        "planilla": None,
+        "lock_hojas": threading.RLock(),
+        # Cola de escritura; lo que falló por cuota o red encabeza el próximo lote
+        "cola": deque(),
+        "reintento": [],
+        "fallos": 0,
+        "agendada": False,
+        # Lo toma el escritor mientras escribe, para que la sincronización
+        # no confunda sus filas recién agregadas con filas cargadas a mano
+        "lock_replicacion": threading.Lock(),
+        # Ids cuyas filas ya se mandaron sin confirmarse: pueden estar en la hoja
+        "enviadas": set()
+    }
+
+def _estado(tienda=None):
+    tienda = tienda or tiendas.actual()
+    estado = _tiendas.get(tienda)
+    if estado is None:
+        with _lock_tiendas:
+            estado = _tiendas.setdefault(tienda, _nuevo_estado(tienda))
+    return estado
+
+# Turnos de escritura: (listo_en, secuencia, tienda). Una sucursal tiene a lo
+# sumo un turno; después de escribir un lote vuelve al final, así una muy
+# activa no deja sin cuota a las demás
+_turnos = []
+_hay_turnos = threading.Condition()
+_secuencia = itertools.count()
+
+def _agendar(estado, demora):
+    """Llamar con _hay_turnos tomado"""
+    heapq.heappush(_turnos, (time.time() + demora, next(_secuencia), estado["nombre"]))
+    estado["agendada"] = True
+    _hay_turnos.notify()
+
+def _encolar(operacion):
+    estado = _estado()
+    with _hay_turnos:
+        estado["cola"].append(operacion)
+        if not estado["agendada"]:
+            _agendar(estado, LATENCIA_MAXIMA)  # Ventana para juntar el lote
+    metrics.fijar("cola.profundidad", en_cola())
+
+def en_cola():
+    """Operaciones esperando ir a la hoja, de todas las sucursales"""
+    return sum(len(e["cola"]) + len(e["reintento"]) for e in list(_tiendas.values()))
+
+def _proximo_turno():
+    with _hay_turnos:
+        while True:
+            espera = _turnos[0][0] - time.time() if _turnos else None
+            if espera is not None and espera <= 0:
+                return heapq.heappop(_turnos)[2]
+            _hay_turnos.wait(espera)
+
+def _tomar_lote(estado):
+    """
+    Lo que hay que reintentar primero, después la cola (hasta LOTE_MAXIMO
+    operaciones o FILAS_POR_LLAMADA filas, por las importaciones)
+    """
+    with _hay_turnos:
+        lote = estado["reintento"]
+        estado["reintento"] = []
+        filas = sum(len(_ids_operacion(*operacion)) for operacion in lote)
+        while estado["cola"] and len(lote) < LOTE_MAXIMO and filas < FILAS_POR_LLAMADA:
+            operacion = estado["cola"].popleft()
+            lote.append(operacion)
+            filas += len(_ids_operacion(*operacion))
+    metrics.fijar("cola.profundidad", en_cola())
+    return lote
+
+def _devolver_turno(estado, demora):
+    with _hay_turnos:
+        if estado["cola"] or estado["reintento"]:
+            _agendar(estado, demora)
+        else:
+            estado["agendada"] = False
+    # Después del lote: lo escrito ya no está, lo que falló volvió a la cola
+    metrics.fijar("cola.profundidad", en_cola())
+
+def _ids_operacion(tipo, datos):
+    """("append", id), ("delete", id), ("update", (id, col, valor)) o ("appends", [ids])"""
+    if tipo == "update":
+        return [datos[0]]
+    if tipo == "appends":
+        return list(datos)
+    return [datos]
+
+def _valores_fila(mov):
+    return [mov["fecha"], mov["hora"], mov["proveedor"], mov["monto"], mov["pagado"]]
+
+def _compactar_lote(lote, movimientos):
+    """
+    Agrupa el lote por mes en filas nuevas, borrados y actualizaciones.
+
+    Las operaciones llevan el id del ledger y las filas nuevas se arman con
+    su estado actual, así que un borrado de algo que todavía no llegó a la
+    hoja lo cancela sin llamar a la API.
+    """
+    planes = {}
+
+    for tipo, datos in lote:
+        for id_mov in _ids_operacion(tipo, datos):
+            mov = movimientos.get(id_mov)
+            if mov is None:
+                continue
+
+            plan = planes.setdefault(mov["mes"], {
+                "nuevas": {},
+                "borrados": {},
+                "cancelados": [],
+                "actualizaciones": [],
+                "confirmar": [],
+                "perdidas": []
+            })
+
+            if tipo in ("append", "appends"):
+                if mov["estado"] == ledger.PENDIENTE and mov["fila"] is None:
+                    plan["nuevas"][id_mov] = _valores_fila(mov)
+
             elif tipo == "delete":
-                hoja.delete_rows(datos)
+                if plan["nuevas"].pop(id_mov, None) is not None or mov["fila"] is None:
+                    plan["cancelados"].append(id_mov)
+                else:
+                    plan["borrados"][id_mov] = mov["fila"]
+
             elif tipo == "update":
-                fila, col, valor = datos
-                hoja.update_cell(fila, col, valor)
-            
-            time.sleep(0.1)  # Evitar rate limits
-            
-        except:
-            continue
+                _, col, valor = datos
+                if mov["fila"] is not None:
+                    plan["actualizaciones"].append((id_mov, mov["fila"], col, valor))
+                elif mov["estado"] == ledger.PENDIENTE:
+                    # Viaja con la fila nueva, que se arma con el valor actual del ledger
+                    plan["confirmar"].append(datos)
+                else:
+                    plan["perdidas"].append(datos)
+
+    return planes
+
+def _enviar_actualizaciones(hoja, actualizaciones):
+    cuota.llamar(
+        "sheets.batch_update_valores",
+        hoja.batch_update,
+        [
+            {"range": gspread.utils.rowcol_to_a1(fila, col), "values": [[valor]]}
+            for _, fila, col, valor in actualizaciones
+        ],
+        value_input_option="USER_ENTERED"
+    )
+
+def _enviar_borrados(hoja, filas):
+    """De abajo hacia arriba, así todas usan la numeración original"""
+    cuota.llamar("sheets.borrar_filas", hoja.spreadsheet.batch_update, {
+        "requests": [
+            {
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": hoja.id,
+                        "dimension": "ROWS",
+                        "startIndex": fila - 1,
+                        "endIndex": fila
+                    }
+                }
+            }
+            for fila in sorted(filas, reverse=True)
+        ]
+    })
+
+def _enviar_nuevas(hoja, nuevas):
+    """
+    Devuelve la primera fila donde quedaron las nuevas. Sin reintentos acá:
+    agregar no es idempotente, el lote vuelve a la cola y antes de repetirse
+    se busca en la hoja lo que llegó (ver _conciliar_cola).
+    """
+    respuesta = cuota.llamar("sheets.append_rows", hoja.append_rows, nuevas, reintentos=0)
+    rango = respuesta["updates"]["updatedRange"]  # 'YYYY-MM'!A10:E12
+    return int(re.search(r"!\D+(\d+)", rango).group(1))
+
+def _verificar_filas(hoja, mes, plan):
+    """
+    Borrados y updates van por número de fila: antes se confirma que cada
+    fila siga teniendo su movimiento. Si la hoja se editó a mano desde la
+    última sincronización, se concilia el mes y los números se corrigen
+    (lo que ya no está en la hoja queda en "perdidas" o se da por borrado).
+    """
+    ids = list(plan["borrados"]) + [id_mov for id_mov, *_ in plan["actualizaciones"]]
+    movimientos = ledger.obtener(ids)
+    esperadas = {
+        mov["fila"]: ledger.firma(mov["fecha"], mov["proveedor"], mov["monto"])
+        for mov in movimientos.values()
+        if mov["fila"] is not None
+    }
+    if not esperadas:
+        return
+    desde = min(esperadas)
+    valores = cuota.llamar("sheets.get_values", hoja.get_values, f"A{desde}:E{max(esperadas)}")
+    if all(
+        fila - desde < len(valores) and _firma_hoja(valores[fila - desde]) == firma
+        for fila, firma in esperadas.items()
+    ):
+        return
+
+    metrics.contar("escritor.filas_corridas")
+    registros = cuota.llamar("sheets.get_all_records", hoja.get_all_records)
+    ledger.importar_mes(mes, registros)
+    olvidar_cache()
+
+    movimientos = ledger.obtener(ids)
+    plan["borrados"] = {
+        id_mov: movimientos[id_mov]["fila"]
+        for id_mov in plan["borrados"]
+        if movimientos[id_mov]["estado"] == ledger.ELIMINAR and movimientos[id_mov]["fila"] is not None
+    }
+    actualizaciones = []
+    for id_mov, _, col, valor in plan["actualizaciones"]:
+        if movimientos[id_mov]["fila"] is not None:
+            actualizaciones.append((id_mov, movimientos[id_mov]["fila"], col, valor))
+        else:
+            plan["perdidas"].append((id_mov, col, valor))
+    plan["actualizaciones"] = actualizaciones
+
+def _conciliar_cola(hoja, mes, desde, hasta, pendientes):
+    """
+    Filas de la hoja desde `desde` (hasta `hasta`, o hasta el final) que el
+    ledger todavía no conoce. Las que coinciden por firma con un id de
+    `pendientes` (id -> firma) son un envío anterior que llegó aunque la
+    respuesta se perdió (timeout, reinicio): se confirman con su fila en vez
+    de mandarse de nuevo. Las demás se cargaron a mano y se importan.
+    Devuelve los ids confirmados.
+    """
+    rango = f"A{desde}:E{hasta}" if hasta else f"A{desde}:E"
+    valores = cuota.llamar("sheets.get_values", hoja.get_values, rango)
+
+    por_firma = defaultdict(list)
+    for id_mov, firma in pendientes.items():
+        por_firma[firma].append(id_mov)
+    confirmados, a_mano = [], []
+    for i, fila_valores in enumerate(valores):
+        candidatos = por_firma.get(_firma_hoja(fila_valores))
+        if candidatos:
+            confirmados.append((candidatos.pop(0), desde + i))
+        else:
+            a_mano.append((desde + i, fila_valores))
+
+    if confirmados:
+        metrics.contar("escritor.filas_ya_escritas", len(confirmados))
+        _estado()["enviadas"].difference_update(id_mov for id_mov, _ in confirmados)
+        for id_mov in ledger.marcar_replicados(mes, confirmados):
+            _encolar(("delete", id_mov))
+
+    if a_mano and ledger.mes_importado(mes):
+        # De a tramos contiguos: las confirmadas pueden quedar en el medio
+        inicio, tramo = a_mano[0][0], []
+        for fila, fila_valores in a_mano:
+            if fila != inicio + len(tramo):
+                ledger.agregar_de_hoja(mes, inicio, tramo)
+                inicio, tramo = fila, []
+            tramo.append(fila_valores)
+        ledger.agregar_de_hoja(mes, inicio, tramo)
+        olvidar_cache()
+    return [id_mov for id_mov, _ in confirmados]
+
+def _importar_intermedias(hoja, mes, primera, pendientes):
+    """
+    Filas entre la última que el ledger conoce y las que se acaban de
+    agregar: se concilian antes de mover el cursor, si no la próxima
+    sincronización las toma por una edición. Devuelve los ids de
+    `pendientes` que ya estaban en la hoja.
+    """
+    ultima = ledger.ultima_fila(mes)
+    if primera <= ultima + 1:
+        return []
+    return _conciliar_cola(hoja, mes, ultima + 1, primera - 1, pendientes)
+
+def _replicar_lote(lote):
+    """
+    Espeja en la hoja las operaciones del lote y avanza el cursor del ledger.
+    Una llamada por tipo de operación, y el ledger se actualiza después de
+    cada una: si algo falla a mitad de camino, repetir el lote es seguro.
+    """
+    ids = {id_mov for tipo, datos in lote for id_mov in _ids_operacion(tipo, datos)}
+    movimientos = ledger.obtener(ids)
+    planes = _compactar_lote(lote, movimientos)
+
+    # Updates de movimientos que el ledger ya no tiene: no hay dónde escribirlos
+    perdidas = [datos for tipo, datos in lote if tipo == "update" and datos[0] not in movimientos]
+
+    enviadas = _estado()["enviadas"]
+    for mes, plan in planes.items():
+        if plan["borrados"] or plan["actualizaciones"]:
+            _verificar_filas(obtener_hoja_mes(mes), mes, plan)
+
+        # Filas ya mandadas una vez (la respuesta se perdió, o hubo un
+        # reinicio): antes de repetirlas se busca cuáles llegaron
+        nuevas = plan["nuevas"]
+        if enviadas.intersection(nuevas):
+            ya_escritas = _conciliar_cola(
+                obtener_hoja_mes(mes), mes, ledger.ultima_fila(mes) + 1, None,
+                {id_mov: _firma_hoja(valores) for id_mov, valores in nuevas.items() if id_mov in enviadas}
+            )
+            for id_mov in ya_escritas:
+                del nuevas[id_mov]
+
+        borrados = list(plan["borrados"].items())
+
+        if nuevas or borrados or plan["actualizaciones"]:
+            hoja = obtener_hoja_mes(mes)
+
+            # Los updates van primero, con la numeración de antes de borrar
+            if plan["actualizaciones"]:
+                _enviar_actualizaciones(hoja, plan["actualizaciones"])
+                ledger.confirmar_actualizaciones([
+                    (id_mov, col, valor) for id_mov, _, col, valor in plan["actualizaciones"]
+                ])
+            if borrados:
+                _enviar_borrados(hoja, [fila for _, fila in borrados])
+                ledger.marcar_borrados(mes, borrados)
+            # De a FILAS_POR_LLAMADA, cada tramo confirmado en el ledger
+            while nuevas:
+                tramo = list(nuevas.items())[:FILAS_POR_LLAMADA]
+                for id_mov, _ in tramo:
+                    del nuevas[id_mov]
+                enviadas.update(id_mov for id_mov, _ in tramo)
+                primera = _enviar_nuevas(hoja, [valores for _, valores in tramo])
+                ya_escritas = _importar_intermedias(hoja, mes, primera, {
+                    id_mov: _firma_hoja(valores) for id_mov, valores in nuevas.items() if id_mov in enviadas
+                })
+                for id_mov in ya_escritas:
+                    del nuevas[id_mov]
+                cancelados = ledger.marcar_replicados(
+                    mes,
+                    [(id_mov, primera + i) for i, (id_mov, _) in enumerate(tramo)]
+                )
+                enviadas.difference_update(id_mov for id_mov, _ in tramo)
+                # Se deshicieron mientras viajaban: ahora sí hay que borrarlos
+                for id_mov in cancelados:
+                    _encolar(("delete", id_mov))
+
+        if plan["cancelados"]:
+            ledger.marcar_borrados(mes, [], plan["cancelados"])
+
+        # Los de filas que todavía no estaban en la hoja viajan con la fila nueva
+        ledger.confirmar_actualizaciones(plan["confirmar"])
+        perdidas += plan["perdidas"]
+
+    # La fila ya no está en la hoja: queda registrado en vez de confirmarse
+    for datos in perdidas:
+        ledger.guardar_fallido(("update", datos), "la fila ya no está en la hoja")
+        metrics.contar("escritor.updates_perdidos")
+    ledger.confirmar_actualizaciones(perdidas)
+
+def _descartar(estado, lote):
+    """
+    Error permanente: se reintenta cada operación por separado y las que
+    vuelven a fallar van a la tabla de fallidos del ledger. El movimiento
+    queda guardado localmente y se vuelve a intentar al reiniciar.
+    """
+    for operacion in lote:
+        try:
+            _replicar_lote([operacion])
+        except Exception as e:
+            if cuota.es_reintentable(e):
+                with _hay_turnos:
+                    estado["reintento"].append(operacion)
+                continue
+            ledger.guardar_fallido(operacion, e)
+            metrics.contar("escritor.fallidos")
+            print(f"❌ Operación descartada {operacion}: {e}")
+
+def _escribir_turno(estado):
+    """Escribe un lote de la sucursal; devuelve cuánto esperar hasta su próximo turno"""
+    lote = _tomar_lote(estado)
+    if not lote:
+        return 0
+
+    metrics.contar("cola.operaciones", len(lote))
+    try:
+        with estado["lock_replicacion"], metrics.medir("escritor.lote"):
+            _replicar_lote(lote)
+        estado["fallos"] = 0
+        return 0
+    except Exception as e:
+        if not cuota.es_reintentable(e):
+            print(f"❌ Error escribiendo lote ({len(lote)} operaciones): {e}")
+            with estado["lock_replicacion"]:
+                _descartar(estado, lote)
+            return 0
+        
+        # Cuota o red: el lote vuelve adelante de la cola y se espera cada vez más
+        print(f"⏳ Sheets no disponible, se reintenta el lote ({len(lote)} operaciones): {e}")
+        metrics.contar("escritor.reintentos")
+        with _hay_turnos:
+            estado["reintento"] = lote + estado["reintento"]
+        estado["fallos"] += 1
+        return cuota.espera(estado["fallos"] - 1)
+
+def _escritor():
+    """Hilo del pool: toma el próximo turno y escribe un lote de esa sucursal"""
+    while True:
+        tienda = _proximo_turno()
+        if tienda is None:  # Señal de parada
+            return
+        
+        estado = _estado(tienda)
+        with tiendas.usando(tienda):
+            demora = _escribir_turno(estado)
+        _devolver_turno(estado, demora)
+
+def encolar_nuevas(ids):
+    """Muchas filas ya guardadas en el ledger: una operación por tramo, no por fila"""
+    ids = list(ids)
+    for inicio in range(0, len(ids), FILAS_POR_LLAMADA):
+        tramo = ids[inicio:inicio + FILAS_POR_LLAMADA]
+        _encolar(("append", tramo[0]) if len(tramo) == 1 else ("appends", tramo))
+
+def _retomar_replicacion():
+    """
+    Encola lo que quedó sin replicar antes del último reinicio. El ledger
+    es la cola persistente: una fila con `fila` asignada no se vuelve a
+    agregar, y las pendientes se buscan en la hoja antes de reenviarse
+    (ver _conciliar_cola), así que repetir una operación no duplica nada.
+    """
+    nuevas = []
+    for mov in ledger.sin_replicar():
+        if mov["estado"] == ledger.PENDIENTE:
+            nuevas.append(mov["id"])
+        else:
+            _encolar(("delete", mov["id"]))
+    _estado()["enviadas"].update(nuevas)
+    encolar_nuevas(nuevas)
+    for actualizacion in ledger.actualizaciones_pendientes():
+        _encolar(("update", actualizacion))
+
+# Hilos del proceso, creados por iniciar()
+_hilos = {"escritores": [], "prealistado": None}
+
+def _precalentar():
+    """Autentica y abre las planillas en segundo plano, antes del primer pedido"""
+    for tienda in tiendas.todas():
+        try:
+            with tiendas.usando(tienda):
+                abrir_planilla()
+        except Exception as e:
+            print(f"❌ No se pudo abrir la planilla de {tienda}: {e}")
+
+def iniciar():
+    """
+    Arranque explícito (post_init de la Application): encola lo que quedó
+    sin replicar, levanta los escritores y el prealistado, y autentica
+    con Google en segundo plano. Llamarlo dos veces no hace nada.
+    """
+    if _hilos["escritores"]:
+        return
+    for tienda in tiendas.todas():
+        with tiendas.usando(tienda):
+            _retomar_replicacion()
+
+    _hilos["escritores"] = [
+        threading.Thread(target=_escritor, daemon=True, name=f"escritor-{i}")
+        for i in range(ESCRITORES)
+    ]
+    for hilo in _hilos["escritores"]:
+        hilo.start()
+
+    _hilos["prealistado"] = threading.Thread(target=_prealistar_hojas, daemon=True, name="prealistado")
+    _hilos["prealistado"].start()
+    threading.Thread(target=_precalentar, daemon=True, name="precalentar").start()
+
+def detener(espera=DRENADO_SEGUNDOS):
+    """
+    Apagado (post_shutdown): espera hasta `espera` segundos a que la cola
+    se vacíe y después para los escritores, que terminan el lote en curso.
+    Lo que no llegó a la hoja sigue en el ledger y se retoma al arrancar.
+    """
+    escritores = _hilos["escritores"]
+    if not escritores:
+        return
+    limite = time.time() + espera
+    while en_cola() and time.time() < limite:
+        time.sleep(0.1)
+
+    with _hay_turnos:
+        for _ in escritores:
+            heapq.heappush(_turnos, (time.time(), next(_secuencia), None))  # Señal de parada
+        _hay_turnos.notify_all()
+    for hilo in escritores:
+        hilo.join(max(limite - time.time(), 0) + TIMEOUT_SHEETS)
+    _hilos["escritores"] = []
+
+    if en_cola():
+        print(f"⏳ Quedaron {en_cola()} operaciones en cola; se retoman al arrancar")
+
+def _cliente():
+    """Cliente de gspread, autenticado la primera vez que se usa"""
+    with _lock_google:
+        if _google["cliente"] is None:
+            credenciales = Credentials.from_service_account_file(CREDENCIALES_PATH, scopes=SCOPES)
+            cliente = gspread.authorize(credenciales)
+            cliente.set_timeout(TIMEOUT_SHEETS)
+            _google["cliente"] = cliente
+        return _google["cliente"]
+
+def abrir_planilla():
+    """La planilla de la sucursal se abre una sola vez por proceso"""
+    estado = _estado()
+    with estado["lock_hojas"]:
+        if estado["planilla"] is None:
+            nombre = tiendas.planilla()
+            try:
+                estado["planilla"] = cuota.llamar("sheets.open", _cliente().open, nombre)
+            except gspread.SpreadsheetNotFound:
+                estado["planilla"] = cuota.llamar("sheets.create", _cliente().create, nombre)
+        return estado["planilla"]
+
+def obtener_hoja_mes(mes=None):
+    """
+    Cache LRU de hojas por mes (la del mes actual, o la de `mes` con formato
+    %Y-%m): cada acierto la pasa al final, se descarta la menos usada.
+    """
+    mes = mes or datetime.now().strftime("%Y-%m")
+    estado = _estado()
+    hojas = estado["hojas"]
     
-    _escritor_activo = False
+    hoja = hojas.get(mes)
+    if hoja is not None:
+        try:
+            hojas.move_to_end(mes)
+        except KeyError:  # La descartó otro hilo recién; igual sirve
+            pass
+        return hoja
+    
+    # Una sola creación por mes aunque lleguen varios pedidos juntos
+    with estado["lock_hojas"]:
+        if mes in hojas:
+            hojas.move_to_end(mes)
+            return hojas[mes]
+        
+        sheet = abrir_planilla()
+        
+        try:
+            hoja = cuota.llamar("sheets.worksheet", sheet.worksheet, mes)
+        except gspread.WorksheetNotFound:
+            hoja = cuota.llamar("sheets.add_worksheet", sheet.add_worksheet, title=mes, rows="1000", cols="5")
+            cuota.llamar("sheets.append_row", hoja.append_row, ledger.ENCABEZADO)
+        
+        hojas[mes] = hoja
+        while len(hojas) > HOJAS_EN_CACHE:
+            hojas.popitem(last=False)
+        return hoja
 
-_hilo_escritor = threading.Thread(target=_procesar_cola_escritura, daemon=True)
-_hilo_escritor.start()
+def _proximo_prealistado(ahora):
+    """Último día del mes a la hora HORA_PREALISTAR (el de este mes o el del siguiente)"""
+    siguiente = (ahora.replace(day=28) + timedelta(days=4)).replace(day=1)
+    momento = (siguiente - timedelta(days=1)).replace(
+        hour=HORA_PREALISTAR, minute=0, second=0, microsecond=0
+    )
+    if momento <= ahora:
+        return _proximo_prealistado(siguiente)
+    return momento
 
-def obtener_hoja_mes():
-    """Cache de hoja"""
-    mes_actual = datetime.now().strftime("%Y-%m")
+def prealistar_mes_siguiente(ahora=None):
+    """Crea y abre la hoja del mes que viene, fuera del camino de los pedidos"""
+    ahora = ahora or datetime.now()
+    siguiente = (ahora.replace(day=28) + timedelta(days=4)).strftime("%Y-%m")
+    for tienda in tiendas.todas():
+        try:
+            with tiendas.usando(tienda):
+                obtener_hoja_mes(siguiente)
+        except Exception as e:
+            print(f"❌ Error prealistando la hoja {siguiente} ({tienda}): {e}")
+
+def _prealistar_hojas():
+    """Hilo que deja lista la hoja del mes siguiente la última noche del mes"""
+    ahora = datetime.now()
+    if ahora.month != (ahora + timedelta(days=1)).month and ahora.hour >= HORA_PREALISTAR:
+        prealistar_mes_siguiente(ahora)  # Arrancó tarde el último día
     
-    if _cache["hoja"] and _cache["mes"] == mes_actual:
-        return _cache["hoja"]
+    while True:
+        momento = _proximo_prealistado(datetime.now())
+        time.sleep(max((momento - datetime.now()).total_seconds(), 0))
+        prealistar_mes_siguiente()
+
+def _firma_hoja(valores):
+    valores = list(valores) + [""] * (5 - len(valores))
+    return ledger.firma(valores[0], valores[2], valores[3])
+
+def sincronizar_hoja(mes):
+    """
+    Trae de la hoja solo las filas nuevas (lectura por rango). Si las
+    últimas filas conocidas no coinciden, alguien editó o borró a mano y
+    se recarga el mes completo. Devuelve True si el ledger cambió.
+    """
+    lock_replicacion = _estado()["lock_replicacion"]
+    if not lock_replicacion.acquire(blocking=False):
+        return False  # El escritor está escribiendo: queda para el próximo TTL
     
     try:
-        sheet = cliente.open(SPREADSHEET_NAME)
-    except gspread.SpreadsheetNotFound:
-        sheet = cliente.create(SPREADSHEET_NAME)
+        hoja = obtener_hoja_mes(mes)
+        
+        if not ledger.mes_importado(mes):
+            registros = cuota.llamar("sheets.get_all_records", hoja.get_all_records)
+            ledger.importar_mes(mes, registros)
+            return True
+        
+        ultima = ledger.ultima_fila(mes)
+        desde = max(2, ultima - FILAS_VERIFICACION + 1)
+        # Se reintenta poco: si no sale, queda para el próximo TTL
+        valores = cuota.llamar("sheets.get_values", hoja.get_values, f"A{desde}:E", reintentos=2)
+        conocidas = ledger.firmas(mes, desde)
+        esperadas = ultima - desde + 1
+        
+        editada = len(valores) < esperadas or any(
+            _firma_hoja(v) != conocidas.get(desde + i)
+            for i, v in enumerate(valores[:esperadas])
+        )
+        if editada:
+            metrics.contar("sincronizacion.recarga_completa")
+            registros = cuota.llamar("sheets.get_all_records", hoja.get_all_records)
+            ledger.importar_mes(mes, registros)
+            return True
+        
+        if len(valores) > esperadas:
+            ledger.agregar_de_hoja(mes, ultima + 1, valores[esperadas:])
+            return True
+        
+        return False
+    finally:
+        lock_replicacion.release()
 
-    try:
-        hoja = sheet.worksheet(mes_actual)
-    except gspread.WorksheetNotFound:
-        hoja = sheet.add_worksheet(title=mes_actual, rows="1000", cols="5")
-        hoja.append_row(["Fecha", "Hora", "Proveedor", "Monto", "Pagado"])
+def cache_vigente(mes):
+    """Datos del mes cargados y dentro del TTL"""
+    return _estado()["cache"].vigente(mes)
+
+def recargar_cache(mes):
+    """Relee el mes del ledger y reconstruye los totales (solo local)"""
+    def recarga(datos):
+        datos.extend(ledger.movimientos_mes(mes))
+        totales.reconstruir(datos, mes)
+        proyeccion.invalidar()
+        pendientes.invalidar()
+
+    cache = _estado()["cache"]
+    cache.mutar(recarga, mes=mes)
+    return cache.datos
+
+def aplicar_sincronizacion(mes, cambio):
+    """Deja el cache al día después de sincronizar la hoja"""
+    cache = _estado()["cache"]
+    cache.timestamp = time.time()
     
-    _cache["hoja"] = hoja
-    _cache["mes"] = mes_actual
-    return hoja
+    # Sin cambios externos el cache y los totales siguen al día
+    if cambio or cache.mes != mes:
+        recargar_cache(mes)
+    return cache.datos
+
+def datos_en_cache():
+    return _estado()["cache"].datos
+
+def mes_en_cache():
+    return _estado()["cache"].mes
 
 def obtener_datos_cache():
-    """Cache de datos con TTL"""
-    ahora = time.time()
+    """Cache de datos (del ledger), sincronizado con la hoja cada TTL"""
+    mes_actual = datetime.now().strftime("%Y-%m")
     
-    if (_cache["datos"] and 
-        _cache["mes"] == datetime.now().strftime("%Y-%m") and
-        (ahora - _cache["timestamp"]) < _cache["ttl"]):
-        return _cache["datos"]
+    if cache_vigente(mes_actual):
+        metrics.contar("cache.hit")
+        return datos_en_cache()
     
-    hoja = obtener_hoja_mes()
-    _cache["datos"] = hoja.get_all_records()
-    _cache["timestamp"] = ahora
-    return _cache["datos"]
+    metrics.contar("cache.miss")
+    return aplicar_sincronizacion(mes_actual, sincronizar_hoja(mes_actual))
 
 def invalidar_cache():
     """Invalida cache inmediatamente"""
-    _cache["timestamp"] = 0
+    _estado()["cache"].timestamp = 0
+
+def olvidar_cache():
+    """El ledger cambió por fuera de los handlers (importación): se relee el mes"""
+    def olvido(datos):
+        proyeccion.invalidar()
+        pendientes.invalidar()
+
+    _estado()["cache"].mutar(olvido, mes=None)
+
+def traer_mes(mes):
+    """
+    Carga en el ledger un mes que hasta ahora solo estaba en la hoja (para
+    exportarlo). Devuelve False si la planilla no tiene hoja de ese mes.
+    """
+    if ledger.mes_importado(mes):
+        return True
+    with _estado()["lock_replicacion"]:
+        if ledger.mes_importado(mes):
+            return True
+        try:
+            hoja = cuota.llamar("sheets.worksheet", abrir_planilla().worksheet, mes)
+        except gspread.WorksheetNotFound:
+            return False
+        registros = cuota.llamar("sheets.get_all_records", hoja.get_all_records)
+        ledger.importar_mes(mes, registros)
+        return True
+
+def _registrar(fila):
+    """Commit en el ledger, cache local y cola de replicación"""
+    cache = _estado()["cache"]
+
+    def alta(datos):
+        id_mov = ledger.guardar_movimiento(*fila)
+        registro = {
+            "id": id_mov,
+            "Fecha": date.fromisoformat(fila[0]),
+            "Hora": fila[1],
+            "Proveedor": fila[2],
+            "Monto": float(fila[3]),
+            "Pagado": str(fila[4]).lower() == "true"
+        }
+
+        # Agregar a cache local, totales y pendientes INMEDIATAMENTE
+        # (si el cache es de otro mes, la próxima recarga lo trae del ledger)
+        if cache.mes == fila[0][:7]:
+            datos.append(registro)
+        totales.sumar(registro)
+        proyeccion.sumar(registro)
+        pendientes.agregar(registro)
+        return id_mov
+
+    id_mov = cache.mutar(alta)
+    
+    # Enviar a cola de escritura
+    _encolar(("append", id_mov))
+    return id_mov
 
 def registrar_ingreso(monto, hora=None):
     """Escritura asíncrona"""
@@ -104,18 +800,7 @@ def registrar_ingreso(monto, hora=None):
     hora_formateada = hora if hora else ahora.strftime("%H:%M")
     
     fila = [ahora.strftime("%Y-%m-%d"), hora_formateada, "cliente", monto, "True"]
-    
-    # Agregar a cache local INMEDIATAMENTE
-    _cache["datos"].append({
-        "Fecha": fila[0],
-        "Hora": fila[1],
-        "Proveedor": fila[2],
-        "Monto": fila[3],
-        "Pagado": fila[4]
-    })
-    
-    # Enviar a cola de escritura
-    _cola_escritura.put(("append", fila))
+    return _registrar(fila)
 
 def registrar_egreso(proveedor, monto, hora=None, pagado=True):
     """Escritura asíncrona"""
@@ -123,65 +808,96 @@ def registrar_egreso(proveedor, monto, hora=None, pagado=True):
     hora_formateada = hora if hora else ahora.strftime("%H:%M")
     
     fila = [ahora.strftime("%Y-%m-%d"), hora_formateada, proveedor, monto, str(pagado)]
-    
-    # Agregar a cache local INMEDIATAMENTE
-    _cache["datos"].append({
-        "Fecha": fila[0],
-        "Hora": fila[1],
-        "Proveedor": fila[2],
-        "Monto": fila[3],
-        "Pagado": fila[4]
-    })
-    
-    # Enviar a cola
-    _cola_escritura.put(("append", fila))
+    return _registrar(fila)
+
+def encolar_pagos(ids):
+    """
+    Marca egresos como pagados (ledger primero, hoja en background).
+    Los updates de un mismo lote salen en un solo batch_update.
+    """
+    ids = set(ids)
+
+    def pago(datos):
+        actualizaciones = ledger.marcar_pagados(ids)
+        for idx, registro in enumerate(datos):
+            if registro.get("id") in ids:
+                datos[idx] = {**registro, "Pagado": True}
+        for id_mov in ids:
+            pendientes.quitar(id_mov)
+        return actualizaciones
+
+    actualizaciones = _estado()["cache"].mutar(pago)
+    for actualizacion in actualizaciones:
+        _encolar(("update", actualizacion))
+
+def _eliminar_ultimo(condicion):
+    """
+    Saca del cache el último registro que cumple `condicion` (None si no
+    hay). Si todavía estaba en cola se cancela sin llamar a la API; si ya
+    está en la hoja se encola su borrado.
+    """
+    def baja(datos):
+        for idx in range(len(datos) - 1, -1, -1):
+            if condicion(datos[idx]):
+                registro = datos.pop(idx)
+                totales.restar(registro)
+                proyeccion.restar(registro)
+                pendientes.quitar(registro["id"])
+                return registro, ledger.marcar_eliminar(registro["id"])
+        return None, None
+
+    registro, estado = _estado()["cache"].mutar(baja)
+    if estado == ledger.ELIMINAR:
+        _encolar(("delete", registro["id"]))
+    return registro
 
 def eliminar_ultimo_cliente():
     """Elimina el último cliente (asíncrono)"""
     try:
-        datos = _cache["datos"]
-        
-        for idx in range(len(datos) - 1, -1, -1):
-            if datos[idx].get("Proveedor") == "cliente":
-                fila_numero = idx + 2
-                
-                # Eliminar del cache INMEDIATAMENTE
-                _cache["datos"].pop(idx)
-                
-                # Enviar a cola
-                _cola_escritura.put(("delete", fila_numero))
-                return True
-        
-        return False
+        return _eliminar_ultimo(lambda r: r.get("Proveedor") == "cliente") is not None
     except Exception as e:
         print(f"❌ Error: {e}")
         return False
 
-def eliminar_ultima_operacion():
-    """Elimina la última fila registrada (cualquier tipo)"""
+def eliminar_operacion(id_mov):
+    """Deshace una operación puntual por su id (el del botón Eliminar)"""
     try:
-        hoja = obtener_hoja_mes()
-        datos = hoja.get_all_records()
+        registro = _eliminar_ultimo(lambda r: r.get("id") == id_mov)
+        if registro is not None:
+            return registro["Proveedor"], float(registro["Monto"])
         
-        if len(datos) == 0:
+        # No está en el cache (p. ej. es de otro mes): solo ledger
+        mov = ledger.obtener([id_mov]).get(id_mov)
+        estado = ledger.marcar_eliminar(id_mov)
+        if estado is None:
+            return None, None
+        pendientes.quitar(id_mov)
+        proyeccion.invalidar()
+        if estado == ledger.ELIMINAR:
+            _encolar(("delete", id_mov))
+        return mov["proveedor"], float(mov["monto"])
+    
+    except Exception as e:
+        print(f"❌ Error al eliminar: {e}")
+        return None, None
+
+def eliminar_ultima_en_cache():
+    """Elimina la última fila del cache tal como está (sin sincronizar)"""
+    try:
+        ultima_fila = _eliminar_ultimo(lambda r: True)
+        if ultima_fila is None:
             return None, None
         
-        # Obtener última fila
-        ultima_fila = datos[-1]
         proveedor = ultima_fila.get("Proveedor", "")
         monto = ultima_fila.get("Monto", "0")
         
-        # Eliminar última fila (datos + 2 porque: 1 header + 1 índice base-0)
-        fila_numero = len(datos) + 1
-        hoja.delete_rows(fila_numero)
-        
-        # 🔥 Eliminar del cache también
-        if _cache["datos"]:
-            _cache["datos"].pop()
-        
-        # print(f"✅ Eliminada última fila: {proveedor} - {monto}")
         return proveedor, float(monto)
     
     except Exception as e:
         print(f"❌ Error al eliminar: {e}")
         return None, None
+
+def eliminar_ultima_operacion():
+    """Elimina la última fila registrada (cualquier tipo)"""
+    obtener_datos_cache()
+    return eliminar_ultima_en_cache()
@@ -0,0 +1,101 @@
+import time
+from collections import OrderedDict
+
+import ledger
+import metrics
+import tiendas
+
+# Telegram reintenta un update hasta 24 h; después ya no puede volver
+TTL_UPDATES = 24 * 3600
+MAXIMO_UPDATES = 50000
+
+# El mismo monto del mismo cajero dentro de esta ventana es un doble envío
+VENTANA_MONTOS = 120
+MAXIMO_MONTOS = 5000
+
+class Ventana:
+    """
+    Claves vistas con vencimiento. Todas usan el mismo TTL, así que el
+    orden de inserción es el orden de vencimiento: purgar es sacar del
+    principio. Sin awaits adentro, es atómica para el event loop.
+    """
+
+    def __init__(self, ttl, maximo):
+        self.ttl = ttl
+        self.maximo = maximo
+        self._vence = OrderedDict()
+
+    def _purgar(self, ahora):
+        while self._vence:
+            vence = next(iter(self._vence.values()))
+            if vence > ahora and len(self._vence) <= self.maximo:
+                break
+            self._vence.popitem(last=False)
+
+    def cargar(self, clave, vence):
+        self._vence[clave] = vence
+
+    def marcar(self, clave, ahora=None):
+        """True si la clave es nueva (y queda marcada hasta que venza)"""
+        ahora = ahora or time.time()
+        self._purgar(ahora)
+        if clave in self._vence:
+            return False
+        self._vence[clave] = ahora + self.ttl
+        return True
+
+    def olvidar(self, clave):
+        self._vence.pop(clave, None)
+
+    def __len__(self):
+        return len(self._vence)
+
+# Cada tantos updates nuevos se limpian los vencidos del ledger
+PURGAR_CADA = 1000
+
+_updates = Ventana(TTL_UPDATES, MAXIMO_UPDATES)
+_montos = Ventana(VENTANA_MONTOS, MAXIMO_MONTOS)
+_nuevos = {"desde_purga": 0, "cargado": False}
+
+def _cargar():
+    """Lo procesado antes de un reinicio sigue contando como visto"""
+    vigentes = []
+    for tienda in tiendas.todas():
+        with tiendas.usando(tienda):
+            vigentes += ledger.procesados_vigentes(time.time())
+    for clave, vence in sorted(vigentes, key=lambda v: v[1]):
+        _updates.cargar(clave, vence)
+
+def nuevo_update(clave):
+    """
+    False si el update ya se procesó (redelivery de Telegram o doble toque).
+    `clave`: "m:<chat>:<mensaje>" o "c:<callback query>". Se guarda en
+    el ledger de la sucursal actual.
+    """
+    if not _nuevos["cargado"]:  # Al primer update, no al importar el módulo
+        _cargar()
+        _nuevos["cargado"] = True
+
+    ahora = time.time()
+    if not _updates.marcar(clave, ahora):
+        metrics.contar("dedup.update_repetido")
+        return False
+    ledger.guardar_procesado(clave, ahora + TTL_UPDATES)
+    
+    _nuevos["desde_purga"] += 1
+    if _nuevos["desde_purga"] >= PURGAR_CADA:
+        ledger.purgar_procesados(ahora)
+        _nuevos["desde_purga"] = 0
+    return True
+
+def monto_repetido(chat_id, usuario_id, monto):
+    """True si el mismo cajero mandó el mismo monto hace menos de VENTANA_MONTOS"""
+    if _montos.marcar((chat_id, usuario_id, monto)):
+        return False
+    metrics.contar("dedup.monto_repetido")
+    return True
+
+def liberar_monto(chat_id, usuario_id, monto):
+    """El registro falló: que el reintento del cajero no se tome como doble"""
+    _montos.olvidar((chat_id, usuario_id, monto))
+
@@ -1,313 +1,437 @@
-import time
-from datetime import datetime
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+import asyncio
+import os
+import tempfile
+from datetime import date, datetime
+from telegram import Update
 from telegram.ext import ContextTypes
-from collections import deque
 
-from telegram_conect import teclado_proveedores
-from db_sheet import (
+from telegram_conect import (
+    decodificar_monto,
+    decodificar_proveedor,
+    mostrar_consultas,
+    teclado_correccion,
+    teclado_eliminar,
+    teclado_gasto,
+    teclado_ingreso,
+    teclado_pagos,
+    teclado_proveedores
+)
+from db_async import (
     registrar_ingreso, 
     registrar_egreso, 
-    eliminar_ultimo_cliente,
-    obtener_datos_cache
+    eliminar_operacion,
+    eliminar_ultima_operacion,
+    obtener_datos_cache,
+    pagar_proveedor,
+    resumen_pendientes,
+    en_hilo
 )
-from utils import formatear_monto, es_numero
-
-procesados = set()
-ultimos_ingresos = deque(maxlen=2)
-
-_totales_globales = {
-    "total_hoy": 0,
-    "total_estado": 0,
-    "ultima_actualizacion": 0
-}
-
-def obtener_totales_instantaneos():
+from services import texto_consulta
+from utils import formatear_monto
+import dedup
+import importacion
+import metrics
+import preguntas
+import sesiones
+import tiendas
+import totales
+
+async def obtener_totales_instantaneos():
     """Devuelve totales pre-calculados (instantáneo)"""
-    ahora = time.time()
-    
-    if ahora - _totales_globales["ultima_actualizacion"] > 5:
-        datos = obtener_datos_cache()
-        hoy = datetime.now().date()
-        excluir = {"Mercadería", "Desperdicio", "Mercaderia"}
-        
-        total_hoy = 0
-        total_estado = 0
-        
-        for row in datos:
-            monto_str = row.get("Monto", "")
-            if not es_numero(monto_str):
-                continue
-            
-            monto = float(monto_str)
-            prov = row.get("Proveedor", "")
-            fecha = row.get("Fecha", "")
-            
-            if prov == "cliente" and fecha:
-                try:
-                    if datetime.strptime(fecha, "%Y-%m-%d").date() == hoy:
-                        total_hoy += monto
-                except:
-                    pass
-            
-            if prov not in excluir:
-                total_estado += monto
-        
-        _totales_globales["total_hoy"] = total_hoy
-        _totales_globales["total_estado"] = total_estado
-        _totales_globales["ultima_actualizacion"] = ahora
+    await obtener_datos_cache()  # Sincroniza con la hoja cada TTL (y reconstruye si cambió)
     
-    return _totales_globales
+    return {
+        "total_hoy": totales.total_dia(),
+        "total_estado": totales.total_estado()
+    }
 
+@metrics.medido("handler.mensaje")
+@tiendas.por_chat
 async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         texto = update.message.text.strip()
+        chat_id = update.effective_chat.id
+        usuario_id = update.effective_user.id
+
+        # Redelivery de Telegram (p. ej. después de un reinicio)
+        if not dedup.nuevo_update(f"m:{chat_id}:{update.message.message_id}"):
+            return
 
         if texto.replace(",", ".").replace(".", "", 1).isdigit():
             monto_float = float(texto.replace(",", "."))
             hora_actual = datetime.now().strftime("%H:%M")
-            timestamp_actual = datetime.now()
 
-            # Anti-duplicados
-            for m, t in ultimos_ingresos:
-                if m == monto_float and (timestamp_actual - t).total_seconds() < 120:
-                    await update.message.reply_text("✅ Ya registrado")
-                    return
+            # Anti-duplicados: mismo monto del mismo cajero en la ventana
+            # (se marca antes del primer await, así dos envíos juntos no pasan)
+            if dedup.monto_repetido(chat_id, usuario_id, monto_float):
+                await update.message.reply_text("✅ Ya registrado")
+                return
 
             # Registrar
-            registrar_ingreso(monto_float, hora=hora_actual)
-            ultimos_ingresos.append((monto_float, timestamp_actual))
+            try:
+                id_mov = await registrar_ingreso(monto_float, hora=hora_actual)
+            except Exception:
+                dedup.liberar_monto(chat_id, usuario_id, monto_float)
+                raise
+            sesiones.registrar(chat_id, usuario_id, id_mov, monto_float)
 
             # Obtener totales
-            totales = obtener_totales_instantaneos()
-            totales["total_hoy"] += monto_float
-            totales["total_estado"] += monto_float
+            totales_actuales = await obtener_totales_instantaneos()
 
             mensaje = (
                 f"💰 ${formatear_monto(monto_float)} ({hora_actual})\n"
-                f"📆 Día: ${formatear_monto(totales['total_hoy'])}\n"
-                f"💰 Estado: ${formatear_monto(totales['total_estado'])}"
+                f"📆 Día: ${formatear_monto(totales_actuales['total_hoy'])}\n"
+                f"💰 Estado: ${formatear_monto(totales_actuales['total_estado'])}"
             )
 
             # 🔥 BOTONES CON ELIMINAR
-            botones = [
-                [
-                    InlineKeyboardButton("📤 Proveedor", callback_data=f"p:{monto_float}"),
-                    InlineKeyboardButton("💸 Gasto", callback_data=f"g:{monto_float}")
-                ],
-                [
-                    InlineKeyboardButton("🗑️ Eliminar", callback_data="eliminar")  # 🔥 NUEVO
-                ]
-            ]
-
-            await update.message.reply_text(mensaje, reply_markup=InlineKeyboardMarkup(botones))
+            await update.message.reply_text(mensaje, reply_markup=teclado_ingreso(monto_float, id_mov))
             return
 
+        # Preguntas en texto libre ("cuánto le pagué a Coca en marzo")
+        if preguntas.es_pregunta(texto):
+            await _responder_pregunta(update.message, texto)
+
     except Exception as e:
+        metrics.contar("handler.errores")
         print(f"❌ {e}")
 
-async def manejar_boton(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        query = update.callback_query
-        await query.answer()
-
-        if query.id in procesados:
-            return
-        procesados.add(query.id)
+async def _responder_pregunta(mensaje, texto, eco=""):
+    await obtener_datos_cache()  # Asegura el mes cargado en el ledger
 
-        data = query.data
-        
-         # ELIMINAR
-        if data == "eliminar":
-            from db_sheet import eliminar_ultima_operacion
-            
-            proveedor, monto = eliminar_ultima_operacion()
-            
-            if proveedor:
-                # Recalcular totales
-                totales = obtener_totales_instantaneos()
-                
-                mensaje = (
-                    f"🗑️ Eliminado: {proveedor} ${formatear_monto(abs(monto))}\n"
-                    f"📆 Día: ${formatear_monto(totales['total_hoy'])}\n"
-                    f"💰 Estado: ${formatear_monto(totales['total_estado'])}"
-                )
-                await query.edit_message_text(mensaje)
-            else:
-                await query.edit_message_text("⚠️ No hay nada para eliminar")
-            return
-        
-        
-        # PROVEEDOR
-        if data.startswith("p:"): 
-            _, monto = data.split(":")
-            await query.edit_message_text("📤 Proveedor:", reply_markup=teclado_proveedores(float(monto)))
+    # El modelo y los meses cerrados (snapshot) pueden usar la red: fuera del loop
+    try:
+        respuesta = await en_hilo(preguntas.responder, texto)
+    except asyncio.TimeoutError:
+        respuesta = "⏳ Preparando el histórico, probá de nuevo en un rato"
+    await mensaje.reply_text(eco + respuesta)
+
+@metrics.medido("handler.voz")
+@tiendas.por_chat
+async def manejar_voz(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pregunta por nota de voz: se transcribe y se contesta igual que el texto"""
+    try:
+        if not dedup.nuevo_update(f"m:{update.effective_chat.id}:{update.message.message_id}"):
             return
-        
-        # GASTO
-        if data.startswith("g:"):
-            _, monto = data.split(":")
-            m = float(monto)
-            
-            botones = [
-                [InlineKeyboardButton("🍻 Nosotros", callback_data=f"N:{m}")],
-                [InlineKeyboardButton("🧀 Mercadería", callback_data=f"M:{m}")],
-                [InlineKeyboardButton("🗑️ Desperdicio", callback_data=f"D:{m}")],
-                [InlineKeyboardButton("📦 Corrección", callback_data=f"C:{m}")]
-            ]
-            
-            await query.edit_message_text(f"💸 ${formatear_monto(m)}:", reply_markup=InlineKeyboardMarkup(botones))
+        if not preguntas.voz_disponible():
+            await update.message.reply_text("🎤 Las preguntas por voz necesitan CONSULTAS_INTERPRETE=openai")
             return
 
-        # PROVEEDOR
-        if data.startswith("proveedor:"):
-            _, proveedor, monto = data.split(":")
-            monto = -abs(float(monto))
-            hora = datetime.now().strftime("%H:%M")
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = os.path.join(carpeta, "voz.ogg")
+            archivo = await update.message.voice.get_file()
+            await archivo.download_to_drive(ruta)
+            texto = await en_hilo(preguntas.transcribir, ruta)
 
-            eliminar_ultimo_cliente()
-            registrar_egreso(proveedor, monto, hora=hora)
+        await _responder_pregunta(update.message, texto, eco=f"🎤 {texto}\n")
+    except Exception as e:
+        metrics.contar("handler.errores")
+        print(f"❌ {e}")
 
-            totales = obtener_totales_instantaneos()
-            totales["total_estado"] += monto
+@metrics.medido("handler.consultas")
+@tiendas.por_chat
+async def manejar_consultas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await update.message.reply_text("📊 Consultas:", reply_markup=mostrar_consultas())
+    except Exception as e:
+        metrics.contar("handler.errores")
+        print(f"❌ {e}")
 
+def _es_admin(update):
+    """ADMIN_IDS: ids de usuario de Telegram separados por coma"""
+    admins = {i.strip() for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()}
+    return str(update.effective_user.id) in admins
 
-            mensaje = (
-                f"📤 {proveedor}: ${formatear_monto(abs(monto))} ({hora})\n"
-                f"💰 Estado: ${formatear_monto(totales['total_estado'])}"
-            )
-            
-            # 🔥 BOTÓN ELIMINAR
-            botones = [[InlineKeyboardButton("🗑️ Eliminar", callback_data="eliminar")]]
-            
-            await query.edit_message_text(mensaje, reply_markup=InlineKeyboardMarkup(botones))
+async def manejar_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if not _es_admin(update):
             return
-            # await query.edit_message_text(
-            #     f"📤 {proveedor}: ${formatear_monto(abs(monto))} ({hora})\n"
-            #     f"💰 Estado: ${formatear_monto(totales['total_estado'])}"
-            # )
-            # return
-
-        # GASTOS PROPIOS / NOSOTROS
-        if data.startswith("N:"):
-            _, monto = data.split(":")
-            monto = -abs(float(monto))
-            hora = datetime.now().strftime("%H:%M")
+        await update.message.reply_text(metrics.texto_stats())
+    except Exception as e:
+        metrics.contar("handler.errores")
+        print(f"❌ {e}")
 
-            eliminar_ultimo_cliente()
-            registrar_egreso("Nosotros", monto, hora=hora)
+@metrics.medido("handler.importacion")
+@tiendas.por_chat
+async def manejar_importacion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Un admin manda un CSV de movimientos como documento"""
+    try:
+        if not _es_admin(update):
+            return
+        if not dedup.nuevo_update(f"m:{update.effective_chat.id}:{update.message.message_id}"):
+            return
 
-            totales = obtener_totales_instantaneos()
-            totales["total_estado"] += monto
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = os.path.join(carpeta, "movimientos.csv")
+            archivo = await update.message.document.get_file()
+            await archivo.download_to_drive(ruta)
+            resultado = await en_hilo(importacion.importar_archivo, ruta, timeout=None)
+
+        lineas = [
+            f"📥 {resultado['importadas']} movimientos importados "
+            f"({', '.join(sorted(resultado['meses'])) or 'ningún mes'})"
+        ]
+        if resultado["rechazadas"]:
+            lineas.append(f"⚠️ {resultado['rechazadas']} filas rechazadas:")
+            lineas += [f"• Línea {linea}: {motivo}" for linea, motivo in resultado["errores"]]
+        await update.message.reply_text("\n".join(lineas))
+    except Exception as e:
+        metrics.contar("handler.errores")
+        print(f"❌ {e}")
 
-            mensaje = (
-                f"💸 Nosotros: ${formatear_monto(abs(monto))} ({hora})\n"
-                f"💰 Estado: ${formatear_monto(totales['total_estado'])}"
-            )
-            
-            # 🔥 BOTÓN ELIMINAR
-            botones = [[InlineKeyboardButton("🗑️ Eliminar", callback_data="eliminar")]]
-            
-            await query.edit_message_text(mensaje, reply_markup=InlineKeyboardMarkup(botones))
+@metrics.medido("handler.exportacion")
+@tiendas.por_chat
+async def manejar_exportacion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/exportar [desde] [hasta] (%Y-%m-%d; por defecto el mes en curso)"""
+    try:
+        if not _es_admin(update):
             return
-        
-            # await query.edit_message_text(
-            #     f"💸 Nosotros: ${formatear_monto(abs(monto))} ({hora})\n"
-            #     f"💰 Estado: ${formatear_monto(totales['total_estado'])}"
-            # )
-            # return
-
-        # MERCADERÍA
-        if data.startswith("M:"):
-            _, monto = data.split(":")
-            monto = -abs(float(monto)) * 0.7
-            hora = datetime.now().strftime("%H:%M")
-
-            eliminar_ultimo_cliente()
-            registrar_egreso("Mercaderia", monto, hora=hora)
-
-            mensaje = f"🧀 ${formatear_monto(abs(monto))} ({hora})"
-            
-            # 🔥 BOTÓN ELIMINAR
-            botones = [[InlineKeyboardButton("🗑️ Eliminar", callback_data="eliminar")]]
-            
-            await query.edit_message_text(mensaje, reply_markup=InlineKeyboardMarkup(botones))
+        hoy = date.today()
+        argumentos = context.args or []
+        desde = argumentos[0] if argumentos else hoy.replace(day=1).isoformat()
+        hasta = argumentos[1] if len(argumentos) > 1 else hoy.isoformat()
+        try:
+            date.fromisoformat(desde), date.fromisoformat(hasta)
+        except ValueError:
+            await update.message.reply_text("⚠️ Uso: /exportar 2025-01-01 2025-12-31")
             return
-            # await query.edit_message_text(f"🧀 ${formatear_monto(abs(monto))} ({hora})")
-            # return
 
-        # DESPERDICIO
-        if data.startswith("D:"):
-            _, monto = data.split(":")
-            monto = -abs(float(monto)) * 0.7
-            hora = datetime.now().strftime("%H:%M")
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = os.path.join(carpeta, f"movimientos_{desde}_{hasta}.csv")
+            cantidad = await en_hilo(importacion.exportar_archivo, desde, hasta, ruta, timeout=None)
+            with open(ruta, "rb") as archivo:
+                await update.message.reply_document(archivo, caption=f"📤 {cantidad} movimientos")
+    except Exception as e:
+        metrics.contar("handler.errores")
+        print(f"❌ {e}")
 
-            eliminar_ultimo_cliente()
-            registrar_egreso("Desperdicio", monto, hora=hora)
+# BOTONES: una función por acción, elegida por el prefijo del callback_data
 
-            await query.edit_message_text(f"🗑️ ${formatear_monto(abs(monto))} ({hora})")
-            return
+async def _eliminar(query, arg):
+    if not arg:
+        # Botones viejos, sin id: la última carga de este cajero (o la última fila)
+        id_mov = sesiones.de(query.message.chat.id, query.from_user.id).ultimo_id
+        arg = str(id_mov) if id_mov else ""
 
-        # CORRECCIÓN DE CAJA
-        if data.startswith("C:"):
-            _, monto = data.split(":")
-            botones = [
-                [
-                    InlineKeyboardButton("Sobra", callback_data=f"S:{monto}"),
-                    InlineKeyboardButton("Falta", callback_data=f"F:{monto}")
-                ]
-            ]
-            
-            mensaje = f"🗑️ ${formatear_monto(abs(monto))} ({hora})"
-            
-            # 🔥 BOTÓN ELIMINAR
-            botones = [[InlineKeyboardButton("🗑️ Eliminar", callback_data="eliminar")]]
-            
-            await query.edit_message_text(mensaje, reply_markup=InlineKeyboardMarkup(botones))
-            return
-        
-            # await query.edit_message_text("📦 ¿Sobra/Falta?", reply_markup=InlineKeyboardMarkup(botones))
-            # return
-
-        # SOBRA EN CAJA
-        if data.startswith("S:"):
-            _, monto = data.split(":")
-            monto = abs(float(monto))
-            hora = datetime.now().strftime("%H:%M")
-
-            eliminar_ultimo_cliente()
-            registrar_egreso("Corrección Caja", monto, hora=hora)
-
-            mensaje = f"✅ Sobra: ${formatear_monto(monto)} ({hora})"
-            
-            # 🔥 BOTÓN ELIMINAR
-            botones = [[InlineKeyboardButton("🗑️ Eliminar", callback_data="eliminar")]]
-            
-            await query.edit_message_text(mensaje, reply_markup=InlineKeyboardMarkup(botones))
-            return
+    if arg:
+        proveedor, monto = await eliminar_operacion(int(arg))
+    else:
+        proveedor, monto = await eliminar_ultima_operacion()
+    
+    if proveedor:
+        # Recalcular totales
+        totales_actuales = await obtener_totales_instantaneos()
         
-            # await query.edit_message_text(f"✅ Sobra: ${formatear_monto(monto)} ({hora})")
-            # return
-
-        # FALTA EN CAJA
-        if data.startswith("F:"):
-            _, monto = data.split(":")
-            monto = -abs(float(monto))
-            hora = datetime.now().strftime("%H:%M")
-
-            eliminar_ultimo_cliente()
-            registrar_egreso("Corrección Caja", monto, hora=hora)
-
-            mensaje = f"⚠️ Falta: ${formatear_monto(abs(monto))} ({hora})"
-            
-            # 🔥 BOTÓN ELIMINAR
-            botones = [[InlineKeyboardButton("🗑️ Eliminar", callback_data="eliminar")]]
-            
-            await query.edit_message_text(mensaje, reply_markup=InlineKeyboardMarkup(botones))
+        mensaje = (
+            f"🗑️ Eliminado: {proveedor} ${formatear_monto(abs(monto))}\n"
+            f"📆 Día: ${formatear_monto(totales_actuales['total_hoy'])}\n"
+            f"💰 Estado: ${formatear_monto(totales_actuales['total_estado'])}"
+        )
+        await query.edit_message_text(mensaje)
+    else:
+        await query.edit_message_text("⚠️ No hay nada para eliminar")
+
+async def _consulta(query, clave):
+    await obtener_datos_cache()  # Asegura el mes cargado en el ledger
+    
+    # Los meses cerrados pueden necesitar bajar su snapshot: fuera del loop
+    try:
+        texto = await en_hilo(texto_consulta, clave)
+    except asyncio.TimeoutError:
+        texto = "⏳ Preparando el histórico, probá de nuevo en un rato"
+    await query.edit_message_text(texto, reply_markup=mostrar_consultas())
+
+async def _menu(query, arg):
+    # MENÚ PAGAR (desde el índice de pendientes, sin tocar la hoja)
+    if arg != "pagar":
+        return
+    resumen = await resumen_pendientes()
+    if not resumen:
+        await query.edit_message_text("✅ No hay nada pendiente de pago")
+        return
+    
+    total = sum(t for _, t in resumen.values())
+    await query.edit_message_text(
+        f"💸 A pagar: ${formatear_monto(total)}",
+        reply_markup=teclado_pagos(resumen)
+    )
+
+async def _pagar_proveedor(query, arg):
+    # PAGAR TODO LO DE UN PROVEEDOR
+    proveedor = decodificar_proveedor(arg)
+    if proveedor is None:  # Botón de antes de un reinicio: el token se busca entre los pendientes
+        proveedor = decodificar_proveedor(arg, await resumen_pendientes())
+    if proveedor is None:
+        await query.edit_message_text("⚠️ Ese proveedor ya no tiene pagos pendientes")
+        return
+    cantidad, total = await pagar_proveedor(proveedor)
+    
+    if cantidad:
+        mensaje = f"✅ {proveedor}: {cantidad} pagos por ${formatear_monto(total)}"
+    else:
+        mensaje = f"⚠️ {proveedor} no tiene pagos pendientes"
+    
+    resumen = await resumen_pendientes()
+    await query.edit_message_text(mensaje, reply_markup=teclado_pagos(resumen) if resumen else None)
+
+def _abrir_menu(query, arg):
+    """
+    "<monto>:<id de la venta>": el menú queda asociado a ese mensaje en la
+    sesión del cajero (los teclados siguientes se cachean por monto y no
+    llevan el id). Devuelve el monto.
+    """
+    token, _, id_mov = arg.partition(":")
+    if id_mov:
+        sesiones.abrir_menu(query.message.chat.id, query.from_user.id, query.message.message_id, int(id_mov))
+    return decodificar_monto(token)
+
+async def _menu_proveedor(query, arg):
+    await query.edit_message_text("📤 Proveedor:", reply_markup=teclado_proveedores(_abrir_menu(query, arg)))
+
+async def _menu_gasto(query, arg):
+    m = _abrir_menu(query, arg)
+    await query.edit_message_text(f"💸 ${formatear_monto(m)}:", reply_markup=teclado_gasto(m))
+
+async def _convertir(query, proveedor, monto, pagado=True):
+    """
+    La venta del menú era en realidad un egreso: se borra esa venta (por su
+    id, no la última del local) y se registra el egreso. Devuelve
+    (id, hora), o None si la venta ya se convirtió o se eliminó.
+    """
+    chat_id, usuario_id = query.message.chat.id, query.from_user.id
+    id_venta = sesiones.tomar_menu(chat_id, usuario_id, query.message.message_id)
+
+    if id_venta == sesiones.USADO:
+        await query.edit_message_text("⚠️ Esa venta ya se convirtió")
+        return None
+    if id_venta is None:
+        # Menú que ninguna sesión recuerda (de antes de un reinicio, o vencido):
+        # nunca la última venta del local, que puede ser de otro cajero
+        metrics.contar("sesiones.sin_menu")
+        await query.edit_message_text("⚠️ No sé qué venta convertir, cargala de nuevo")
+        return None
+
+    borrado, _ = await eliminar_operacion(id_venta)
+    if borrado is None:
+        await query.edit_message_text("⚠️ Esa venta ya no está")
+        return None
+
+    hora = datetime.now().strftime("%H:%M")
+    id_mov = await registrar_egreso(proveedor, monto, hora=hora, pagado=pagado)
+    sesiones.registrar(chat_id, usuario_id, id_mov, monto)
+    return id_mov, hora
+
+async def _egreso_proveedor(query, arg, pagado):
+    codigo, _, monto = arg.rpartition(":")
+    proveedor = decodificar_proveedor(codigo)
+    monto = -abs(decodificar_monto(monto))
+    convertido = await _convertir(query, proveedor, monto, pagado=pagado)
+    if convertido is None:
+        return
+    id_mov, hora = convertido
+
+    totales_actuales = await obtener_totales_instantaneos()
+    detalle = "" if pagado else " a pagar"
+    icono = "📤" if pagado else "⏳"
+    mensaje = (
+        f"{icono} {proveedor}: ${formatear_monto(abs(monto))}{detalle} ({hora})\n"
+        f"💰 Estado: ${formatear_monto(totales_actuales['total_estado'])}"
+    )
+    
+    # 🔥 BOTÓN ELIMINAR
+    await query.edit_message_text(mensaje, reply_markup=teclado_eliminar(id_mov))
+
+async def _egreso_pagado(query, arg):
+    await _egreso_proveedor(query, arg, pagado=True)
+
+async def _egreso_a_pagar(query, arg):
+    # A PAGAR: queda registrado como egreso pendiente
+    await _egreso_proveedor(query, arg, pagado=False)
+
+async def _nosotros(query, arg):
+    # GASTOS PROPIOS / NOSOTROS
+    monto = -abs(decodificar_monto(arg))
+    convertido = await _convertir(query, "Nosotros", monto)
+    if convertido is None:
+        return
+    id_mov, hora = convertido
+
+    totales_actuales = await obtener_totales_instantaneos()
+    mensaje = (
+        f"💸 Nosotros: ${formatear_monto(abs(monto))} ({hora})\n"
+        f"💰 Estado: ${formatear_monto(totales_actuales['total_estado'])}"
+    )
+    await query.edit_message_text(mensaje, reply_markup=teclado_eliminar(id_mov))
+
+async def _mercaderia(query, arg):
+    monto = -abs(decodificar_monto(arg)) * 0.7
+    convertido = await _convertir(query, "Mercaderia", monto)
+    if convertido is None:
+        return
+    id_mov, hora = convertido
+    await query.edit_message_text(f"🧀 ${formatear_monto(abs(monto))} ({hora})", reply_markup=teclado_eliminar(id_mov))
+
+async def _desperdicio(query, arg):
+    monto = -abs(decodificar_monto(arg)) * 0.7
+    convertido = await _convertir(query, "Desperdicio", monto)
+    if convertido is None:
+        return
+    _, hora = convertido
+    await query.edit_message_text(f"🗑️ ${formatear_monto(abs(monto))} ({hora})")
+
+async def _correccion(query, arg):
+    # CORRECCIÓN DE CAJA
+    await query.edit_message_text("📦 ¿Sobra/Falta?", reply_markup=teclado_correccion(decodificar_monto(arg)))
+
+async def _sobra(query, arg):
+    monto = abs(decodificar_monto(arg))
+    convertido = await _convertir(query, "Corrección Caja", monto)
+    if convertido is None:
+        return
+    id_mov, hora = convertido
+    await query.edit_message_text(f"✅ Sobra: ${formatear_monto(monto)} ({hora})", reply_markup=teclado_eliminar(id_mov))
+
+async def _falta(query, arg):
+    monto = -abs(decodificar_monto(arg))
+    convertido = await _convertir(query, "Corrección Caja", monto)
+    if convertido is None:
+        return
+    id_mov, hora = convertido
+    await query.edit_message_text(f"⚠️ Falta: ${formatear_monto(abs(monto))} ({hora})", reply_markup=teclado_eliminar(id_mov))
+
+# prefijo -> acción (los nombres largos son de botones enviados antes del formato compacto)
+_ACCIONES = {
+    "e": _eliminar, "eliminar": _eliminar,
+    "q": _consulta, "consulta": _consulta,
+    "m": _menu, "menu": _menu,
+    "x": _pagar_proveedor, "pagarprov": _pagar_proveedor,
+    "p": _menu_proveedor,
+    "g": _menu_gasto,
+    "v": _egreso_pagado, "proveedor": _egreso_pagado,
+    "a": _egreso_a_pagar, "apagar": _egreso_a_pagar,
+    "N": _nosotros,
+    "M": _mercaderia,
+    "D": _desperdicio,
+    "C": _correccion,
+    "S": _sobra,
+    "F": _falta
+}
+
+@metrics.medido("handler.boton")
+@tiendas.por_chat
+async def manejar_boton(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        query = update.callback_query
+        await query.answer()
+
+        if not dedup.nuevo_update(f"c:{query.id}"):
             return
-        
-            # await query.edit_message_text(f"⚠️ Falta: ${formatear_monto(abs(monto))} ({hora})")
-            # return
+
+        prefijo, _, arg = query.data.partition(":")
+        accion = _ACCIONES.get(prefijo)
+        if accion is not None:
+            await accion(query, arg)
 
     except Exception as e:
+        metrics.contar("handler.errores")
         print(f"❌ {e}")
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+import gspread
+import numpy as np
+import pandas as pd
+
+import cuota
+import db_sheet
+import tiendas
+
+# Junto al ledger, en el volumen ./logs (las otras sucursales en logs/<tienda>/historico)
+HISTORICO_DIR = os.getenv("HISTORICO_DIR", "logs/historico")
+
+# Cada cuánto se vuelve a mirar la fecha de modificación de la planilla
+TTL_MODIFICACION = 600
+# Aunque la planilla cambie (cambia siempre, por el mes en curso), un mes
+# cerrado se revalida como mucho una vez en este intervalo
+REVALIDAR_HORAS = 24
+
+# Cambia cuando cambia cómo se arma el snapshot: los de otra versión se rehacen
+VERSION_SNAPSHOT = 2
+
+# tienda -> modifiedTime de su planilla y cuándo se consultó
+_estados = {}
+_lock = threading.Lock()
+
+def _ruta(nombre):
+    return os.path.join(tiendas.ruta(HISTORICO_DIR), nombre)
+
+def _leer_indice():
+    try:
+        with open(_ruta("indice.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _guardar_indice(indice):
+    temporal = _ruta("indice.json.tmp")
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(indice, f, indent=1, sort_keys=True)
+    os.replace(temporal, _ruta("indice.json"))
+
+def modificacion_planilla():
+    """modifiedTime de la planilla (Drive), cacheado TTL_MODIFICACION segundos"""
+    ahora = time.time()
+    estado = _estados.setdefault(tiendas.actual(), {"modificado": None, "consultado": 0})
+    if estado["modificado"] is None or ahora - estado["consultado"] > TTL_MODIFICACION:
+        estado["modificado"] = cuota.llamar(
+            "sheets.get_lastUpdateTime", db_sheet.abrir_planilla().get_lastUpdateTime
+        )
+        estado["consultado"] = ahora
+    return estado["modificado"]
+
+# Con UNFORMATTED_VALUE una fecha tipeada a mano llega como número de serie
+# (días desde el 30/12/1899) y una hora como fracción del día
+_EPOCA_SHEETS = date(1899, 12, 30)
+
+def _serial(valor):
+    """El número de serie de la celda (también como texto), o None"""
+    if isinstance(valor, bool):
+        return None
+    if isinstance(valor, (int, float)):
+        return valor
+    try:
+        return float(valor) if str(valor).replace(".", "", 1).isdigit() else None
+    except ValueError:
+        return None
+
+def _fecha(valor):
+    """np.datetime64 del día, o None si no es una fecha real"""
+    serial = _serial(valor)
+    try:
+        if serial is not None:
+            fecha = _EPOCA_SHEETS + timedelta(days=int(serial))
+        else:
+            fecha = date.fromisoformat(str(valor).strip())
+    except (ValueError, OverflowError):
+        return None
+    # Fuera de esto, el datetime64[ns] de frame_cerrado desborda
+    if not pd.Timestamp.min.date() <= fecha <= pd.Timestamp.max.date():
+        return None
+    return np.datetime64(fecha, "D")
+
+def _hora(valor):
+    serial = _serial(valor)
+    if serial is not None and serial < 1:
+        return int(serial * 24 + 1e-9)
+    hora = str(valor).split(":")[0]
+    return int(hora) if hora.isdigit() and int(hora) < 24 else -1
+
+def _columnas(valores):
+    """Filas crudas de la hoja (sin encabezado) -> arrays columnares tipados"""
+    fechas, horas, proveedores, montos, pagados = [], [], [], [], []
+
+    for fila in valores:
+        fila = list(fila) + [""] * (5 - len(fila))
+        try:
+            monto = float(fila[3])
+        except ValueError:
+            continue
+        fecha = _fecha(fila[0])
+        if fecha is None:
+            continue
+        fechas.append(fecha)
+        horas.append(_hora(fila[1]))
+        proveedores.append(str(fila[2]))
+        montos.append(monto)
+        pagados.append(str(fila[4]).strip("'").lower() == "true")
+
+    categorias, codigos = np.unique(np.array(proveedores, dtype=str), return_inverse=True)
+    return {
+        "fecha": np.array(fechas, dtype="datetime64[D]"),
+        "hora": np.array(horas, dtype=np.int8),
+        "proveedor": codigos.astype(np.int16),
+        "proveedores": categorias,
+        "monto": np.array(montos, dtype=np.float64),
+        "pagado": np.array(pagados, dtype=bool)
+    }
+
+def _descargar(mes):
+    """Valores de la hoja del mes ([] si la hoja no existe)"""
+    try:
+        hoja = cuota.llamar("sheets.worksheet", db_sheet.abrir_planilla().worksheet, mes)
+    except gspread.WorksheetNotFound:
+        return []
+    valores = cuota.llamar(
+        "sheets.get_all_values", hoja.get_all_values, value_render_option="UNFORMATTED_VALUE"
+    )
+    return valores[1:]
+
+def _hash(valores):
+    return hashlib.sha1(json.dumps(valores, default=str).encode()).hexdigest()
+
+def asegurar_snapshot(mes):
+    """
+    Devuelve la ruta del snapshot de un mes cerrado. Solo se descarga la
+    hoja si no hay snapshot o si la planilla se modificó desde el último
+    (y pasó REVALIDAR_HORAS); si el contenido no cambió no se reescribe.
+    """
+    with _lock:
+        os.makedirs(tiendas.ruta(HISTORICO_DIR), exist_ok=True)
+        indice = _leer_indice()
+        meta = indice.get(mes)
+        archivo = _ruta(f"{mes}.npz")
+
+        if meta and meta.get("version") == VERSION_SNAPSHOT and os.path.exists(archivo):
+            if time.time() - meta["validado"] < REVALIDAR_HORAS * 3600:
+                return archivo
+            modificado = modificacion_planilla()
+            if modificado == meta["modificado"]:
+                return archivo
+        else:
+            modificado = modificacion_planilla()
+
+        valores = _descargar(mes)
+        firma = _hash(valores)
+
+        if (
+            not meta or meta["hash"] != firma or meta.get("version") != VERSION_SNAPSHOT
+            or not os.path.exists(archivo)
+        ):
+            temporal = _ruta(f"{mes}.tmp.npz")
+            np.savez_compressed(temporal, **_columnas(valores))
+            os.replace(temporal, archivo)
+
+        indice[mes] = {
+            "modificado": modificado, "validado": time.time(), "hash": firma, "version": VERSION_SNAPSHOT
+        }
+        _guardar_indice(indice)
+        return archivo
+
+def invalidar(mes):
+    """El mes cambió por fuera de la hoja (importación): el snapshot se vuelve a bajar"""
+    with _lock:
+        indice = _leer_indice()
+        if indice.pop(mes, None) is not None:
+            _guardar_indice(indice)
+
+def frame_cerrado(mes):
+    """DataFrame de un mes cerrado, leído del snapshot local"""
+    with np.load(asegurar_snapshot(mes)) as z:
+        horas = z["hora"].astype("float32")
+        horas[horas < 0] = np.nan
+        return pd.DataFrame({
+            "fecha": z["fecha"].astype("datetime64[ns]"),
+            "hora": pd.array(horas, dtype="Int8"),
+            "proveedor": pd.Categorical.from_codes(z["proveedor"], categories=z["proveedores"]),
+            "monto": z["monto"],
+            "pagado": z["pagado"]
+        })
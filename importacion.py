@@ -0,0 +1,239 @@
+"""
+Importación y exportación de movimientos en CSV, en streaming.
+
+    python importacion.py importar movimientos.csv [--tienda nombre]
+    python importacion.py exportar 2024-01-01 2024-12-31 [salida.csv] [--tienda nombre]
+
+Desde la línea de comandos va con el bot apagado (comparten ledger y
+planilla). Con el bot andando, un admin manda el CSV como documento o
+pide /exportar desde hasta.
+"""
+import argparse
+import csv
+import itertools
+import sys
+from datetime import date
+
+import db_sheet
+import historico
+import ledger
+import metrics
+import tiendas
+from utils import es_numero
+
+# Filas por transacción del ledger (y memoria máxima de la importación)
+BLOQUE = 5000
+
+# Encabezados aceptados -> columna del ledger (los de la hoja y los de un extracto)
+_ALIAS = {
+    "fecha": "fecha",
+    "hora": "hora",
+    "proveedor": "proveedor",
+    "concepto": "proveedor",
+    "descripcion": "proveedor",
+    "descripción": "proveedor",
+    "monto": "monto",
+    "importe": "monto",
+    "pagado": "pagado"
+}
+_ORDEN = ["fecha", "hora", "proveedor", "monto", "pagado"]  # Sin encabezado: el de la hoja
+
+_NO_PAGADO = {"false", "0", "no", "'false"}
+
+# Errores que se informan (el resto solo se cuenta)
+ERRORES_MOSTRADOS = 10
+
+def _fecha(valor):
+    """%Y-%m-%d o %d/%m/%Y -> %Y-%m-%d (None si no es fecha)"""
+    valor = valor.strip()
+    try:
+        return date.fromisoformat(valor).isoformat()
+    except ValueError:
+        pass
+    # strptime es lento para un año de filas
+    dia, _, resto = valor.partition("/")
+    mes, _, anio = resto.partition("/")
+    try:
+        return date(int(anio), int(mes), int(dia)).isoformat()
+    except ValueError:
+        return None
+
+def _columnas(primera):
+    """Índice de cada columna según el encabezado, o None si la primera fila ya es un dato"""
+    columnas = {}
+    for i, nombre in enumerate(primera):
+        nombre = _ALIAS.get(nombre.strip().lower())
+        if nombre:
+            columnas.setdefault(nombre, i)
+    if "fecha" not in columnas or "monto" not in columnas:
+        return None
+    return columnas
+
+def _fila(valores, columnas):
+    """Fila del CSV -> (fecha, hora, proveedor, monto, pagado), o el motivo del rechazo"""
+    def campo(nombre):
+        i = columnas.get(nombre)
+        return valores[i].strip() if i is not None and i < len(valores) else ""
+
+    fecha = _fecha(campo("fecha"))
+    if fecha is None:
+        return f"fecha inválida {campo('fecha')!r}"
+    monto = campo("monto")
+    if not es_numero(monto):
+        return f"monto inválido {monto!r}"
+    proveedor = campo("proveedor")
+    if not proveedor:
+        return "sin proveedor"
+    pagado = "False" if campo("pagado").lower() in _NO_PAGADO else "True"
+    return (fecha, campo("hora"), proveedor, float(monto), pagado)
+
+def _lector(archivo):
+    """csv.reader con el separador detectado en la primera línea (, ; o tab)"""
+    primera = archivo.readline()
+    try:
+        dialecto = csv.Sniffer().sniff(primera, delimiters=",;\t")
+    except csv.Error:
+        dialecto = csv.excel
+    return csv.reader(itertools.chain([primera], archivo), dialecto)
+
+def _guardar(bloque, meses):
+    ids = ledger.guardar_movimientos(bloque)
+    db_sheet.encolar_nuevas(ids)
+    meses.update(fila[0][:7] for fila in bloque)
+
+def importar(archivo):
+    """
+    Lee un CSV (archivo de texto abierto) de a BLOQUE filas: cada bloque es
+    una transacción del ledger y sale a la hoja en escrituras por rango, no
+    fila por fila. Las filas inválidas se saltean y se informan.
+    """
+    lector = _lector(archivo)
+    resultado = {"importadas": 0, "rechazadas": 0, "errores": [], "meses": set()}
+
+    primera = next(lector, None)
+    if primera is None:
+        return resultado
+    columnas = _columnas(primera)
+    if columnas is None:
+        columnas = {nombre: i for i, nombre in enumerate(_ORDEN)}
+        filas, inicio = itertools.chain([primera], lector), 1
+    else:
+        filas, inicio = lector, 2
+
+    bloque = []
+    with metrics.medir("importacion.archivo"):
+        for linea, valores in enumerate(filas, start=inicio):
+            if not any(v.strip() for v in valores):
+                continue
+            fila = _fila(valores, columnas)
+            if isinstance(fila, str):
+                resultado["rechazadas"] += 1
+                if len(resultado["errores"]) < ERRORES_MOSTRADOS:
+                    resultado["errores"].append((linea, fila))
+                continue
+
+            bloque.append(fila)
+            if len(bloque) >= BLOQUE:
+                _guardar(bloque, resultado["meses"])
+                resultado["importadas"] += len(bloque)
+                bloque = []
+
+        if bloque:
+            _guardar(bloque, resultado["meses"])
+            resultado["importadas"] += len(bloque)
+
+    # Los snapshots de meses cerrados y el cache del mes ya no están al día
+    for mes in resultado["meses"]:
+        historico.invalidar(mes)
+    db_sheet.olvidar_cache()
+
+    metrics.contar("importacion.filas", resultado["importadas"])
+    metrics.contar("importacion.rechazadas", resultado["rechazadas"])
+    return resultado
+
+def importar_archivo(ruta):
+    # utf-8-sig: los CSV de Excel vienen con BOM
+    with open(ruta, encoding="utf-8-sig", newline="") as archivo:
+        return importar(archivo)
+
+def _meses(desde, hasta):
+    """Meses (%Y-%m) entre dos fechas %Y-%m-%d, inclusive"""
+    inicio, fin = date.fromisoformat(desde), date.fromisoformat(hasta)
+    return [
+        f"{m // 12:04d}-{m % 12 + 1:02d}"
+        for m in range(inicio.year * 12 + inicio.month - 1, fin.year * 12 + fin.month)
+    ]
+
+def exportar(desde, hasta, salida):
+    """
+    Escribe en `salida` (archivo de texto) los movimientos entre dos fechas
+    %Y-%m-%d, de a BLOQUE filas. Los meses que solo estaban en la hoja se
+    traen al ledger primero. Devuelve la cantidad de filas.
+    """
+    for mes in _meses(desde, hasta):
+        db_sheet.traer_mes(mes)
+
+    escritor = csv.writer(salida)
+    escritor.writerow(ledger.ENCABEZADO)
+    cantidad = 0
+    despues = ("", 0)
+    with metrics.medir("exportacion.archivo"):
+        while True:
+            filas = ledger.movimientos_rango(desde, hasta, despues, BLOQUE)
+            if not filas:
+                break
+            escritor.writerows(
+                (f["fecha"], f["hora"], f["proveedor"], f["monto"], f["pagado"]) for f in filas
+            )
+            cantidad += len(filas)
+            despues = (filas[-1]["fecha"], filas[-1]["id"])
+
+    metrics.contar("exportacion.filas", cantidad)
+    return cantidad
+
+def exportar_archivo(desde, hasta, ruta):
+    with open(ruta, "w", encoding="utf-8", newline="") as salida:
+        return exportar(desde, hasta, salida)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tienda", default=tiendas.PRINCIPAL, choices=tiendas.todas())
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    p_importar = comandos.add_parser("importar", help="cargar un CSV de movimientos")
+    p_importar.add_argument("archivo")
+    p_importar.add_argument("--drenado", type=float, default=600, help="segundos máximos esperando la hoja")
+
+    p_exportar = comandos.add_parser("exportar", help="bajar movimientos a CSV")
+    p_exportar.add_argument("desde", help="%%Y-%%m-%%d")
+    p_exportar.add_argument("hasta", help="%%Y-%%m-%%d")
+    p_exportar.add_argument("salida", nargs="?", help="archivo (por defecto, la salida estándar)")
+    args = parser.parse_args()
+
+    with tiendas.usando(args.tienda):
+        if args.comando == "exportar":
+            if args.salida:
+                cantidad = exportar_archivo(args.desde, args.hasta, args.salida)
+            else:
+                cantidad = exportar(args.desde, args.hasta, sys.stdout)
+            print(f"✅ {cantidad} movimientos exportados", file=sys.stderr)
+            return 0
+
+        db_sheet.iniciar()
+        resultado = importar_archivo(args.archivo)
+        print(f"✅ {resultado['importadas']} movimientos importados, {resultado['rechazadas']} rechazados")
+        for linea, motivo in resultado["errores"]:
+            print(f"⚠️ Línea {linea}: {motivo}")
+
+    # El proceso termina cuando la hoja tiene todo (o se cumple el plazo)
+    db_sheet.detener(args.drenado)
+    with tiendas.usando(args.tienda):
+        faltan = len(ledger.sin_replicar())
+    if faltan:
+        print(f"❌ Quedaron {faltan} movimientos sin escribir; se retoman al arrancar el bot")
+        return 1
+    print("✅ Hoja actualizada")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
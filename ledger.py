@@ -0,0 +1,612 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+
+import tiendas
+
+# Vive en el volumen ./logs para sobrevivir a reinicios del contenedor
+# (las otras sucursales en logs/<tienda>/ledger.db)
+LEDGER_PATH = os.getenv("LEDGER_PATH", "logs/ledger.db")
+
+# Columnas de la hoja, en orden
+ENCABEZADO = ["Fecha", "Hora", "Proveedor", "Monto", "Pagado"]
+COL_PAGADO = ENCABEZADO.index("Pagado") + 1
+
+# Estados de un movimiento respecto de la hoja de Google
+PENDIENTE = "pendiente"        # guardado local, todavía no está en la hoja
+SINCRONIZADO = "sincronizado"  # escrito en la hoja, en la fila `fila`
+ELIMINAR = "eliminar"          # borrado local, falta borrarlo de la hoja
+ELIMINADO = "eliminado"        # borrado en ambos lados
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS movimientos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mes TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    hora TEXT NOT NULL,
+    proveedor TEXT NOT NULL,
+    monto REAL NOT NULL,
+    pagado TEXT NOT NULL,
+    fila INTEGER,
+    estado TEXT NOT NULL DEFAULT 'pendiente'
+);
+CREATE INDEX IF NOT EXISTS idx_movimientos_fecha ON movimientos(fecha);
+CREATE INDEX IF NOT EXISTS idx_movimientos_proveedor ON movimientos(proveedor, fecha);
+CREATE INDEX IF NOT EXISTS idx_movimientos_mes ON movimientos(mes, estado);
+
+CREATE TABLE IF NOT EXISTS meses_importados (
+    mes TEXT PRIMARY KEY,
+    ultima_fila INTEGER NOT NULL
+);
+
+-- Cambios de celdas de filas ya escritas, hasta que la hoja los confirma
+CREATE TABLE IF NOT EXISTS actualizaciones (
+    id_mov INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    valor TEXT NOT NULL,
+    PRIMARY KEY (id_mov, col)
+);
+
+-- Updates de Telegram ya procesados (dedup que sobrevive reinicios)
+CREATE TABLE IF NOT EXISTS procesados (
+    clave TEXT PRIMARY KEY,
+    vence REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS fallidos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    operacion TEXT NOT NULL,
+    error TEXT NOT NULL,
+    fecha TEXT NOT NULL
+);
+
+-- Cierre diario: totales de caja del día y acumulados del mes hasta ese día
+CREATE TABLE IF NOT EXISTS cierres (
+    fecha TEXT PRIMARY KEY,
+    mes TEXT NOT NULL,
+    ingreso REAL NOT NULL,
+    egreso REAL NOT NULL,
+    ventas INTEGER NOT NULL,
+    ingreso_mes REAL NOT NULL,
+    egreso_mes REAL NOT NULL,
+    a_pagar REAL NOT NULL,
+    cerrado TEXT NOT NULL
+);
+
+-- Un movimiento que aparece, desaparece o cambia en un día ya cerrado
+-- invalida ese cierre y los siguientes del mes (arrastran el acumulado)
+CREATE TRIGGER IF NOT EXISTS cierres_alta AFTER INSERT ON movimientos
+WHEN new.estado IN ('pendiente', 'sincronizado')
+BEGIN
+    DELETE FROM cierres WHERE mes = new.mes AND fecha >= new.fecha;
+END;
+
+CREATE TRIGGER IF NOT EXISTS cierres_cambio AFTER UPDATE OF estado, monto, proveedor ON movimientos
+WHEN (old.estado IN ('pendiente', 'sincronizado')) != (new.estado IN ('pendiente', 'sincronizado'))
+    OR old.monto != new.monto OR old.proveedor != new.proveedor
+BEGIN
+    DELETE FROM cierres WHERE mes = old.mes AND fecha >= old.fecha;
+END;
+"""
+
+_VISIBLES = (PENDIENTE, SINCRONIZADO)
+
+# Una conexión por sucursal, compartida entre el event loop y los escritores
+_conexiones = {}
+_lock = threading.Lock()
+
+# Se incrementa cada vez que cambian los movimientos visibles de un mes,
+# para que quien cachee derivados (analytics) sepa cuándo recalcular
+_versiones = defaultdict(int)
+
+def version(mes):
+    return _versiones[(tiendas.actual(), mes)]
+
+def _tocar(mes):
+    _versiones[(tiendas.actual(), mes)] += 1
+
+def _conectar():
+    """Conexión de la sucursal actual (se llama con _lock tomado)"""
+    tienda = tiendas.actual()
+    if tienda not in _conexiones:
+        ruta = tiendas.ruta(LEDGER_PATH, tienda)
+        carpeta = os.path.dirname(ruta)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+
+        con = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")  # WAL: un crash del proceso no pierde commits
+        con.executescript(_ESQUEMA)
+        _conexiones[tienda] = con
+    return _conexiones[tienda]
+
+def a_registro(row):
+    """Fila del ledger -> registro tipado con las columnas de la hoja"""
+    return {
+        "id": row["id"],
+        "Fecha": date.fromisoformat(row["fecha"]),
+        "Hora": row["hora"],
+        "Proveedor": row["proveedor"],
+        "Monto": row["monto"],
+        "Pagado": row["pagado"].lower() == "true"
+    }
+
+def _es_fecha(valor):
+    try:
+        date.fromisoformat(str(valor))
+        return True
+    except ValueError:
+        return False
+
+def firma(fecha, proveedor, monto):
+    """Resumen de una fila para detectar ediciones en la hoja"""
+    if not _es_fecha(fecha):
+        return None
+    try:
+        return f"{fecha}|{proveedor}|{float(monto):.2f}"
+    except (TypeError, ValueError):
+        return None
+
+def guardar_movimiento(fecha, hora, proveedor, monto, pagado):
+    """Commit local del movimiento, devuelve su id"""
+    with _lock:
+        cur = _conectar().execute(
+            "INSERT INTO movimientos (mes, fecha, hora, proveedor, monto, pagado, estado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (fecha[:7], fecha, hora, proveedor, float(monto), str(pagado), PENDIENTE)
+        )
+        _tocar(fecha[:7])
+        return cur.lastrowid
+
+def guardar_movimientos(filas):
+    """
+    Muchos movimientos [(fecha, hora, proveedor, monto, pagado)] en una sola
+    transacción (importaciones). Devuelve sus ids, en el mismo orden.
+    """
+    filas = list(filas)
+    if not filas:
+        return []
+    with _lock:
+        con = _conectar()
+        con.execute("BEGIN")
+        # AUTOINCREMENT con un solo escritor: los ids salen consecutivos
+        row = con.execute("SELECT seq FROM sqlite_sequence WHERE name = 'movimientos'").fetchone()
+        primero = (row[0] if row else 0) + 1
+        con.executemany(
+            "INSERT INTO movimientos (mes, fecha, hora, proveedor, monto, pagado, estado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (fecha[:7], fecha, hora, proveedor, float(monto), str(pagado), PENDIENTE)
+                for fecha, hora, proveedor, monto, pagado in filas
+            ]
+        )
+        con.execute("COMMIT")
+        for mes in {fila[0][:7] for fila in filas}:
+            _tocar(mes)
+    return list(range(primero, primero + len(filas)))
+
+def movimientos_mes(mes):
+    """Movimientos visibles del mes, en el orden en que quedan en la hoja"""
+    with _lock:
+        rows = _conectar().execute(
+            "SELECT * FROM movimientos WHERE mes = ? AND estado IN (?, ?) "
+            "ORDER BY fila IS NULL, fila, id",
+            (mes, *_VISIBLES)
+        ).fetchall()
+    return [a_registro(r) for r in rows]
+
+def obtener(ids):
+    """id -> fila del ledger, para los ids pedidos"""
+    ids = list(ids)
+    if not ids:
+        return {}
+    marcas = ",".join("?" * len(ids))
+    with _lock:
+        rows = _conectar().execute(
+            f"SELECT * FROM movimientos WHERE id IN ({marcas})", ids
+        ).fetchall()
+    return {r["id"]: r for r in rows}
+
+def marcar_eliminar(id_mov):
+    """
+    Oculta el movimiento y devuelve su nuevo estado (None si no existía):
+    ELIMINADO si nunca llegó a la hoja (el append en cola se descarta solo),
+    ELIMINAR si ya está escrito y hay que borrar su fila.
+    """
+    with _lock:
+        con = _conectar()
+        con.execute("BEGIN")
+        row = con.execute(
+            "SELECT mes, estado, fila FROM movimientos WHERE id = ?", (id_mov,)
+        ).fetchone()
+        if row is None or row["estado"] not in _VISIBLES:
+            con.execute("COMMIT")
+            return None
+
+        estado = ELIMINADO if row["fila"] is None else ELIMINAR
+        con.execute("UPDATE movimientos SET estado = ? WHERE id = ?", (estado, id_mov))
+        con.execute("COMMIT")
+        _tocar(row["mes"])
+        return estado
+
+def valor_pagado(pagado):
+    """Cómo se escribe Pagado en la hoja (texto, para que no lo convierta)"""
+    return f"'{str(pagado).lower()}"
+
+def marcar_pagados(ids, pagado=True):
+    """
+    Marca varios egresos en una sola transacción, junto con los updates
+    que la hoja tiene que recibir. Devuelve esos updates [(id, col, valor)].
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+    marcas = ",".join("?" * len(ids))
+    actualizaciones = [(id_mov, COL_PAGADO, valor_pagado(pagado)) for id_mov in ids]
+    with _lock:
+        con = _conectar()
+        con.execute("BEGIN")
+        con.execute(
+            f"UPDATE movimientos SET pagado = ? WHERE id IN ({marcas})", (str(pagado), *ids)
+        )
+        con.executemany(
+            "INSERT OR REPLACE INTO actualizaciones (id_mov, col, valor) VALUES (?, ?, ?)",
+            actualizaciones
+        )
+        meses = [r["mes"] for r in con.execute(
+            f"SELECT DISTINCT mes FROM movimientos WHERE id IN ({marcas})", ids
+        )]
+        con.execute("COMMIT")
+    for mes in meses:
+        _tocar(mes)
+    return actualizaciones
+
+def confirmar_actualizaciones(actualizaciones):
+    """
+    Saca de la tabla los updates [(id, col, valor)] que ya están en la hoja.
+    Si la celda volvió a cambiar mientras tanto, el update nuevo se queda.
+    """
+    if not actualizaciones:
+        return
+    with _lock:
+        con = _conectar()
+        con.execute("BEGIN")
+        con.executemany(
+            "DELETE FROM actualizaciones WHERE id_mov = ? AND col = ? AND valor = ?",
+            actualizaciones
+        )
+        con.execute("COMMIT")
+
+def marcar_replicados(mes, filas_por_id):
+    """
+    Cursor de sincronización: [(id, fila en la hoja)]. Devuelve los ids que
+    se cancelaron mientras se escribían, que ahora hay que borrar de la hoja.
+    """
+    with _lock:
+        con = _conectar()
+        con.execute("BEGIN")
+        ids = [id_mov for id_mov, _ in filas_por_id]
+        cancelados = [
+            r["id"] for r in con.execute(
+                f"SELECT id FROM movimientos WHERE estado = ? AND id IN ({','.join('?' * len(ids))})",
+                (ELIMINADO, *ids)
+            )
+        ]
+        con.executemany(
+            "UPDATE movimientos SET fila = ?, estado = CASE estado "
+            "WHEN ? THEN ? WHEN ? THEN ? ELSE estado END "
+            "WHERE id = ?",
+            [
+                (fila, PENDIENTE, SINCRONIZADO, ELIMINADO, ELIMINAR, id_mov)
+                for id_mov, fila in filas_por_id
+            ]
+        )
+        con.execute(
+            "UPDATE meses_importados SET ultima_fila = MAX(ultima_fila, ?) WHERE mes = ?",
+            (max(fila for _, fila in filas_por_id), mes)
+        )
+        con.execute("COMMIT")
+        return cancelados
+
+def marcar_borrados(mes, borrados, cancelados=()):
+    """
+    Registra filas borradas de la hoja [(id, fila)] y corre hacia arriba
+    las filas de abajo. `cancelados` son ids que nunca llegaron a escribirse.
+    """
+    with _lock:
+        con = _conectar()
+        con.execute("BEGIN")
+        for id_mov, fila in sorted(borrados, key=lambda b: b[1], reverse=True):
+            con.execute(
+                "UPDATE movimientos SET estado = ?, fila = NULL WHERE id = ?",
+                (ELIMINADO, id_mov)
+            )
+            con.execute(
+                "UPDATE movimientos SET fila = fila - 1 WHERE mes = ? AND fila > ?",
+                (mes, fila)
+            )
+        con.executemany(
+            "UPDATE movimientos SET estado = ? WHERE id = ?",
+            [(ELIMINADO, id_mov) for id_mov in cancelados]
+        )
+        con.execute(
+            "UPDATE meses_importados SET ultima_fila = ultima_fila - ? WHERE mes = ?",
+            (len(borrados), mes)
+        )
+        con.execute("COMMIT")
+
+def sin_replicar():
+    """Operaciones que quedaron a medio camino (para retomar al arrancar)"""
+    with _lock:
+        return _conectar().execute(
+            "SELECT id, estado FROM movimientos WHERE estado IN (?, ?) ORDER BY id",
+            (PENDIENTE, ELIMINAR)
+        ).fetchall()
+
+def actualizaciones_pendientes():
+    """[(id, col, valor)] que todavía no se confirmaron en la hoja"""
+    with _lock:
+        return [
+            tuple(r) for r in _conectar().execute(
+                "SELECT id_mov, col, valor FROM actualizaciones ORDER BY rowid"
+            )
+        ]
+
+def movimientos_rango(desde, hasta, despues=("", 0), limite=1000):
+    """
+    Movimientos visibles entre dos fechas (inclusive), ordenados por
+    (fecha, id) y a partir de `despues`: se recorren de a `limite` filas
+    sin dejar el lock tomado entre tramos.
+    """
+    with _lock:
+        return _conectar().execute(
+            "SELECT id, fecha, hora, proveedor, monto, pagado FROM movimientos "
+            "WHERE fecha BETWEEN ? AND ? AND estado IN (?, ?) AND (fecha, id) > (?, ?) "
+            "ORDER BY fecha, id LIMIT ?",
+            (desde, hasta, *_VISIBLES, *despues, limite)
+        ).fetchall()
+
+def mes_importado(mes):
+    with _lock:
+        return _conectar().execute(
+            "SELECT 1 FROM meses_importados WHERE mes = ?", (mes,)
+        ).fetchone() is not None
+
+def ultima_fila(mes):
+    """Última fila de la hoja que el ledger conoce (1 = solo encabezado)"""
+    with _lock:
+        row = _conectar().execute(
+            "SELECT ultima_fila FROM meses_importados WHERE mes = ?", (mes,)
+        ).fetchone()
+    return row[0] if row else 1
+
+def firmas(mes, desde):
+    """fila -> firma de las filas escritas en la hoja a partir de `desde`"""
+    with _lock:
+        rows = _conectar().execute(
+            "SELECT fila, fecha, proveedor, monto FROM movimientos "
+            "WHERE mes = ? AND fila >= ? AND estado IN (?, ?)",
+            (mes, desde, SINCRONIZADO, ELIMINAR)
+        ).fetchall()
+    return {r["fila"]: firma(r["fecha"], r["proveedor"], r["monto"]) for r in rows}
+
+def _pagado_de_hoja(valor):
+    """El Pagado que escribe el bot lleva un apóstrofo (ver valor_pagado)"""
+    return str(valor).lstrip("'")
+
+def _insertar_de_hoja(con, mes, filas):
+    """Inserta filas leídas de la hoja [(fila, [Fecha, Hora, Proveedor, Monto, Pagado])]"""
+    from utils import es_numero
+
+    con.executemany(
+        "INSERT INTO movimientos (mes, fecha, hora, proveedor, monto, pagado, fila, estado) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (mes, str(v[0]), str(v[1]), str(v[2]), float(v[3]), _pagado_de_hoja(v[4]), fila, SINCRONIZADO)
+            for fila, v in filas
+            if es_numero(v[3]) and _es_fecha(v[0])
+        ]
+    )
+
+def _como_valores(registro):
+    return [registro.get(c, "") for c in ENCABEZADO]
+
+def importar_mes(mes, registros):
+    """
+    Concilia el ledger con la hoja del mes (resultado de get_all_records),
+    sea la carga inicial o después de una edición a mano. Las filas que
+    siguen en la hoja (misma firma) conservan su id y pasan a su fila
+    actual, así los botones y los borrados en cola apuntan a la fila
+    correcta; las que ya no están se ocultan (un borrado en cola se da por
+    hecho) y las que el ledger no conocía se agregan.
+    """
+    with _lock:
+        con = _conectar()
+        con.execute("BEGIN")
+        conocidas = con.execute(
+            "SELECT id, fila, fecha, proveedor, monto FROM movimientos "
+            "WHERE mes = ? AND fila IS NOT NULL AND estado IN (?, ?) ORDER BY fila",
+            (mes, SINCRONIZADO, ELIMINAR)
+        ).fetchall()
+        por_firma = defaultdict(list)  # firma -> [(fila, id)], de arriba hacia abajo
+        for r in conocidas:
+            por_firma[firma(r["fecha"], r["proveedor"], r["monto"])].append((r["fila"], r["id"]))
+
+        ubicadas, nuevas = [], []
+        for fila, registro in enumerate(registros, start=2):
+            valores = _como_valores(registro)
+            candidatas = por_firma.get(firma(valores[0], valores[2], valores[3]))
+            if not candidatas:
+                nuevas.append((fila, valores))
+                continue
+            # La que estaba en esa fila; si no, la primera (las de arriba se corrieron)
+            i = next((k for k, (anterior, _) in enumerate(candidatas) if anterior == fila), 0)
+            _, id_mov = candidatas.pop(i)
+            ubicadas.append((fila, str(valores[1]), _pagado_de_hoja(valores[4]), id_mov))
+
+        ids_ubicados = {id_mov for *_, id_mov in ubicadas}
+        con.executemany(
+            "UPDATE movimientos SET estado = ?, fila = NULL WHERE id = ?",
+            [(ELIMINADO, r["id"]) for r in conocidas if r["id"] not in ids_ubicados]
+        )
+        # Hora y Pagado pueden haberse editado; un Pagado que todavía no
+        # llegó a la hoja manda sobre lo que dice la hoja
+        con.executemany(
+            "UPDATE movimientos SET fila = ?, hora = ?, pagado = CASE WHEN EXISTS "
+            "(SELECT 1 FROM actualizaciones WHERE id_mov = movimientos.id) THEN pagado ELSE ? END "
+            "WHERE id = ?",
+            ubicadas
+        )
+        _insertar_de_hoja(con, mes, nuevas)
+        con.execute(
+            "INSERT OR REPLACE INTO meses_importados (mes, ultima_fila) VALUES (?, ?)",
+            (mes, len(registros) + 1)
+        )
+        con.execute("COMMIT")
+        _tocar(mes)
+
+def agregar_de_hoja(mes, desde, valores):
+    """Filas cargadas directamente en la hoja, a partir de la fila `desde`"""
+    with _lock:
+        con = _conectar()
+        con.execute("BEGIN")
+        _insertar_de_hoja(con, mes, [
+            (desde + i, list(v) + [""] * (5 - len(v)))
+            for i, v in enumerate(valores)
+        ])
+        con.execute(
+            "UPDATE meses_importados SET ultima_fila = MAX(ultima_fila, ?) WHERE mes = ?",
+            (desde + len(valores) - 1, mes)
+        )
+        con.execute("COMMIT")
+        _tocar(mes)
+
+def pendientes_de_pago():
+    """Egresos con Pagado distinto de true"""
+    with _lock:
+        rows = _conectar().execute(
+            "SELECT * FROM movimientos WHERE estado IN (?, ?) AND lower(pagado) != 'true' "
+            "AND proveedor NOT IN ('', 'cliente') ORDER BY id",
+            _VISIBLES
+        ).fetchall()
+    return [a_registro(r) for r in rows]
+
+def total_dia(fecha, proveedor):
+    with _lock:
+        return _conectar().execute(
+            "SELECT COALESCE(SUM(monto), 0) FROM movimientos "
+            "WHERE proveedor = ? AND fecha = ? AND estado IN (?, ?)",
+            (proveedor, fecha, *_VISIBLES)
+        ).fetchone()[0]
+
+def filas_mes(mes):
+    """Tuplas (fecha, hora, proveedor, monto, pagado) visibles del mes, para analytics"""
+    with _lock:
+        return _conectar().execute(
+            "SELECT fecha, hora, proveedor, monto, pagado FROM movimientos "
+            "WHERE mes = ? AND estado IN (?, ?)",
+            (mes, *_VISIBLES)
+        ).fetchall()
+
+def mes_replicado(mes):
+    """True si no queda nada del mes esperando ir a la hoja"""
+    with _lock:
+        return _conectar().execute(
+            "SELECT 1 FROM movimientos WHERE mes = ? AND estado IN (?, ?) LIMIT 1",
+            (mes, PENDIENTE, ELIMINAR)
+        ).fetchone() is None
+
+def guardar_fallido(operacion, error):
+    """Operación de la cola que la hoja rechazó de forma permanente"""
+    with _lock:
+        _conectar().execute(
+            "INSERT INTO fallidos (operacion, error, fecha) VALUES (?, ?, ?)",
+            (json.dumps(operacion), str(error), datetime.now().isoformat(timespec="seconds"))
+        )
+
+def fallidos():
+    """[(operacion, error, fecha)] de las operaciones descartadas"""
+    with _lock:
+        rows = _conectar().execute("SELECT * FROM fallidos ORDER BY id").fetchall()
+    return [(tuple(json.loads(r["operacion"])), r["error"], r["fecha"]) for r in rows]
+
+def guardar_procesado(clave, vence):
+    with _lock:
+        _conectar().execute(
+            "INSERT OR REPLACE INTO procesados (clave, vence) VALUES (?, ?)", (clave, vence)
+        )
+
+def purgar_procesados(ahora):
+    with _lock:
+        _conectar().execute("DELETE FROM procesados WHERE vence <= ?", (ahora,))
+
+def procesados_vigentes(ahora):
+    """[(clave, vence)] que todavía no vencieron, por vencimiento"""
+    purgar_procesados(ahora)
+    with _lock:
+        return [
+            tuple(r) for r in _conectar().execute(
+                "SELECT clave, vence FROM procesados ORDER BY vence"
+            )
+        ]
+
+def totales_caja(desde, hasta, excluir=()):
+    """
+    (ingreso, egreso, ventas de clientes) entre dos fechas %Y-%m-%d
+    (inclusive), sin los proveedores de `excluir`. Usa el índice por fecha.
+    """
+    excluir = list(excluir)
+    marcas = ",".join("?" * len(excluir))
+    with _lock:
+        row = _conectar().execute(
+            "SELECT COALESCE(SUM(CASE WHEN monto > 0 THEN monto END), 0), "
+            "COALESCE(-SUM(CASE WHEN monto < 0 THEN monto END), 0), "
+            "COUNT(CASE WHEN proveedor = 'cliente' THEN 1 END) "
+            f"FROM movimientos WHERE fecha BETWEEN ? AND ? AND estado IN (?, ?) "
+            f"AND proveedor NOT IN ({marcas})",
+            (desde, hasta, *_VISIBLES, *excluir)
+        ).fetchone()
+    return tuple(row)
+
+def movimientos_caja(desde, hasta, excluir=()):
+    """
+    (último id del ledger, tuplas (id, fecha, hora, proveedor, monto)) de los
+    movimientos visibles entre dos fechas, sin los de `excluir`. Con el id
+    se sabe qué altas posteriores todavía no están en las tuplas.
+    """
+    excluir = list(excluir)
+    marcas = ",".join("?" * len(excluir))
+    with _lock:
+        con = _conectar()
+        ultimo = con.execute("SELECT COALESCE(MAX(id), 0) FROM movimientos").fetchone()[0]
+        filas = con.execute(
+            "SELECT id, fecha, hora, proveedor, monto FROM movimientos "
+            f"WHERE fecha BETWEEN ? AND ? AND estado IN (?, ?) AND proveedor NOT IN ({marcas}) "
+            "ORDER BY fecha, id",
+            (desde, hasta, *_VISIBLES, *excluir)
+        ).fetchall()
+    return ultimo, [tuple(f) for f in filas]
+
+def guardar_cierre(cierre):
+    """`cierre`: dict con las columnas de la tabla cierres"""
+    columnas = list(cierre)
+    with _lock:
+        _conectar().execute(
+            f"INSERT OR REPLACE INTO cierres ({', '.join(columnas)}) "
+            f"VALUES ({', '.join('?' * len(columnas))})",
+            [cierre[c] for c in columnas]
+        )
+
+def ultimo_cierre(mes, antes_de):
+    """El cierre vigente más reciente del mes anterior a la fecha `antes_de`, o None"""
+    with _lock:
+        row = _conectar().execute(
+            "SELECT * FROM cierres WHERE mes = ? AND fecha < ? ORDER BY fecha DESC LIMIT 1",
+            (mes, antes_de)
+        ).fetchone()
+    return dict(row) if row else None
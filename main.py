@@ -1,5 +1,16 @@
-from telegram.ext import Application, CallbackQueryHandler, MessageHandler, filters
-from handlers import manejar_boton, manejar_mensaje
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+from handlers import (
+    manejar_boton,
+    manejar_consultas,
+    manejar_exportacion,
+    manejar_importacion,
+    manejar_mensaje,
+    manejar_stats,
+    manejar_voz
+)
+import cierre
+import proyeccion
+from db_async import detener, iniciar
 import os, logging
 from dotenv import load_dotenv
 from telegram import Update
@@ -13,15 +24,72 @@ import sys
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
-logging.basicConfig(level=logging.ERROR)  # Solo errores críticos
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "ERROR").upper())  # Solo errores críticos por defecto
+
+# "polling" o "webhook"
+MODO = os.getenv("BOT_MODO", "polling")
+
+# Handlers corriendo a la vez; el resto espera en la cola interna de la app
+HANDLERS_CONCURRENTES = int(os.getenv("HANDLERS_CONCURRENTES", "32"))
+
+# Con el dedup persistente, los updates que llegaron durante un reinicio se procesan
+DESCARTAR_PENDIENTES = os.getenv("DESCARTAR_PENDIENTES", "false").lower() == "true"
+
+# Webhook: Telegram hace POST a WEBHOOK_URL (el proxy/HTTPS delante del bot)
+# y el servidor local escucha en WEBHOOK_ESCUCHA:WEBHOOK_PUERTO/WEBHOOK_RUTA
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_ESCUCHA = os.getenv("WEBHOOK_ESCUCHA", "0.0.0.0")
+WEBHOOK_PUERTO = int(os.getenv("WEBHOOK_PUERTO", "8443"))
+WEBHOOK_RUTA = os.getenv("WEBHOOK_RUTA", "telegram")
+WEBHOOK_SECRETO = os.getenv("WEBHOOK_SECRETO")
+
+def construir_app(token=TOKEN):
+    # Google y los escritores arrancan en post_init, no al importar los módulos
+    app = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(HANDLERS_CONCURRENTES)
+        .post_init(iniciar)
+        .post_shutdown(detener)
+        .build()
+    )
 
-if __name__ == "__main__":
-    app = Application.builder().token(TOKEN).concurrent_updates(True).build()  # 🔥 Updates concurrentes
-    
     app.add_handler(CallbackQueryHandler(manejar_boton))
+    app.add_handler(CommandHandler("consultas", manejar_consultas))
+    app.add_handler(CommandHandler("stats", manejar_stats))
+    app.add_handler(CommandHandler("exportar", manejar_exportacion))
+    app.add_handler(MessageHandler(filters.Document.FileExtension("csv"), manejar_importacion))
+    app.add_handler(MessageHandler(filters.VOICE, manejar_voz))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, manejar_mensaje))
-    
-    
+
+    if app.job_queue is None:
+        print("❌ Sin JobQueue (falta APScheduler): no hay cierre diario ni alertas")
+    else:
+        cierre.programar(app.job_queue)
+        proyeccion.programar(app.job_queue)
+    return app
+
+def correr_webhook(app):
+    """
+    El servidor responde 200 apenas encola el update (valida antes el
+    header X-Telegram-Bot-Api-Secret-Token) y los handlers lo toman de
+    la cola interna. Necesita tornado (python-telegram-bot[webhooks]).
+    """
+    if not WEBHOOK_URL or not WEBHOOK_SECRETO:
+        sys.exit("❌ El modo webhook necesita WEBHOOK_URL y WEBHOOK_SECRETO")
+
+    app.run_webhook(
+        listen=WEBHOOK_ESCUCHA,
+        port=WEBHOOK_PUERTO,
+        url_path=WEBHOOK_RUTA,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_RUTA}",
+        secret_token=WEBHOOK_SECRETO,
+        max_connections=min(HANDLERS_CONCURRENTES, 100),  # Tope de Telegram
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=DESCARTAR_PENDIENTES
+    )
+
+def correr_polling(app):
     app.run_polling(
         timeout=60,
         read_timeout=60,
@@ -29,5 +97,13 @@ if __name__ == "__main__":
         connect_timeout=60,
         pool_timeout=60,
         allowed_updates=Update.ALL_TYPES,
-        drop_pending_updates=True  
+        drop_pending_updates=DESCARTAR_PENDIENTES
     )
+
+if __name__ == "__main__":
+    app = construir_app()
+
+    if MODO == "webhook":
+        correr_webhook(app)
+    else:
+        correr_polling(app)
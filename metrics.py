@@ -0,0 +1,134 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Se vuelca periódicamente junto a los demás archivos del volumen ./logs
+METRICS_PATH = os.getenv("METRICS_PATH", "logs/metrics.json")
+INTERVALO_VOLCADO = int(os.getenv("METRICS_INTERVALO", "60"))
+
+# Últimas N duraciones por nombre, para los percentiles
+MUESTRAS = 2048
+
+_tiempos = defaultdict(lambda: deque(maxlen=MUESTRAS))
+_llamadas = defaultdict(int)
+_contadores = defaultdict(int)
+_valores = {}
+_lock = threading.Lock()
+
+def registrar(nombre, segundos):
+    with _lock:
+        _tiempos[nombre].append(segundos)
+        _llamadas[nombre] += 1
+
+def contar(nombre, n=1):
+    with _lock:
+        _contadores[nombre] += n
+
+def fijar(nombre, valor):
+    """Valor instantáneo (p. ej. profundidad de la cola)"""
+    _valores[nombre] = valor
+
+@contextmanager
+def medir(nombre):
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        contar(f"{nombre}.error")
+        raise
+    finally:
+        registrar(nombre, time.perf_counter() - inicio)
+
+def medido(nombre=None):
+    """Decorador de medir() para funciones sync o async"""
+    def decorador(funcion):
+        etiqueta = nombre or funcion.__name__
+
+        if asyncio.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura(*args, **kwargs):
+                with medir(etiqueta):
+                    return await funcion(*args, **kwargs)
+        else:
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with medir(etiqueta):
+                    return funcion(*args, **kwargs)
+
+        return envoltura
+    return decorador
+
+def _percentil(ordenados, p):
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+def resumen():
+    """Percentiles en ms, contadores y valores actuales"""
+    with _lock:
+        muestras = {nombre: sorted(valores) for nombre, valores in _tiempos.items() if valores}
+        llamadas = dict(_llamadas)
+        contadores = dict(_contadores)
+
+    return {
+        "tiempos": {
+            nombre: {
+                "n": llamadas[nombre],
+                "p50": _percentil(ordenados, 50) * 1000,
+                "p95": _percentil(ordenados, 95) * 1000,
+                "p99": _percentil(ordenados, 99) * 1000,
+                "max": ordenados[-1] * 1000
+            }
+            for nombre, ordenados in sorted(muestras.items())
+        },
+        "contadores": dict(sorted(contadores.items())),
+        "valores": dict(sorted(_valores.items())),
+        "generado": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+def texto_stats():
+    """Resumen para el comando /stats"""
+    datos = resumen()
+    lineas = ["⏱️ ms (p50 / p95 / p99)"]
+    for nombre, t in datos["tiempos"].items():
+        lineas.append(f"{nombre} [{t['n']}]: {t['p50']:.1f} / {t['p95']:.1f} / {t['p99']:.1f}")
+
+    if datos["contadores"]:
+        lineas.append("\n🔢 Contadores")
+        lineas += [f"{nombre}: {n}" for nombre, n in datos["contadores"].items()]
+
+    if datos["valores"]:
+        lineas.append("\n📊 Ahora")
+        lineas += [f"{nombre}: {v}" for nombre, v in datos["valores"].items()]
+
+    return "\n".join(lineas)[:4000]  # Límite de mensaje de Telegram
+
+def volcar():
+    """Escribe el resumen en METRICS_PATH (reemplazo atómico)"""
+    carpeta = os.path.dirname(METRICS_PATH)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    temporal = METRICS_PATH + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(resumen(), f, indent=1, ensure_ascii=False)
+    os.replace(temporal, METRICS_PATH)
+
+def _volcar_periodicamente():
+    while True:
+        time.sleep(INTERVALO_VOLCADO)
+        try:
+            volcar()
+        except Exception as e:
+            print(f"❌ Error guardando métricas: {e}")
+
+_hilos = {"volcado": None}
+
+def iniciar():
+    """Arranca el volcado periódico (post_init). Llamarlo dos veces no hace nada."""
+    if _hilos["volcado"]:
+        return
+    _hilos["volcado"] = threading.Thread(target=_volcar_periodicamente, daemon=True, name="metricas")
+    _hilos["volcado"].start()
@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+import ledger
+import tiendas
+
+# Por sucursal: proveedor -> {id: monto} de los egresos sin pagar (de cualquier mes)
+_indices = {}
+
+def _indice():
+    tienda = tiendas.actual()
+    if tienda not in _indices:
+        _indices[tienda] = {
+            "cargado": False,
+            "por_proveedor": defaultdict(dict),
+            "proveedor_de": {}  # id -> proveedor, para sacar en O(1)
+        }
+    return _indices[tienda]
+
+def _es_pendiente(registro):
+    return not registro.get("Pagado") and registro.get("Proveedor") not in ("", "cliente")
+
+def _cargar():
+    indice = _indice()
+    indice["por_proveedor"] = defaultdict(dict)
+    indice["proveedor_de"] = {}
+    for registro in ledger.pendientes_de_pago():
+        agregar(registro)
+    indice["cargado"] = True
+
+def _asegurar():
+    if not _indice()["cargado"]:
+        _cargar()
+    return _indice()
+
+def invalidar():
+    """La próxima consulta se rearma desde el ledger (p. ej. tras editar la hoja)"""
+    _indice()["cargado"] = False
+
+def agregar(registro):
+    if not _es_pendiente(registro):
+        return
+    indice = _indice()
+    proveedor = registro["Proveedor"]
+    indice["por_proveedor"][proveedor][registro["id"]] = abs(float(registro["Monto"]))
+    indice["proveedor_de"][registro["id"]] = proveedor
+
+def quitar(id_mov):
+    indice = _indice()
+    proveedor = indice["proveedor_de"].pop(id_mov, None)
+    if proveedor is None:
+        return
+    items = indice["por_proveedor"][proveedor]
+    items.pop(id_mov, None)
+    if not items:
+        del indice["por_proveedor"][proveedor]
+
+def de_proveedor(proveedor):
+    """{id: monto} pendientes de un proveedor"""
+    return dict(_asegurar()["por_proveedor"].get(proveedor, {}))
+
+def resumen():
+    """proveedor -> (cantidad, total) para armar el menú de pagos"""
+    return {
+        proveedor: (len(items), sum(items.values()))
+        for proveedor, items in sorted(_asegurar()["por_proveedor"].items())
+    }
+
+def todos():
+    """[(id, proveedor, monto)]"""
+    return [
+        (id_mov, proveedor, monto)
+        for proveedor, items in _asegurar()["por_proveedor"].items()
+        for id_mov, monto in items.items()
+    ]
+
+def obtener(id_mov):
+    """(proveedor, monto) de un pendiente, o None"""
+    indice = _asegurar()
+    proveedor = indice["proveedor_de"].get(id_mov)
+    if proveedor is None:
+        return None
+    return proveedor, indice["por_proveedor"][proveedor][id_mov]
@@ -0,0 +1,337 @@
+"""
+Preguntas en texto libre ("cuánto le pagué a Coca en marzo", "ventas del
+sábado vs el anterior"). Un intérprete las pasa a una intención y la
+respuesta sale del cubo día × proveedor × hora, nunca de la hoja.
+
+Intérpretes (CONSULTAS_INTERPRETE): "reglas" (local, sin red) u "openai"
+(OPENAI_API_KEY, modelo en OPENAI_MODELO). Si el modelo falla se usan las
+reglas.
+"""
+import json
+import os
+import re
+import unicodedata
+from datetime import date, timedelta
+
+import cubo
+import metrics
+from telegram_conect import proveedores as PROVEEDORES
+from utils import formatear_monto
+
+INTERPRETE = os.getenv("CONSULTAS_INTERPRETE", "reglas")
+OPENAI_MODELO = os.getenv("OPENAI_MODELO", "gpt-4o-mini")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "15"))
+
+# Además de los del teclado, los que cargan los botones de gasto
+OTROS_PROVEEDORES = ["Nosotros", "Mercaderia", "Desperdicio", "Corrección Caja"]
+
+METRICAS = ("ventas", "pagos", "saldo")
+AGRUPACIONES = ("hora", "proveedor", "fecha")
+
+# Renglones del desglose por día o proveedor (los más grandes)
+RENGLONES = 10
+
+MESES = [
+    "enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+    "agosto", "septiembre", "octubre", "noviembre", "diciembre"
+]
+DIAS = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+
+def _normalizar(texto):
+    """minúsculas y sin tildes"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+# Arranques que ya son una pregunta sobre la caja ("cuánto...", "ventas de...")
+_INICIOS = re.compile(
+    r"(cuanto|cuanta|cuantos|cuantas|a quien|ventas|vendimos|pagos|pague|pagamos|saldo|gastos)\b"
+)
+
+# Arranques de charla ("qué tal", "dame un minuto"): cuentan solo si se habla de la caja
+_CHARLA = re.compile(r"(que|cual|como|quien|cuando|mostrame|dame)\b")
+
+# Lo que dice que se habla de la caja: una métrica, o un período
+_METRICAS = re.compile(
+    r"\b(ventas?|vend\w*|pag\w*|saldo|gastos?|caja|ingresos?|egresos?|proveedor\w*)\b"
+)
+_PERIODOS = re.compile(
+    r"\b(hoy|ayer|semana|mes|ano|" + "|".join(MESES + [_normalizar(d) for d in DIAS]) + r")\b"
+)
+
+def es_pregunta(texto):
+    """
+    Para no contestar cualquier charla del grupo. Cuenta un arranque de
+    pregunta sobre la caja (palabra completa); un arranque de charla con
+    una métrica o un período ("qué vendimos ayer"); o un "?" con una
+    métrica ("todo bien con la caja?").
+    """
+    texto = _normalizar(texto).strip("¿¡ ")
+    if _INICIOS.match(texto):
+        return True
+    if _METRICAS.search(texto):
+        return bool(_CHARLA.match(texto)) or "?" in texto
+    return bool(_CHARLA.match(texto) and _PERIODOS.search(texto))
+
+def _proveedores():
+    return PROVEEDORES + OTROS_PROVEEDORES
+
+def _alias(proveedor):
+    """Formas de nombrar a un proveedor: "Cafaratti(pepsi)" -> cafaratti, pepsi"""
+    nombre = _normalizar(proveedor).replace("_", " ")
+    partes = re.split(r"[()/]", nombre)
+    return {nombre.strip()} | {p.strip() for p in partes if len(p.strip()) > 2}
+
+# ---------------------------------------------------------------------------
+# Intérprete local por reglas
+# ---------------------------------------------------------------------------
+
+def _fin_de_mes(anio, mes):
+    return (date(anio, mes, 28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+def _hace_un_anio(fecha):
+    try:
+        return fecha.replace(year=fecha.year - 1)
+    except ValueError:  # 29 de febrero
+        return fecha.replace(year=fecha.year - 1, day=28)
+
+def _mes_anterior(desde):
+    fin = desde.replace(day=1) - timedelta(days=1)
+    return fin.replace(day=1), fin
+
+def _periodo(texto, hoy):
+    """(desde, hasta, tipo) del período nombrado; el mes en curso por defecto"""
+    if re.search(r"\bhoy\b", texto):
+        return hoy, hoy, "dia"
+    if re.search(r"\bayer\b", texto):
+        return hoy - timedelta(days=1), hoy - timedelta(days=1), "dia"
+
+    for i, dia in enumerate(DIAS):
+        if re.search(rf"\b{_normalizar(dia)}\b", texto):
+            fecha = hoy - timedelta(days=(hoy.weekday() - i) % 7)
+            return fecha, fecha, "dia"
+
+    for i, nombre in enumerate(MESES, start=1):
+        if re.search(rf"\b{nombre}\b", texto):
+            anio = re.search(rf"\b{nombre}\s+(?:de\s+|del\s+)?(\d{{4}})\b", texto)
+            if anio:
+                anio = int(anio.group(1))
+            else:
+                anio = hoy.year if i <= hoy.month else hoy.year - 1
+            return date(anio, i, 1), min(_fin_de_mes(anio, i), hoy), "mes"
+
+    if "semana pasada" in texto:
+        lunes = hoy - timedelta(days=hoy.weekday() + 7)
+        return lunes, lunes + timedelta(days=6), "semana"
+    if "semana" in texto:
+        return hoy - timedelta(days=hoy.weekday()), hoy, "semana"
+    if "mes pasado" in texto:
+        desde, hasta = _mes_anterior(hoy)
+        return desde, hasta, "mes"
+    if re.search(r"\b(este )?ano\b", texto):
+        return hoy.replace(month=1, day=1), hoy, "anio"
+    return hoy.replace(day=1), hoy, "mes"
+
+def _comparacion(texto, desde, hasta, tipo):
+    """El período contra el que se compara, si la pregunta lo pide"""
+    if not re.search(r"\b(vs|versus|contra|anterior|compar\w*)\b", texto):
+        return None
+    if tipo == "anio" or "ano pasado" in texto:
+        return _hace_un_anio(desde), _hace_un_anio(hasta)
+    if tipo == "mes":
+        anterior_desde, anterior_hasta = _mes_anterior(desde)
+        # Mes en curso: contra el mismo tramo del anterior
+        largo = (hasta - desde).days
+        return anterior_desde, min(anterior_desde + timedelta(days=largo), anterior_hasta)
+    # Un día con nombre o una semana: la semana anterior
+    return desde - timedelta(days=7), hasta - timedelta(days=7)
+
+def interpretar_reglas(texto, hoy):
+    """Intención a partir de palabras clave (sin red, para pruebas y de respaldo)"""
+    texto = _normalizar(texto)
+
+    proveedor = None
+    for nombre in _proveedores():
+        if nombre == "Otro":  # "el otro sábado" no es un proveedor
+            continue
+        if any(re.search(rf"\b{re.escape(a)}\b", texto) for a in _alias(nombre)):
+            proveedor = nombre
+            break
+
+    if re.search(r"\b(saldo|gananc\w*|balance|quedo|quedamos)\b", texto):
+        metrica = "saldo"
+    elif proveedor or re.search(r"\b(pag\w*|gast\w*|egres\w*|compr\w*)\b", texto):
+        metrica = "pagos"
+    else:
+        metrica = "ventas"
+
+    agrupar = None
+    if re.search(r"\b(por hora|que hora|horario\w*)\b", texto):
+        agrupar = "hora"
+    elif re.search(r"\b(por proveedor|a quien|proveedores)\b", texto):
+        agrupar = "proveedor"
+    elif re.search(r"\b(por dia|cada dia|que dia)\b", texto):
+        agrupar = "fecha"
+
+    desde, hasta, tipo = _periodo(texto, hoy)
+    comparar = _comparacion(texto, desde, hasta, tipo)
+    return {
+        "metrica": metrica,
+        "proveedor": proveedor,
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "comparar_desde": comparar[0].isoformat() if comparar else None,
+        "comparar_hasta": comparar[1].isoformat() if comparar else None,
+        "agrupar": agrupar
+    }
+
+# ---------------------------------------------------------------------------
+# Intérprete con LLM (OpenAI)
+# ---------------------------------------------------------------------------
+
+_PROMPT = """Convertís preguntas sobre la caja de una fiambrería en JSON.
+Hoy es {hoy} ({dia}). Respondé solo un objeto con estas claves:
+- "metrica": "ventas" (ingresos de clientes), "pagos" (egresos a proveedores) o "saldo"
+- "proveedor": uno de {proveedores}, o null
+- "desde", "hasta": fechas YYYY-MM-DD del período (el mes en curso si no dice)
+- "comparar_desde", "comparar_hasta": el período contra el que compara, o null
+- "agrupar": "hora", "proveedor", "fecha" o null"""
+
+_openai = {"cliente": None}
+
+def _cliente_openai():
+    if _openai["cliente"] is None:
+        from openai import OpenAI  # Solo hace falta con CONSULTAS_INTERPRETE=openai
+        _openai["cliente"] = OpenAI(timeout=OPENAI_TIMEOUT, max_retries=1)
+    return _openai["cliente"]
+
+def interpretar_openai(texto, hoy):
+    respuesta = _cliente_openai().chat.completions.create(
+        model=OPENAI_MODELO,
+        response_format={"type": "json_object"},
+        temperature=0,
+        messages=[
+            {"role": "system", "content": _PROMPT.format(
+                hoy=hoy.isoformat(), dia=DIAS[hoy.weekday()], proveedores=json.dumps(_proveedores())
+            )},
+            {"role": "user", "content": texto}
+        ]
+    )
+    return json.loads(respuesta.choices[0].message.content)
+
+def voz_disponible():
+    return INTERPRETE == "openai"
+
+def transcribir(ruta):
+    """Audio (nota de voz) -> texto; necesita el intérprete de OpenAI"""
+    with open(ruta, "rb") as audio, metrics.medir("openai.transcripcion"):
+        return _cliente_openai().audio.transcriptions.create(
+            model="whisper-1", file=audio, language="es"
+        ).text
+
+_INTERPRETES = {
+    "reglas": interpretar_reglas,
+    "openai": interpretar_openai
+}
+
+def _validar(intencion):
+    """Intención cruda (del modelo o de las reglas) -> fechas y valores conocidos, o None"""
+    try:
+        limpia = {
+            "metrica": intencion.get("metrica") if intencion.get("metrica") in METRICAS else "ventas",
+            "proveedor": intencion.get("proveedor") if intencion.get("proveedor") in _proveedores() else None,
+            "desde": date.fromisoformat(intencion["desde"]),
+            "hasta": date.fromisoformat(intencion["hasta"]),
+            "comparar": None,
+            "agrupar": intencion.get("agrupar") if intencion.get("agrupar") in AGRUPACIONES else None
+        }
+        if intencion.get("comparar_desde") and intencion.get("comparar_hasta"):
+            limpia["comparar"] = (
+                date.fromisoformat(intencion["comparar_desde"]),
+                date.fromisoformat(intencion["comparar_hasta"])
+            )
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    if limpia["desde"] > limpia["hasta"]:
+        return None
+    return limpia
+
+def interpretar(texto, hoy=None):
+    hoy = hoy or date.today()
+    interprete = _INTERPRETES.get(INTERPRETE, interpretar_reglas)
+    try:
+        with metrics.medir(f"preguntas.{INTERPRETE}"):
+            intencion = _validar(interprete(texto, hoy))
+        if intencion is not None:
+            return intencion
+    except Exception as e:
+        print(f"❌ Error interpretando la pregunta: {e}")
+    metrics.contar("preguntas.respaldo")
+    return _validar(interpretar_reglas(texto, hoy))
+
+# ---------------------------------------------------------------------------
+# Respuesta desde el cubo
+# ---------------------------------------------------------------------------
+
+def _seleccion(intencion, desde, hasta):
+    if intencion["metrica"] == "ventas":
+        return cubo.ventas(desde, hasta)
+    if intencion["metrica"] == "pagos":
+        return cubo.pagos(desde, hasta, intencion["proveedor"])
+    return cubo.caja(desde, hasta)
+
+def _rango(desde, hasta):
+    if desde == hasta:
+        return f"{DIAS[desde.weekday()]} {desde:%d/%m}"
+    return f"{desde:%d/%m} al {hasta:%d/%m/%Y}"
+
+def _monto(intencion, suma):
+    """Ventas y pagos en positivo; el saldo con su signo"""
+    return formatear_monto(suma if intencion["metrica"] == "saldo" else abs(suma))
+
+def _titulo(intencion):
+    if intencion["metrica"] == "ventas":
+        return "📥 Ventas"
+    if intencion["metrica"] == "saldo":
+        return "💰 Saldo"
+    if intencion["proveedor"]:
+        return f"📤 Pagos a {intencion['proveedor']}"
+    return "📤 Pagos"
+
+def _etiqueta(nivel, valor):
+    if nivel == "hora":
+        return "sin hora" if valor < 0 else f"{valor:02d}h"
+    if nivel == "fecha":
+        return f"{valor:%d/%m}"
+    return valor
+
+def responder(texto, hoy=None):
+    """Texto de la respuesta a una pregunta libre"""
+    intencion = interpretar(texto, hoy)
+    if intencion is None:
+        return "🤔 No entendí la pregunta"
+
+    desde, hasta = intencion["desde"], intencion["hasta"]
+    sel = _seleccion(intencion, desde, hasta)
+    suma, cantidad = cubo.total(sel)
+    lineas = [f"{_titulo(intencion)} ({_rango(desde, hasta)}): ${_monto(intencion, suma)} ({cantidad})"]
+
+    if intencion["comparar"]:
+        otro_desde, otro_hasta = intencion["comparar"]
+        otra_suma, otra_cantidad = cubo.total(_seleccion(intencion, otro_desde, otro_hasta))
+        cambio = f" ({(suma / otra_suma - 1) * 100:+.1f}%)" if otra_suma else ""
+        lineas.append(f"vs {_rango(otro_desde, otro_hasta)}: ${_monto(intencion, otra_suma)} ({otra_cantidad}){cambio}")
+
+    if intencion["agrupar"] and not sel.empty:
+        nivel = intencion["agrupar"]
+        serie = cubo.agrupar(sel, nivel)
+        if nivel == "hora":
+            serie = serie.sort_index()  # Las horas en orden, todas
+        else:
+            serie = serie.head(RENGLONES)
+        lineas += [
+            f"• {_etiqueta(nivel, valor)}: ${_monto(intencion, monto)}"
+            for valor, monto in serie.items()
+        ]
+
+    metrics.contar("preguntas.respondidas")
+    return "\n".join(lineas)
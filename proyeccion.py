@@ -0,0 +1,376 @@
+import calendar
+import os
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import ledger
+import metrics
+import tiendas
+from totales import EXCLUIR_ESTADO
+
+# Días de historia para las medias (la proyección y las anomalías)
+VENTANA_DIAS = int(os.getenv("PROYECCION_DIAS", "56"))
+
+# Cada cuánto (segundos) se recalcula y se avisan anomalías a los dueños
+INTERVALO_ALERTAS = int(os.getenv("ALERTAS_INTERVALO", "900"))
+
+# Desvíos respecto de lo normal para que un monto sea anómalo
+UMBRAL_ALERTA = float(os.getenv("ALERTAS_UMBRAL", "3"))
+
+# Observaciones previas mínimas para juzgar una hora o un proveedor
+MINIMO_HISTORIA = 5
+
+# Pagos previos de un proveedor que cuentan para su "normal"
+PAGOS_HISTORIA = 20
+
+# tienda -> series diarias de la sucursal, al día con cada alta y baja
+_series = {}
+
+def _nuevas_series():
+    return {
+        "lock": threading.Lock(),
+        "carga": threading.Lock(),                 # una carga a la vez
+        "cargado": None,                           # día de la carga (se recarga al cambiar)
+        "durante_carga": None,                     # altas/bajas que llegan con la consulta en curso
+        "ultimo_id": 0,                            # altas hasta este id ya vinieron del ledger
+        "caja": defaultdict(lambda: [0.0, 0.0]),   # date -> [ingreso, egreso]
+        "ventas_hora": defaultdict(float),         # (date, hora) -> ventas de clientes
+        "pagos": {},                               # id -> (date, proveedor, monto)
+        "version": 0,                              # cambia con cada alta o baja aplicada
+        "resultado": None,                         # (version, (día, hora), resultado) del último cálculo
+        "avisadas": set()                          # alertas del día ya mandadas
+    }
+
+def _estado():
+    tienda = tiendas.actual()
+    if tienda not in _series:
+        _series[tienda] = _nuevas_series()
+    return _series[tienda]
+
+def _hora(texto):
+    texto = str(texto)[:2]
+    return int(texto) if texto.isdigit() and int(texto) < 24 else None
+
+def _aplicar(estado, id_mov, fecha, hora, proveedor, monto, signo):
+    """Suma (signo=1) o resta (signo=-1) un movimiento, O(1). Con el lock tomado."""
+    if proveedor in EXCLUIR_ESTADO or fecha < estado["cargado"] - timedelta(days=VENTANA_DIAS):
+        return
+
+    dia = estado["caja"][fecha]
+    if monto > 0:
+        dia[0] += monto * signo
+    else:
+        dia[1] -= monto * signo
+
+    if proveedor == "cliente":
+        hora = _hora(hora)
+        if hora is not None:
+            estado["ventas_hora"][(fecha, hora)] += monto * signo
+    elif monto < 0:
+        if signo > 0:
+            estado["pagos"][id_mov] = (fecha, proveedor, -monto)
+        else:
+            estado["pagos"].pop(id_mov, None)
+
+    estado["version"] += 1
+
+def _aplicar_registro(estado, registro, signo):
+    _aplicar(
+        estado, registro["id"], registro["Fecha"], registro["Hora"],
+        registro["Proveedor"], float(registro["Monto"]), signo
+    )
+
+def _cargar(estado, hoy):
+    """
+    Las series de los últimos VENTANA_DIAS días, desde el ledger. Las altas y
+    bajas que llegan mientras corre la consulta se guardan y se aplican al final.
+    """
+    with estado["carga"]:
+        if estado["cargado"] == hoy:  # La cargó otro hilo mientras esperábamos
+            return
+        with estado["lock"]:
+            estado["durante_carga"] = []
+
+        desde = hoy - timedelta(days=VENTANA_DIAS)
+        try:
+            with metrics.medir("proyeccion.carga"):
+                ultimo, filas = ledger.movimientos_caja(desde.isoformat(), hoy.isoformat(), EXCLUIR_ESTADO)
+        except Exception:
+            with estado["lock"]:
+                estado["durante_carga"] = None
+            raise
+
+        with estado["lock"]:
+            cambios = estado["durante_carga"]
+            estado["durante_carga"] = None
+            estado["caja"] = defaultdict(lambda: [0.0, 0.0])
+            estado["ventas_hora"] = defaultdict(float)
+            estado["pagos"] = {}
+            if estado["cargado"] != hoy:
+                estado["avisadas"] = set()
+            estado["cargado"] = hoy
+            estado["ultimo_id"] = ultimo
+            contados = set()
+            for id_mov, fecha, hora, proveedor, monto in filas:
+                _aplicar(estado, id_mov, date.fromisoformat(fecha), hora, proveedor, monto, 1)
+                contados.add(id_mov)
+
+            # Con la consulta en curso: altas que no alcanzó a ver, bajas de lo que sí vio
+            for signo, registro in cambios or ():
+                if (signo > 0) != (registro["id"] in contados):
+                    _aplicar_registro(estado, registro, signo)
+                    if signo > 0:
+                        contados.add(registro["id"])
+                    else:
+                        contados.discard(registro["id"])
+
+            if cambios is None:  # Se invalidó durante la consulta: la próxima vez se recarga
+                estado["cargado"] = None
+
+def _cambio(registro, signo):
+    estado = _estado()
+    with estado["lock"]:
+        if estado["durante_carga"] is not None:
+            estado["durante_carga"].append((signo, registro))
+            return
+        # Sin cargar, o un alta ya contada en la carga: nada que hacer
+        if estado["cargado"] is None or (signo > 0 and registro["id"] <= estado["ultimo_id"]):
+            return
+        _aplicar_registro(estado, registro, signo)
+
+def sumar(registro):
+    """Alta de un registro del cache (la llama db_sheet junto con totales)"""
+    _cambio(registro, 1)
+
+def restar(registro):
+    _cambio(registro, -1)
+
+def invalidar():
+    """El ledger cambió por fuera de las altas y bajas (recarga, importación)"""
+    estado = _estado()
+    with estado["lock"]:
+        estado["cargado"] = None
+        estado["resultado"] = None
+        estado["durante_carga"] = None
+
+def _copiar(estado):
+    with estado["lock"]:
+        return (
+            estado["version"],
+            dict(estado["caja"]),
+            dict(estado["ventas_hora"]),
+            list(estado["pagos"].items())
+        )
+
+# ---------------------------------------------------------------------------
+# Cálculo (vectorizado, sobre las series en memoria)
+# ---------------------------------------------------------------------------
+
+def _proyectar(caja, hoy, hora, perfil):
+    """
+    Saldo a fin de mes: lo real hasta ahora más, por cada día que falta, la
+    media de ese día de la semana (y de hoy, la parte del día que suele
+    quedar según el perfil horario de ventas). None con menos de una semana.
+    """
+    historia = caja.loc[:hoy - timedelta(days=1)]
+    con_movimientos = np.flatnonzero(historia.sum(axis=1).to_numpy())
+    if len(con_movimientos) == 0 or len(historia) - con_movimientos[0] < 7:
+        return None
+    historia = historia.iloc[con_movimientos[0]:]
+
+    dia_semana = pd.DatetimeIndex(historia.index).dayofweek
+    media = historia.groupby(dia_semana).mean()
+    varianza_neto = (historia["ingreso"] - historia["egreso"]).groupby(dia_semana).var()
+
+    fin = hoy.replace(day=calendar.monthrange(hoy.year, hoy.month)[1])
+    restantes = pd.date_range(hoy + timedelta(days=1), fin).dayofweek
+    esperado = media.reindex(restantes).fillna(0.0).sum()
+    esperado += media.reindex([hoy.weekday()]).fillna(0.0).iloc[0] * (1.0 - perfil[:hora].sum())
+
+    real = caja.loc[hoy.replace(day=1):hoy].sum()
+    ingreso = real["ingreso"] + esperado["ingreso"]
+    egreso = real["egreso"] + esperado["egreso"]
+    return {
+        "fin": fin,
+        "ingreso": float(ingreso),
+        "egreso": float(egreso),
+        "saldo": float(ingreso - egreso),
+        "desvio": float(np.sqrt(varianza_neto.reindex(restantes).fillna(0.0).sum())),
+        "real": float(real["ingreso"] - real["egreso"])
+    }
+
+def _normal(tabla, ventana):
+    """
+    Media y desvío móviles de cada columna con las filas anteriores (sin
+    la propia). El desvío tiene un piso del 10% de la media, para que una
+    historia muy pareja no marque como anómala cualquier diferencia.
+    """
+    previas = tabla.shift(1).rolling(ventana, min_periods=MINIMO_HISTORIA)
+    media = previas.mean()
+    return media, np.maximum(previas.std(), media.abs() * 0.1)
+
+def _horas_flojas(ventas_hora, dias, hoy, hora):
+    """Horas ya cerradas de hoy con ventas muy por debajo de lo normal para esa hora"""
+    if not ventas_hora:
+        return []
+    serie = pd.Series(ventas_hora)
+    tabla = serie.unstack(fill_value=0.0).reindex(index=dias, columns=range(24), fill_value=0.0)
+
+    # Solo los días que abrió (hoy siempre: no haber vendido nada es justamente lo anómalo)
+    abiertos = tabla.sum(axis=1).to_numpy() > 0
+    abiertos[-1] = True
+    tabla = tabla[abiertos]
+
+    media, desvio = _normal(tabla, VENTANA_DIAS)
+    z = (tabla.iloc[-1] - media.iloc[-1]) / desvio.iloc[-1]
+    flojas = z[(z < -UMBRAL_ALERTA) & (media.iloc[-1] > 0) & (z.index < hora)]
+    return [
+        (("hora", hoy, h), float(tabla.iloc[-1][h]), float(media.iloc[-1][h]))
+        for h in flojas.index
+    ]
+
+def _pagos_grandes(pagos, hoy):
+    """Pagos de hoy muy por encima de los anteriores al mismo proveedor"""
+    if not pagos:
+        return []
+    df = pd.DataFrame(
+        [(id_mov, fecha, proveedor, monto) for id_mov, (fecha, proveedor, monto) in pagos],
+        columns=["id", "fecha", "proveedor", "monto"]
+    ).sort_values(["fecha", "id"])
+
+    previos = df.groupby("proveedor")["monto"].shift(1)
+    ventanas = previos.groupby(df["proveedor"]).rolling(PAGOS_HISTORIA, min_periods=MINIMO_HISTORIA)
+    media = ventanas.mean().reset_index(level=0, drop=True).reindex(df.index)
+    desvio = np.maximum(ventanas.std().reset_index(level=0, drop=True).reindex(df.index), media * 0.1)
+
+    z = (df["monto"] - media) / desvio
+    grandes = df[(z > UMBRAL_ALERTA) & (df["fecha"] == hoy)]
+    return [
+        (("pago", int(fila.id)), fila.proveedor, float(fila.monto), float(media[i]))
+        for i, fila in zip(grandes.index, grandes.itertuples())
+    ]
+
+def _calcular(ahora):
+    hoy, hora = ahora.date(), ahora.hour
+    estado = _estado()
+    if estado["cargado"] != hoy:
+        _cargar(estado, hoy)
+    version, caja, ventas_hora, pagos = _copiar(estado)
+
+    dias = [hoy - timedelta(days=n) for n in range(VENTANA_DIAS, -1, -1)]
+    tabla_caja = pd.DataFrame(
+        [caja.get(d, (0.0, 0.0)) for d in dias],
+        index=pd.DatetimeIndex(dias), columns=["ingreso", "egreso"]
+    )
+    tabla_caja.index = tabla_caja.index.date
+
+    # Qué parte de las ventas de un día cae en cada hora
+    por_hora = np.zeros(24)
+    for (_, h), monto in ventas_hora.items():
+        por_hora[h] += monto
+    perfil = por_hora / por_hora.sum() if por_hora.sum() > 0 else np.zeros(24)
+
+    return version, {
+        "calculado": ahora,
+        "proyeccion": _proyectar(tabla_caja, hoy, hora, perfil),
+        "horas": _horas_flojas(ventas_hora, dias, hoy, hora),
+        "pagos": _pagos_grandes(pagos, hoy)
+    }
+
+def resultado(ahora=None):
+    """
+    Proyección y anomalías de la sucursal actual. Se recalcula solo si hubo
+    altas o bajas, o cambió la hora; si no, sale del último cálculo.
+    """
+    ahora = ahora or datetime.now()
+    estado = _estado()
+    cacheado = estado["resultado"]
+    if (
+        cacheado
+        and estado["cargado"] == ahora.date()
+        and cacheado[0] == estado["version"]
+        and cacheado[1] == (ahora.date(), ahora.hour)
+    ):
+        metrics.contar("proyeccion.hit")
+        return cacheado[2]
+
+    metrics.contar("proyeccion.miss")
+    with metrics.medir("proyeccion.calculo"):
+        version, calculado = _calcular(ahora)
+    estado["resultado"] = (version, (ahora.date(), ahora.hour), calculado)
+    return calculado
+
+# ---------------------------------------------------------------------------
+# Textos y job
+# ---------------------------------------------------------------------------
+
+def _textos_alertas(calculado):
+    """(clave, texto) de cada anomalía"""
+    from utils import formatear_monto
+
+    alertas = [
+        (clave, f"📉 Ventas de las {clave[2]:02d}h: ${formatear_monto(monto)} (lo normal: ${formatear_monto(media)})")
+        for clave, monto, media in calculado["horas"]
+    ]
+    alertas += [
+        (clave, f"💸 Pago a {proveedor}: ${formatear_monto(monto)} (lo normal: ${formatear_monto(media)})")
+        for clave, proveedor, monto, media in calculado["pagos"]
+    ]
+    return alertas
+
+def texto(ahora=None):
+    """Respuesta del botón de proyección"""
+    from utils import formatear_monto
+
+    calculado = resultado(ahora)
+    p = calculado["proyeccion"]
+    if p is None:
+        lineas = ["🔮 Todavía no hay una semana de movimientos para proyectar"]
+    else:
+        lineas = [
+            f"🔮 Proyección al {p['fin']:%d/%m}",
+            f"📥 ${formatear_monto(p['ingreso'])}",
+            f"📤 ${formatear_monto(p['egreso'])}",
+            f"💰 Saldo: ${formatear_monto(p['saldo'])} (± ${formatear_monto(p['desvio'])})",
+            f"📆 Hasta hoy: ${formatear_monto(p['real'])}"
+        ]
+
+    alertas = _textos_alertas(calculado)
+    if alertas:
+        lineas.append("⚠️ Fuera de lo normal hoy:")
+        lineas += [f"• {texto_alerta}" for _, texto_alerta in alertas]
+    return "\n".join(lineas)
+
+async def revisar(context):
+    """Job del JobQueue: recalcula cada sucursal y avisa las anomalías nuevas a los dueños"""
+    from db_async import en_hilo  # db_async -> services -> proyeccion
+
+    for tienda in tiendas.todas():
+        try:
+            with tiendas.usando(tienda):
+                estado = _estado()
+                nuevas = [
+                    (clave, texto_alerta)
+                    for clave, texto_alerta in _textos_alertas(await en_hilo(resultado))
+                    if clave not in estado["avisadas"]
+                ]
+                if not nuevas:
+                    continue
+                metrics.contar("proyeccion.alertas", len(nuevas))
+                mensaje = f"⚠️ {tienda}:\n" + "\n".join(t for _, t in nuevas)
+                for dueno in tiendas.duenos():
+                    try:
+                        await context.bot.send_message(dueno, mensaje)
+                    except Exception as e:
+                        print(f"❌ Error mandando alertas a {dueno}: {e}")
+                estado["avisadas"].update(clave for clave, _ in nuevas)
+        except Exception as e:
+            print(f"❌ Error revisando {tienda}: {e}")
+
+def programar(job_queue):
+    """Recalcula y revisa anomalías cada INTERVALO_ALERTAS segundos"""
+    job_queue.run_repeating(revisar, INTERVALO_ALERTAS, first=60, name="alertas")
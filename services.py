@@ -1,34 +1,99 @@
 from datetime import datetime
-from utils import es_numero, obtener_hoja_segura
+import analytics
+import cierre
+import ledger
+from db_sheet import encolar_pagos
+import pendientes
+import proyeccion
+from totales import EXCLUIR_ESTADO
 
 def obtener_egresos_pendientes():
-    hoja = obtener_hoja_segura()
-    datos = hoja.get_all_records()
-    pendientes = []
-
-    for i, fila in enumerate(datos, start=2):
-        if "Pagado" in fila and str(fila["Pagado"]).lower() == "true":
-            continue
-        if not fila.get("Proveedor") or not fila.get("Monto"):
-            continue
-        pendientes.append((i, fila["Proveedor"], abs(float(fila["Monto"]))))
-    return pendientes
-
-def marcar_como_pagado(fila_idx):
-    hoja = obtener_hoja_segura()
-    hoja.update_cell(fila_idx, 5, "'true")
-    fila = hoja.row_values(fila_idx)
-    return fila[2], abs(float(fila[3]))
+    return pendientes.todos()
+
+def marcar_como_pagado(id_mov):
+    pendiente = pendientes.obtener(id_mov)
+    if pendiente is None:
+        return None, None
+    encolar_pagos([id_mov])
+    return pendiente
+
+def pagar_proveedor(proveedor):
+    """Salda todo lo pendiente de un proveedor de una vez"""
+    items = pendientes.de_proveedor(proveedor)
+    encolar_pagos(items)
+    return len(items), sum(items.values())
 
 def calcular_total_diario(proveedor="cliente"):
-    hoja = obtener_hoja_segura()
-    datos = hoja.get_all_records()
+    hoy = datetime.now().strftime("%Y-%m-%d")
+    return ledger.total_dia(hoy, proveedor)
+
+def texto_consulta(clave):
+    """Respuesta de los botones de consultas, calculada con analytics"""
+    from utils import formatear_monto
+
     hoy = datetime.now().date()
 
-    return sum(
-        float(row["Monto"]) for row in datos
-        if "Fecha" in row and "Monto" in row and "Proveedor" in row
-        and row["Proveedor"] == proveedor
-        and es_numero(row["Monto"])
-        and datetime.strptime(row["Fecha"], "%Y-%m-%d").date() == hoy
-    )
\ No newline at end of file
+    # Día y mes salen del ledger por índice y del último cierre, sin armar el frame
+    if clave in ("ingreso_hoy", "egreso_hoy"):
+        ingreso, egreso, _ = ledger.totales_caja(hoy.isoformat(), hoy.isoformat(), EXCLUIR_ESTADO)
+        if clave == "ingreso_hoy":
+            return f"📥 Ingreso hoy: ${formatear_monto(ingreso)}"
+        return f"📤 Egreso hoy: ${formatear_monto(egreso)}"
+
+    if clave in ("ingreso_mes", "egreso_mes", "saldo_mes"):
+        t = cierre.mes_a_la_fecha(hoy)
+        if clave == "ingreso_mes":
+            return f"📆 Ingreso mes: ${formatear_monto(t['ingreso'])}"
+        if clave == "egreso_mes":
+            return f"📉 Egreso mes: ${formatear_monto(t['egreso'])}"
+        return (
+            f"📥 ${formatear_monto(t['ingreso'])}\n"
+            f"📤 ${formatear_monto(t['egreso'])}\n"
+            f"💰 Saldo mes: ${formatear_monto(t['saldo'])}"
+        )
+
+    # Sale del último cálculo del job (series en memoria), sin tocar el ledger
+    if clave == "proyeccion":
+        return proyeccion.texto()
+
+    df = analytics.frame()
+
+    if clave == "proveedores_mes":
+        serie = analytics.por_proveedor(df)
+        if serie.empty:
+            return "🏷️ Sin pagos a proveedores este mes"
+        lineas = [f"• {prov}: ${formatear_monto(monto)}" for prov, monto in serie.items()]
+        return "🏷️ Pagos del mes por proveedor:\n" + "\n".join(lineas)
+
+    if clave == "horas_mes":
+        tabla = analytics.por_hora(df)
+        if tabla.empty:
+            return "🕐 Sin ventas este mes"
+        lineas = [
+            f"{hora:02d}h: ${formatear_monto(fila['sum'])} ({int(fila['count'])})"
+            for hora, fila in tabla.iterrows()
+        ]
+        return "🕐 Ventas del mes por hora:\n" + "\n".join(lineas)
+
+    if clave == "ultimos_12":
+        tabla = analytics.ultimos_12_meses()
+        if tabla.empty:
+            return "📈 Sin movimientos en los últimos 12 meses"
+        lineas = [
+            f"{periodo}: 📥 ${formatear_monto(fila['ingreso'])} 📤 ${formatear_monto(fila['egreso'])} "
+            f"💰 ${formatear_monto(fila['saldo'])}"
+            for periodo, fila in tabla.iterrows()
+        ]
+        return "📈 Últimos 12 meses:\n" + "\n".join(lineas)
+
+    if clave == "interanual":
+        actual, anterior, variacion = analytics.interanual()
+        lineas = []
+        for campo, nombre in (("ingreso", "📥 Ingreso"), ("egreso", "📤 Egreso"), ("saldo", "💰 Saldo")):
+            cambio = "—" if variacion[campo] is None else f"{variacion[campo]:+.1f}%"
+            lineas.append(
+                f"{nombre}: ${formatear_monto(actual[campo])} vs ${formatear_monto(anterior[campo])} ({cambio})"
+            )
+        return "🔁 Este mes vs el mismo tramo del año pasado:\n" + "\n".join(lineas)
+
+    return "⚠️ Consulta desconocida"
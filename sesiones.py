@@ -0,0 +1,86 @@
+import os
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Sesiones (chat, cajero) en memoria; las menos usadas se descartan primero
+MAXIMO_SESIONES = int(os.getenv("SESIONES_MAXIMO", "500"))
+TTL_SESION = 12 * 3600
+
+# Menús abiertos que recuerda cada cajero (mensaje -> operación a convertir)
+MENUS_POR_SESION = 16
+
+# Marca de un menú ya usado: otro toque no convierte otra venta
+USADO = 0
+
+class Sesion:
+    """
+    Lo de un cajero en un chat: su última carga y los menús de
+    proveedor/gasto que abrió, cada uno con el id de la venta que convierte.
+    """
+    __slots__ = ("ultimo_id", "ultimo_monto", "menus", "uso")
+
+    def __init__(self):
+        self.ultimo_id = None
+        self.ultimo_monto = None
+        self.menus = OrderedDict()
+        self.uso = time.time()
+
+    def abrir_menu(self, mensaje_id, id_mov):
+        self.menus[mensaje_id] = id_mov
+        self.menus.move_to_end(mensaje_id)
+        while len(self.menus) > MENUS_POR_SESION:
+            self.menus.popitem(last=False)
+
+# (chat, usuario) -> Sesion, en orden de uso. Sin awaits adentro: atómico para el event loop
+_sesiones = OrderedDict()
+
+def _purgar(ahora):
+    while _sesiones:
+        sesion = next(iter(_sesiones.values()))
+        if sesion.uso > ahora - TTL_SESION and len(_sesiones) <= MAXIMO_SESIONES:
+            break
+        _sesiones.popitem(last=False)
+        metrics.contar("sesiones.descartadas")
+
+def de(chat_id, usuario_id):
+    """La sesión del cajero (se crea si no hay)"""
+    ahora = time.time()
+    clave = (chat_id, usuario_id)
+    sesion = _sesiones.get(clave)
+    if sesion is None:
+        sesion = _sesiones[clave] = Sesion()
+    sesion.uso = ahora
+    _sesiones.move_to_end(clave)
+    _purgar(ahora)
+    return sesion
+
+def existe(chat_id, usuario_id):
+    return (chat_id, usuario_id) in _sesiones
+
+def registrar(chat_id, usuario_id, id_mov, monto):
+    sesion = de(chat_id, usuario_id)
+    sesion.ultimo_id = id_mov
+    sesion.ultimo_monto = monto
+
+def abrir_menu(chat_id, usuario_id, mensaje_id, id_mov):
+    de(chat_id, usuario_id).abrir_menu(mensaje_id, id_mov)
+
+def tomar_menu(chat_id, usuario_id, mensaje_id):
+    """
+    Id de la venta que convierte el menú del mensaje, y lo marca usado:
+    None si no se conoce, USADO si ya se convirtió. Si lo abrió otro
+    cajero del mismo chat, se busca en su sesión.
+    """
+    propia = de(chat_id, usuario_id)
+    candidatas = [propia] + [
+        sesion for (chat, usuario), sesion in _sesiones.items()
+        if chat == chat_id and usuario != usuario_id
+    ]
+    for sesion in candidatas:
+        if mensaje_id in sesion.menus:
+            id_mov = sesion.menus[mensaje_id]
+            sesion.menus[mensaje_id] = USADO
+            return id_mov
+    return None
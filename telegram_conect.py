@@ -1,3 +1,6 @@
+import functools
+import hashlib
+
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 
 proveedores = [
@@ -19,30 +22,132 @@ proveedores = [
     "Otro"
 ]
 
+# callback_data compacto (Telegram admite hasta 64 bytes): "<acción>:<args>",
+# el proveedor por su índice en `proveedores` y el monto en centavos, base 36.
+# Los botones viejos (nombre y monto con punto) se siguen entendiendo.
+LIMITE_CALLBACK = 64
+
+def codificar_monto(monto):
+    centavos = round(abs(float(monto)) * 100)
+    digitos = ""
+    while True:
+        centavos, resto = divmod(centavos, 36)
+        digitos = "0123456789abcdefghijklmnopqrstuvwxyz"[resto] + digitos
+        if not centavos:
+            return digitos
+
+def decodificar_monto(texto):
+    if "." in texto:  # Formato viejo: el float tal cual
+        return float(texto)
+    return int(texto, 36) / 100
+
+_indice_proveedor = {nombre: str(i) for i, nombre in enumerate(proveedores)}
+
+# Proveedores fuera de la lista (de la hoja o de un CSV): "~" + hash corto del
+# nombre, estable entre reinicios. token -> nombre de los que ya se codificaron
+_por_token = {}
+
+def _token_proveedor(nombre):
+    return "~" + hashlib.blake2s(nombre.encode(), digest_size=6).hexdigest()
+
+def codificar_proveedor(nombre):
+    """Índice si es de la lista; si no, un token corto (el nombre puede pasar los 64 bytes)"""
+    if nombre in _indice_proveedor:
+        return _indice_proveedor[nombre]
+    token = _token_proveedor(nombre)
+    _por_token[token] = nombre
+    return token
+
+def decodificar_proveedor(texto, conocidos=()):
+    """
+    Nombre del proveedor del botón; None si es un token que no se conoce.
+    `conocidos`: nombres candidatos para tokens de antes de un reinicio.
+    """
+    if texto.isdigit() and int(texto) < len(proveedores):
+        return proveedores[int(texto)]
+    if texto.startswith("~"):
+        if texto not in _por_token:
+            for nombre in conocidos:
+                codificar_proveedor(nombre)
+        return _por_token.get(texto)
+    return texto
+
+def _dato(texto):
+    if len(texto.encode()) > LIMITE_CALLBACK:
+        raise ValueError(f"callback_data de más de {LIMITE_CALLBACK} bytes: {texto!r}")
+    return texto
+
+@functools.lru_cache(maxsize=256)
+def _teclado_proveedores(token):
+    # 🔹 Una fila por proveedor: (Proveedor | A pagar)
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(proveedor, callback_data=f"v:{i}:{token}"),
+            InlineKeyboardButton("⏳ A pagar", callback_data=f"a:{i}:{token}")
+        ]
+        for i, proveedor in enumerate(proveedores)
+    ])
+
 def teclado_proveedores(monto):
-    botones = []
-    fila_temp = []
-
-    # 🔹 Armar botones de proveedores en pares
-    for proveedor in proveedores:
-        fila_temp.append(
-            InlineKeyboardButton(proveedor, callback_data=f"proveedor:{proveedor}:{monto}")
-        )
-        fila_temp.append(
-            InlineKeyboardButton("⏳ A pagar", callback_data=f"apagar:{proveedor}:{monto}")
-        )
-
-        # Cuando ya hay 2 (Proveedor | Pagar), agregamos la fila
-        botones.append(fila_temp)
-        fila_temp = []
-        
-    return InlineKeyboardMarkup(botones)
+    """Cacheado por monto (los teclados de telegram son inmutables)"""
+    return _teclado_proveedores(codificar_monto(monto))
+
+@functools.lru_cache(maxsize=256)
+def _teclado_gasto(token):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🍻 Nosotros", callback_data=f"N:{token}")],
+        [InlineKeyboardButton("🧀 Mercadería", callback_data=f"M:{token}")],
+        [InlineKeyboardButton("🗑️ Desperdicio", callback_data=f"D:{token}")],
+        [InlineKeyboardButton("📦 Corrección", callback_data=f"C:{token}")]
+    ])
+
+def teclado_gasto(monto):
+    return _teclado_gasto(codificar_monto(monto))
+
+def teclado_correccion(monto):
+    token = codificar_monto(monto)
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("Sobra", callback_data=f"S:{token}"),
+        InlineKeyboardButton("Falta", callback_data=f"F:{token}")
+    ]])
+
+def teclado_eliminar(id_mov):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🗑️ Eliminar", callback_data=f"e:{id_mov}")]])
 
+def teclado_ingreso(monto, id_mov):
+    """Cada botón lleva el id de la venta: la conversión y el borrado van a esa fila"""
+    token = codificar_monto(monto)
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("📤 Proveedor", callback_data=f"p:{token}:{id_mov}"),
+            InlineKeyboardButton("💸 Gasto", callback_data=f"g:{token}:{id_mov}")
+        ],
+        [
+            InlineKeyboardButton("🗑️ Eliminar", callback_data=f"e:{id_mov}")
+        ]
+    ])
 
+@functools.lru_cache(maxsize=1)
 def mostrar_consultas():                              
     botones = [
-        [InlineKeyboardButton("📥 Ingreso hoy", callback_data="consulta:ingreso_hoy")],                             [InlineKeyboardButton("📤 Egreso hoy", callback_data="consulta:egreso_hoy")],
-        [InlineKeyboardButton("📆 Ingreso mes", callback_data="consulta:ingreso_mes")],                             [InlineKeyboardButton("📉 Egreso mes", callback_data="consulta:egreso_mes")],
-        [InlineKeyboardButton("💰 Saldo mes", callback_data="consulta:saldo_mes")],                                 [InlineKeyboardButton("💸 Pagar", callback_data="menu:pagar")]  # 👈 NUEVO
+        [InlineKeyboardButton("📥 Ingreso hoy", callback_data="q:ingreso_hoy")],                             [InlineKeyboardButton("📤 Egreso hoy", callback_data="q:egreso_hoy")],
+        [InlineKeyboardButton("📆 Ingreso mes", callback_data="q:ingreso_mes")],                             [InlineKeyboardButton("📉 Egreso mes", callback_data="q:egreso_mes")],
+        [InlineKeyboardButton("💰 Saldo mes", callback_data="q:saldo_mes")],                                 [InlineKeyboardButton("💸 Pagar", callback_data="m:pagar")],  # 👈 NUEVO
+        [InlineKeyboardButton("🏷️ Por proveedor", callback_data="q:proveedores_mes")],                     [InlineKeyboardButton("🕐 Por hora", callback_data="q:horas_mes")],
+        [InlineKeyboardButton("📈 Últimos 12 meses", callback_data="q:ultimos_12")],                        [InlineKeyboardButton("🔁 Interanual", callback_data="q:interanual")],
+        [InlineKeyboardButton("🔮 Proyección", callback_data="q:proyeccion")]
  ]
-    return InlineKeyboardMarkup(botones)
\ No newline at end of file
+    return InlineKeyboardMarkup(botones)
+
+def teclado_pagos(resumen):
+    """Un botón por proveedor con deuda: salda todo lo pendiente de ese proveedor"""
+    from utils import formatear_monto
+
+    botones = [
+        [InlineKeyboardButton(
+            f"✅ {proveedor} ({cantidad}) ${formatear_monto(total)}",
+            callback_data=_dato(f"x:{codificar_proveedor(proveedor)}")
+        )]
+        for proveedor, (cantidad, total) in resumen.items()
+    ]
+    return InlineKeyboardMarkup(botones)
@@ -0,0 +1,80 @@
+import contextvars
+import functools
+import json
+import os
+from contextlib import contextmanager
+
+# Sucursales: {"nombre": {"planilla": "Registro_...", "chats": [chat_id, ...], "duenos": [user_id, ...]}}
+# Sin archivo hay una sola, la principal, y todos los chats van a ella
+TIENDAS_PATH = os.getenv("TIENDAS_PATH", "tiendas.json")
+PRINCIPAL = "principal"
+
+def _leer_config():
+    try:
+        with open(TIENDAS_PATH, encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        config = {}
+
+    config.setdefault(PRINCIPAL, {})
+    for nombre, datos in config.items():
+        datos.setdefault(
+            "planilla",
+            "Registro_Movimientos" if nombre == PRINCIPAL else f"Registro_Movimientos_{nombre}"
+        )
+    return config
+
+_config = _leer_config()
+_por_chat = {
+    int(chat): nombre
+    for nombre, datos in _config.items()
+    for chat in datos.get("chats", [])
+}
+
+# Sucursal del update que se está atendiendo (cada update corre en su tarea)
+_actual = contextvars.ContextVar("tienda", default=PRINCIPAL)
+
+def todas():
+    return list(_config)
+
+def de_chat(chat_id):
+    """Los chats que no figuran en la configuración usan la principal"""
+    return _por_chat.get(chat_id, PRINCIPAL)
+
+def actual():
+    return _actual.get()
+
+def planilla(tienda=None):
+    return _config[tienda or actual()]["planilla"]
+
+def duenos(tienda=None):
+    """A quién se le manda el cierre diario: los "duenos" de la sucursal, o ADMIN_IDS"""
+    ids = _config[tienda or actual()].get("duenos")
+    if ids is None:
+        ids = [i.strip() for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()]
+    return [int(i) for i in ids]
+
+def ruta(base, tienda=None):
+    """logs/ledger.db -> logs/<tienda>/ledger.db (la principal queda como estaba)"""
+    tienda = tienda or actual()
+    if tienda == PRINCIPAL:
+        return base
+    carpeta, nombre = os.path.split(base)
+    return os.path.join(carpeta, tienda, nombre)
+
+@contextmanager
+def usando(tienda):
+    token = _actual.set(tienda)
+    try:
+        yield
+    finally:
+        _actual.reset(token)
+
+def por_chat(handler):
+    """Decorador de handlers: todo lo que corre adentro usa la sucursal del chat"""
+    @functools.wraps(handler)
+    async def envoltura(update, context):
+        chat = update.effective_chat
+        with usando(de_chat(chat.id) if chat else PRINCIPAL):
+            return await handler(update, context)
+    return envoltura
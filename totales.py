@@ -0,0 +1,72 @@
+from collections import defaultdict
+from datetime import date
+
+import tiendas
+
+# Movimientos que no cuentan para el estado de caja
+EXCLUIR_ESTADO = {"Mercadería", "Desperdicio", "Mercaderia"}
+
+# tienda -> totales del mes en cache de esa sucursal
+_por_tienda = {}
+
+def _nuevos_totales(mes=None):
+    return {
+        "mes": mes,
+        "por_dia": defaultdict(float),        # date -> ingresos de clientes
+        "por_proveedor": defaultdict(float),  # proveedor -> suma del mes
+        "estado": 0.0
+    }
+
+def _totales():
+    tienda = tiendas.actual()
+    if tienda not in _por_tienda:
+        _por_tienda[tienda] = _nuevos_totales()
+    return _por_tienda[tienda]
+
+def _aplicar(registro, signo):
+    """Suma (signo=1) o resta (signo=-1) un registro, O(1)"""
+    try:
+        monto = float(registro.get("Monto", "")) * signo
+    except (TypeError, ValueError):
+        return
+
+    totales = _totales()
+    fecha = registro.get("Fecha")
+    if str(fecha)[:7] != totales["mes"]:
+        return
+
+    proveedor = registro.get("Proveedor", "")
+    totales["por_proveedor"][proveedor] += monto
+
+    if proveedor == "cliente":
+        totales["por_dia"][fecha] += monto
+
+    if proveedor not in EXCLUIR_ESTADO:
+        totales["estado"] += monto
+
+def reconstruir(datos, mes):
+    """Recalcula todo desde cero (solo cuando se recarga el cache)"""
+    _por_tienda[tiendas.actual()] = _nuevos_totales(mes)
+
+    for registro in datos:
+        _aplicar(registro, 1)
+
+def sumar(registro):
+    _aplicar(registro, 1)
+
+def restar(registro):
+    _aplicar(registro, -1)
+
+def mes():
+    return _totales()["mes"]
+
+def total_dia(fecha=None):
+    """Ingresos de clientes del día (hoy por defecto)"""
+    fecha = fecha or date.today()
+    return _totales()["por_dia"].get(fecha, 0.0)
+
+def total_estado():
+    return _totales()["estado"]
+
+def por_proveedor():
+    return dict(_totales()["por_proveedor"])
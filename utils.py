@@ -1,4 +1,3 @@
-import time
 from db_sheet import obtener_hoja_mes
 
 def formatear_monto(monto):
@@ -11,11 +10,6 @@ def es_numero(valor):
     except:
         return False
 
-def obtener_hoja_segura(reintentos=3, espera=2):
-    """Obtiene la hoja de cálculo con reintentos si falla."""
-    for i in range(reintentos):
-        try:
-            return obtener_hoja_mes()
-        except Exception as e:
-            time.sleep(espera)
-    raise Exception("No se pudo obtener la hoja después de varios intentos.")
\ No newline at end of file
+def obtener_hoja_segura():
+    """Obtiene la hoja del mes; los reintentos con backoff los hace cuota.llamar"""
+    return obtener_hoja_mes()